@@ -0,0 +1,239 @@
+"""
+音频时长探测模块
+直接读取WAV(RIFF)和MP3的文件头计算时长，无需启动ffmpeg解码；
+无法识别的格式才调用ffprobe，结果按路径和修改时间缓存
+"""
+import os
+import re
+import shutil
+import struct
+import subprocess
+import threading
+
+# MPEG音频帧头中的比特率表（kbps），按 (版本, 层) 索引；版本1为MPEG-1，2为MPEG-2/2.5
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# 采样率表，按帧头中的版本位索引：0为MPEG-2.5，2为MPEG-2，3为MPEG-1
+_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _parse_mp3_frame_header(data, pos):
+    """
+    解析pos处的MPEG音频帧头
+    
+    返回:
+        dict: 包含 version_bits, layer, sample_rate, samples, length, mono 字段，不是有效帧头时返回None
+    """
+    if pos + 4 > len(data):
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    
+    version = 1 if version_bits == 3 else 2
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+    
+    return {
+        'version_bits': version_bits,
+        'layer': layer,
+        'sample_rate': sample_rate,
+        'samples': samples,
+        'length': length,
+        'mono': ((b3 >> 6) & 0x03) == 3,
+    }
+
+
+def _skip_id3v2(data):
+    """返回ID3v2标签之后的偏移量"""
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def _probe_mp3(data):
+    """
+    计算MP3时长：优先读取首帧中的Xing/Info或VBRI头，没有时逐帧累加采样数
+    
+    返回:
+        float: 时长（秒），无法解析时返回None
+    """
+    pos = _skip_id3v2(data)
+    
+    # 定位第一个有效帧（要求下一帧紧随其后，避免把数据中的偶然同步字当成帧头）
+    first = None
+    limit = min(len(data), pos + 64 * 1024)
+    while pos < limit:
+        header = _parse_mp3_frame_header(data, pos)
+        if header and header['length'] > 0:
+            following = pos + header['length']
+            if following >= len(data) or _parse_mp3_frame_header(data, following):
+                first = header
+                break
+        pos += 1
+    if first is None:
+        return None
+    
+    # Xing/Info头位于side information之后
+    if first['version_bits'] == 3:
+        side_info = 17 if first['mono'] else 32
+    else:
+        side_info = 9 if first['mono'] else 17
+    xing_pos = pos + 4 + side_info
+    tag = data[xing_pos:xing_pos + 4]
+    if tag in (b'Xing', b'Info') and len(data) >= xing_pos + 12:
+        flags = struct.unpack('>I', data[xing_pos + 4:xing_pos + 8])[0]
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[xing_pos + 8:xing_pos + 12])[0]
+            if frames:
+                return frames * first['samples'] / first['sample_rate']
+    
+    # VBRI头固定位于帧头之后32字节
+    vbri_pos = pos + 4 + 32
+    if data[vbri_pos:vbri_pos + 4] == b'VBRI' and len(data) >= vbri_pos + 18:
+        frames = struct.unpack('>I', data[vbri_pos + 14:vbri_pos + 18])[0]
+        if frames:
+            return frames * first['samples'] / first['sample_rate']
+    
+    # 逐帧扫描
+    samples = 0
+    sample_rate = first['sample_rate']
+    while True:
+        header = _parse_mp3_frame_header(data, pos)
+        if header is None or header['length'] <= 0:
+            break
+        samples += header['samples']
+        pos += header['length']
+    return samples / sample_rate if samples else None
+
+
+def _probe_wav(data):
+    """
+    根据RIFF/WAVE头计算时长
+    
+    返回:
+        float: 时长（秒），无法解析时返回None
+    """
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    
+    pos = 12
+    byte_rate = None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b'fmt ' and chunk_size >= 16:
+            byte_rate = struct.unpack('<I', data[body + 8:body + 12])[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # 流式写入的WAV可能没有回填data长度
+            available = len(data) - body
+            if chunk_size == 0 or chunk_size == 0xFFFFFFFF or chunk_size > available:
+                chunk_size = available
+            return chunk_size / byte_rate
+        pos = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _probe_with_ffmpeg(audio_file):
+    """
+    使用ffprobe获取时长；没有ffprobe时使用MoviePy自带的ffmpeg读取Duration
+    
+    返回:
+        float: 时长（秒），失败时返回None
+    """
+    ffprobe = shutil.which('ffprobe')
+    try:
+        if ffprobe:
+            output = subprocess.run(
+                [ffprobe, '-v', 'error', '-show_entries', 'format=duration',
+                 '-of', 'default=noprint_wrappers=1:nokey=1', audio_file],
+                capture_output=True, text=True, timeout=30
+            ).stdout.strip()
+            return float(output) if output else None
+        
+        import imageio_ffmpeg
+        output = subprocess.run(
+            [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-i', audio_file],
+            capture_output=True, text=True, timeout=30
+        ).stderr
+        match = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', output)
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (OSError, ValueError, subprocess.SubprocessError, ImportError):
+        pass
+    return None
+
+
+def probe_duration(audio_file):
+    """
+    获取音频文件时长
+    
+    按文件内容（而不是扩展名）识别WAV和MP3并直接解析文件头，其他格式调用ffprobe。
+    结果按 (路径, 修改时间, 文件大小) 缓存，文件未变化时不会重复读取。
+    
+    参数:
+        audio_file: 音频文件路径
+    
+    返回:
+        float: 时长（秒），无法获取时返回None
+    """
+    path = os.path.abspath(audio_file)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    if data[:4] == b'RIFF':
+        duration = _probe_wav(data)
+    else:
+        duration = _probe_mp3(data)
+    if duration is None:
+        duration = _probe_with_ffmpeg(path)
+    
+    with _cache_lock:
+        _cache[path] = (signature, duration)
+    return duration
@@ -0,0 +1,224 @@
+"""
+批量运行入口
+一次生成多个项目的视频：所有项目共享各服务商的客户端和全局并发上限，
+一个项目渲染视频的同时，后续项目继续调用API生成素材
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import Config
+from encoding_profiles import ENCODING_PROFILES, load_calibration, select_profile
+from main import STAGE_PROVIDERS, STAGES, ProjectClients, prepare_project, render_project, select_stages
+from pipeline import ProviderLimits
+import metrics
+
+
+def collect_input_files(path):
+    """
+    收集批量运行的输入配置文件
+    
+    参数:
+        path: 输入配置所在目录（其中所有.json文件），或清单文件。
+              清单可以是每行一个路径的文本文件（忽略空行和#开头的行），也可以是路径组成的JSON数组，
+              相对路径以清单所在目录为基准
+    
+    返回:
+        list: 输入配置文件路径列表
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.json')))
+    
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    try:
+        entries = json.loads(content)
+    except ValueError:
+        entries = None
+    if isinstance(entries, dict):
+        # 单个输入配置文件
+        return [path]
+    if not isinstance(entries, list):
+        entries = [
+            line.strip() for line in content.splitlines()
+            if line.strip() and not line.strip().startswith('#')
+        ]
+    return [os.path.join(base_dir, entry) for entry in entries]
+
+
+def find_duplicate_projects(json_file_paths):
+    """
+    找出与前面的项目重名的输入配置
+    
+    项目的临时目录、状态库和输出文件都按name命名，重名的项目会互相覆盖，只保留第一个。
+    无法加载的输入配置不在这里检查，之后生成素材时会报告错误。
+    
+    参数:
+        json_file_paths: 输入配置文件路径列表
+    
+    返回:
+        dict: 重名的输入配置文件路径到错误信息的字典
+    """
+    seen = {}
+    duplicates = {}
+    for path in json_file_paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                name = json.load(f).get('name')
+        except Exception:
+            continue
+        if name is None:
+            continue
+        key = os.path.normcase(os.path.normpath(str(name)))
+        if key in seen:
+            duplicates[path] = f"项目名称 {name} 与 {seen[key]} 重复"
+        else:
+            seen[key] = path
+    return duplicates
+
+
+def run_batch(json_file_paths, use_cache=True, project_workers=None, stages=STAGES, encoding_profile=None,
+              target_bitrate=None):
+    """
+    批量生成视频
+    
+    最多 project_workers 个项目同时生成素材，对各服务商的并发请求数合计不超过配置的上限；
+    素材生成完成的项目按完成顺序依次渲染，渲染期间其他项目的素材生成不受影响。
+    
+    参数:
+        json_file_paths: 输入配置文件路径列表
+        use_cache: 是否使用缓存
+        project_workers: 同时生成素材的项目数，默认为配置中的BATCH_PROJECT_WORKERS
+        stages: 要执行的阶段，默认为全部阶段
+        encoding_profile: 编码配置名称，指定时不再按目标码率选择
+        target_bitrate: 目标码率上限（kbps），默认为配置中的BATCH_TARGET_BITRATE；大于0时按各项目的视频尺寸
+                        在校准结果中选择码率不超过目标的最快编码配置。输入配置中的encoding_profile优先
+    
+    返回:
+        dict: 输入配置文件路径到输出视频路径的字典，失败或与前面的项目重名的项目为None
+    """
+    if project_workers is None:
+        project_workers = Config.BATCH_PROJECT_WORKERS
+    project_workers = max(1, project_workers)
+    if target_bitrate is None:
+        target_bitrate = Config.BATCH_TARGET_BITRATE
+    calibration = None
+    if encoding_profile is None and target_bitrate > 0:
+        calibration = load_calibration()
+        if not calibration:
+            print("[批量] 没有编码校准结果，请先运行 python encoding_profiles.py；使用默认编码配置")
+    
+    clients = ProjectClients(use_cache=use_cache)
+    limits = ProviderLimits.from_config()
+    # 同一个输入配置只运行一次
+    json_file_paths = list(dict.fromkeys(json_file_paths))
+    outputs = {path: None for path in json_file_paths}
+    
+    duplicates = find_duplicate_projects(json_file_paths)
+    for path, message in duplicates.items():
+        print(f"[批量] 项目 {path} 已跳过: {message}")
+        metrics.inc('projects_total', result='error')
+    json_file_paths = [path for path in json_file_paths if path not in duplicates]
+    
+    def prepare(path):
+        try:
+            return prepare_project(path, clients, limits=limits, stages=stages)
+        except Exception as e:
+            print(f"[批量] 项目 {path} 生成素材失败: {e}")
+            return None
+    
+    def choose_profile(project):
+        if encoding_profile is not None or not calibration:
+            return encoding_profile
+        video_size = project['config']['video_size']
+        if not isinstance(video_size, list):
+            video_size = [1080, 1920]
+        profile = select_profile(target_bitrate, video_size, calibration)
+        if profile is None:
+            print(f"[批量] 没有 {video_size[0]}x{video_size[1]} 的编码校准结果，使用默认编码配置")
+        return profile
+    
+    def render(path, project):
+        try:
+            outputs[path] = render_project(project, use_cache=use_cache, encoding_profile=choose_profile(project))
+        except Exception as e:
+            print(f"[批量] 项目 {path} 渲染失败: {e}")
+        metrics.inc('projects_total', result='ok' if outputs[path] else 'error')
+    
+    try:
+        # 渲染本身已按CPU核数并行，同一时间只渲染一个项目
+        with ThreadPoolExecutor(max_workers=1) as render_executor:
+            with ThreadPoolExecutor(max_workers=project_workers) as prepare_executor:
+                futures = {prepare_executor.submit(prepare, path): path for path in json_file_paths}
+                for future in as_completed(futures):
+                    project = future.result()
+                    if project is None:
+                        continue
+                    if 'render' in stages:
+                        render_executor.submit(render, futures[future], project)
+                    else:
+                        outputs[futures[future]] = project['output_json_path']
+    finally:
+        clients.close()
+        # 指标在整个批次内累计
+        metrics.write_summary(metrics.summary_path('temp', 'batch_metrics'))
+    
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量自动化生成视频")
+    parser.add_argument("path", help="输入配置所在目录，或每行一个输入配置路径的清单文件")
+    parser.add_argument("--no-cache", action="store_true", help="不使用缓存，重新请求模型、生成图片和语音")
+    parser.add_argument("--workers", type=int, default=None, help="同时生成素材的项目数，默认为BATCH_PROJECT_WORKERS")
+    parser.add_argument("--stages", default=None,
+                        help=f"只执行这些阶段（逗号分隔），可选: {','.join(STAGES)}；各阶段只补齐缺少的内容")
+    parser.add_argument("--from-stage", default=None, choices=STAGES, help="从该阶段开始执行之后的全部阶段")
+    parser.add_argument("--encoding-profile", default=None, choices=list(ENCODING_PROFILES),
+                        help="所有项目使用的编码配置，指定时不再按目标码率选择")
+    parser.add_argument("--target-bitrate", type=int, default=None,
+                        help="目标码率上限（kbps），按校准结果选择满足该码率的最快编码配置，默认为BATCH_TARGET_BITRATE")
+    args = parser.parse_args()
+    
+    try:
+        stages = select_stages(args.stages, args.from_stage)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if not os.path.exists(args.path):
+        print(f"[错误] 文件不存在: {args.path}")
+        sys.exit(1)
+    
+    try:
+        Config.validate({STAGE_PROVIDERS[stage] for stage in stages if stage in STAGE_PROVIDERS})
+        print("[配置] 配置验证通过")
+    except ValueError as e:
+        print(f"[错误] {e}")
+        sys.exit(1)
+    
+    json_file_paths = collect_input_files(args.path)
+    if not json_file_paths:
+        print(f"[错误] 没有找到输入配置文件: {args.path}")
+        sys.exit(1)
+    print(f"[批量] 共 {len(json_file_paths)} 个项目")
+    
+    outputs = run_batch(
+        json_file_paths, use_cache=not args.no_cache, project_workers=args.workers, stages=stages,
+        encoding_profile=args.encoding_profile, target_bitrate=args.target_bitrate
+    )
+    
+    print("\n" + "=" * 60)
+    print("批量生成完成")
+    print("=" * 60)
+    for path, output_file in outputs.items():
+        if output_file:
+            print(f"✅ {path} -> {output_file}")
+        else:
+            print(f"❌ {path}")
+    failed = sum(1 for output_file in outputs.values() if not output_file)
+    print(f"\n成功 {len(outputs) - failed} 个，失败 {failed} 个")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,532 @@
+"""
+离线基准测试
+在本地启动DeepSeek（OpenAI兼容）聊天接口、火山引擎图片接口和图片文件服务的替身，并注册语音合成服务商的替身代替Azure和DashScope，
+以合成的输入驱动 main()，报告各阶段耗时、吞吐量和峰值内存，不消耗任何API额度
+
+用法:
+    python benchmark.py --segments 5 50 500
+    python benchmark.py --segments 50 --image-latency 2 --image-error-rate 0.1 --output result.json
+    python benchmark.py --segments 50 --baseline result.json
+    python benchmark.py --segments 50 --tts-latency 3 --tts-error-rate 0.2 --tts-backup-latency 0.5
+"""
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 各阶段在报告中的名称，按执行顺序排列
+STAGES = [
+    ('script', '脚本'),
+    ('assets', '素材'),
+    ('render', '渲染'),
+]
+
+# 查找测试用中文字体的位置
+FONT_PATTERNS = [
+    './resource/*.ttf',
+    '/usr/share/fonts/**/*.ttc',
+    '/usr/share/fonts/**/*.ttf',
+    '/System/Library/Fonts/*.ttc',
+    'C:/Windows/Fonts/*.ttc',
+]
+
+
+class FakeProviderServer:
+    """
+    DeepSeek聊天接口、火山引擎图片接口和图片文件服务的本地替身
+    
+    按请求内容返回格式正确的脚本、批量提示词和单段提示词；每个请求先等待随机化的延迟，
+    再按错误率随机返回429（带Retry-After）或503，用于观察限流重试的开销。
+    """
+    
+    def __init__(self, chat_latency=0.5, chat_error_rate=0.0, image_latency=1.0, image_error_rate=0.0):
+        """
+        初始化替身服务
+        
+        参数:
+            chat_latency: 聊天接口的平均延迟（秒），实际延迟在其50%-150%之间
+            chat_error_rate: 聊天接口返回错误的概率
+            image_latency: 图片接口的平均延迟（秒）
+            image_error_rate: 图片接口返回错误的概率
+        """
+        self.chat_latency = chat_latency
+        self.chat_error_rate = chat_error_rate
+        self.image_latency = image_latency
+        self.image_error_rate = image_error_rate
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._images = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+    
+    @property
+    def base_url(self):
+        """替身服务的根地址"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        """在后台线程中启动服务"""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+    
+    def _image_bytes(self, size):
+        """生成（并缓存）指定尺寸的JPEG图片"""
+        with self._lock:
+            data = self._images.get(size)
+        if data is None:
+            from PIL import Image
+            width, height = (int(n) for n in size.split('x'))
+            image = Image.new('RGB', (width, height), (random.randint(0, 255), 96, 160))
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=90)
+            data = buffer.getvalue()
+            with self._lock:
+                self._images[size] = data
+        return data
+    
+    def _chat_content(self, prompt):
+        """按提示词的类型生成模型回复"""
+        match = re.search(r'生成一个包含(\d+)段内容的视频脚本', prompt)
+        if match:
+            return json.dumps([
+                {"title": f"第{n}段标题", "subtitle": f"这是第{n}段的字幕内容，用于测试语音合成和视频渲染的速度。"}
+                for n in range(1, int(match.group(1)) + 1)
+            ], ensure_ascii=False)
+        match = re.search(r'请为以下(\d+)段视频内容分别生成', prompt)
+        if match:
+            return json.dumps([
+                {"index": n, "prompt": f"测试画面{n}，明亮的城市街景，电影感光线，高清细节"}
+                for n in range(1, int(match.group(1)) + 1)
+            ], ensure_ascii=False)
+        return "测试画面，明亮的城市街景，电影感光线，高清细节"
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _send(self, status, body, content_type='application/json', headers=None):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def _simulate(self, name, latency, error_rate):
+                """模拟延迟和错误，返回True表示已发送错误响应"""
+                server._count(f"{name}_requests")
+                time.sleep(random.uniform(0.5, 1.5) * latency)
+                if random.random() < error_rate:
+                    server._count(f"{name}_errors")
+                    if random.random() < 0.5:
+                        self._send(429, {"error": {"message": "rate limited"}}, headers={'Retry-After': '0.2'})
+                    else:
+                        self._send(503, {"error": {"message": "service unavailable"}})
+                    return True
+                return False
+            
+            def _stream_chat(self, body, content):
+                """以SSE格式逐片发送回复"""
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                pieces = [content[start:start + 20] for start in range(0, len(content), 20)]
+                delay = server.chat_latency * 0.8 / max(1, len(pieces))
+                for n, piece in enumerate(pieces + [None]):
+                    chunk = {
+                        "id": "chatcmpl-benchmark",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get('model'),
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": piece} if n == 0 else {"content": piece},
+                            "finish_reason": None if piece is not None else "stop"
+                        }]
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    self.wfile.flush()
+                    if piece is not None:
+                        time.sleep(delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+            
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path.endswith('/chat/completions') and body.get('stream'):
+                    # 流式请求：首个分片前只等待一部分延迟，其余延迟分摊到各分片之间
+                    if self._simulate('chat', server.chat_latency * 0.2, server.chat_error_rate):
+                        return
+                    self._stream_chat(body, server._chat_content(body['messages'][-1]['content']))
+                elif self.path.endswith('/chat/completions'):
+                    if self._simulate('chat', server.chat_latency, server.chat_error_rate):
+                        return
+                    content = server._chat_content(body['messages'][-1]['content'])
+                    self._send(200, {
+                        "id": "chatcmpl-benchmark",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get('model'),
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop"
+                        }],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                    })
+                elif self.path.endswith('/images/generations'):
+                    if self._simulate('image', server.image_latency, server.image_error_rate):
+                        return
+                    size = body.get('size', '1080x1920')
+                    if body.get('response_format') == 'b64_json':
+                        data = {"b64_json": base64.b64encode(server._image_bytes(size)).decode('ascii')}
+                    else:
+                        data = {"url": f"{server.base_url}/files/{size}.jpg"}
+                    self._send(200, {
+                        "model": body.get('model'),
+                        "created": int(time.time()),
+                        "data": [dict(data, size=size)],
+                        "usage": {"generated_images": 1}
+                    })
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+            
+            def do_GET(self):
+                match = re.fullmatch(r'/files/(\d+x\d+)\.jpg', self.path)
+                if not match:
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                server._count('download_requests')
+                self._send(200, server._image_bytes(match.group(1)), content_type='image/jpeg')
+        
+        return Handler
+
+
+def make_fake_tts_provider(name, latency=0.8, error_rate=0.0, stats=None):
+    """
+    创建语音合成服务商的替身类，实现 tts_providers.TTSProvider 接口，注册后可在TTS_PROVIDERS中使用
+    
+    按字幕长度（每字约0.25秒）流式写出静音WAV，并模拟合成延迟和限流错误。
+    需要在设置好环境变量之后调用（会导入被测模块）。
+    
+    参数:
+        name: 服务商名称
+        latency: 平均延迟（秒）
+        error_rate: 返回可重试错误的概率
+        stats: 记录请求数和错误数的字典
+    
+    返回:
+        type: TTSProvider的子类
+    """
+    from rate_limit import RetryableError
+    from tts_providers import SAMPLE_RATE, StreamingWavWriter, TTSProvider
+    
+    stats = stats if stats is not None else {}
+    lock = threading.Lock()
+    
+    def count(key):
+        with lock:
+            stats[key] = stats.get(key, 0) + 1
+    
+    class FakeTTSProvider(TTSProvider):
+        @classmethod
+        def is_configured(cls):
+            return True
+        
+        @classmethod
+        def voice_for(cls, voice_name=None):
+            return voice_name or 'benchmark'
+        
+        def synthesize(self, text, output_file):
+            count(f'{name}_requests')
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+            if random.random() < error_rate:
+                count(f'{name}_errors')
+                raise RetryableError("语音合成被取消: TooManyRequests")
+            
+            writer = StreamingWavWriter(output_file)
+            frames = int(max(1.0, len(text) * 0.25) * SAMPLE_RATE)
+            # 按0.5秒一块写入，与真实服务商的流式返回一致
+            chunk = SAMPLE_RATE // 2
+            for offset in range(0, frames, chunk):
+                writer.write(b'\x00\x00' * min(chunk, frames - offset))
+            return writer.commit()
+    
+    FakeTTSProvider.name = name
+    return FakeTTSProvider
+
+
+def find_font():
+    """查找一个可用于渲染的字体文件，找不到时返回None"""
+    for pattern in FONT_PATTERNS:
+        fonts = sorted(glob.glob(pattern, recursive=True))
+        if fonts:
+            return os.path.abspath(fonts[0])
+    return None
+
+
+def _peak_rss_mb(who):
+    """进程（或其已结束的子进程）的峰值常驻内存（MB）"""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux上单位为KB，macOS上为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _timed(timings, stage, func):
+    """包装func，把每次调用的耗时累加到timings[stage]"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+def _timed_stream(timings, stage, func):
+    """包装生成器函数func，把从开始迭代到迭代结束的耗时累加到timings[stage]"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            yield from func(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+    return wrapper
+
+
+def run_once(segments, args):
+    """
+    在当前进程中用替身服务运行一次 main()
+    
+    需要在独立的进程中调用：会修改环境变量和工作目录，并替换被测模块中的函数。
+    
+    参数:
+        segments: 段数
+        args: 命令行参数
+    
+    返回:
+        dict: 本次运行的结果
+    """
+    server = FakeProviderServer(
+        chat_latency=args.chat_latency, chat_error_rate=args.chat_error_rate,
+        image_latency=args.image_latency, image_error_rate=args.image_error_rate
+    )
+    server.start()
+    
+    # 配置在导入时读取，必须在导入被测模块之前设置
+    scratch_dir = tempfile.mkdtemp(prefix='autovedio-benchmark-')
+    os.environ.update({
+        'DEEPSEEK_API_KEY': 'benchmark',
+        'DEEPSEEK_BASE_URL': server.base_url,
+        'ARK_API_KEY': 'benchmark',
+        'ARK_BASE_URL': f"{server.base_url}/api/v3",
+        'AZURE_SPEECH_KEY': 'benchmark',
+        'AZURE_SPEECH_REGION': 'benchmark',
+    })
+    tts_providers = ['fake_tts'] + (['fake_tts_backup'] if args.tts_backup_latency > 0 else [])
+    os.environ['TTS_PROVIDERS'] = ','.join(tts_providers)
+    os.environ.setdefault('RETRY_BACKOFF_BASE', '0.1')
+    os.environ.setdefault('RETRY_BACKOFF_MAX', '2')
+    os.chdir(scratch_dir)
+    
+    import main as app
+    from prompt_generator import PromptGenerator
+    from tts_providers import register_provider
+    
+    tts_stats = {}
+    register_provider(make_fake_tts_provider(
+        'fake_tts', latency=args.tts_latency, error_rate=args.tts_error_rate, stats=tts_stats
+    ))
+    if args.tts_backup_latency > 0:
+        register_provider(make_fake_tts_provider('fake_tts_backup', latency=args.tts_backup_latency, stats=tts_stats))
+    timings = {}
+    PromptGenerator.generate_video_script = _timed(timings, 'script', PromptGenerator.generate_video_script)
+    # 流式生成脚本时，脚本阶段与素材阶段重叠，素材阶段的耗时包含脚本生成
+    PromptGenerator.stream_video_script = _timed_stream(timings, 'script', PromptGenerator.stream_video_script)
+    app.run_segment_pipeline = _timed(timings, 'assets', app.run_segment_pipeline)
+    app.render_project = _timed(timings, 'render', app.render_project)
+    
+    width, height = args.video_size
+    input_path = os.path.join(scratch_dir, 'benchmark.json')
+    with open(input_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'name': 'benchmark',
+            'video_size': [width, height],
+            'iamges': segments,
+            'voice': 'zh-CN-XiaoxiaoNeural',
+            'font': args.font,
+            'font_color': '#FFFFFF',
+            'font_size': 50,
+            'text': '基准测试用的输入文本。' * 10
+        }, f, ensure_ascii=False)
+    
+    start = time.perf_counter()
+    try:
+        app.main(input_path, use_cache=args.cache)
+    finally:
+        total = time.perf_counter() - start
+        server.stop()
+    
+    outputs = glob.glob(os.path.join(scratch_dir, 'temp', 'benchmark', '*.mp4'))
+    result = {
+        'segments': segments,
+        'ok': bool(outputs),
+        'total': total,
+        'stages': {stage: timings.get(stage, 0.0) for stage, _ in STAGES},
+        'segments_per_second': segments / total if total else 0.0,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+        'peak_child_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'requests': dict(server.stats, **tts_stats),
+        'output_bytes': sum(os.path.getsize(path) for path in outputs),
+        'scratch_dir': scratch_dir,
+    }
+    return result
+
+
+def print_report(results):
+    """打印各次运行的结果表格"""
+    header = f"{'段数':>6} {'状态':>4}" + ''.join(f" {label + '(s)':>9}" for _, label in STAGES)
+    header += f" {'总计(s)':>9} {'段/秒':>7} {'内存(MB)':>9} {'子进程(MB)':>10} {'请求/错误':>12}"
+    print(header)
+    for result in results:
+        requests = result['requests']
+        request_count = sum(v for k, v in requests.items() if k.endswith('_requests'))
+        error_count = sum(v for k, v in requests.items() if k.endswith('_errors'))
+        line = f"{result['segments']:>6} {'成功' if result['ok'] else '失败':>4}"
+        line += ''.join(f" {result['stages'][stage]:>9.2f}" for stage, _ in STAGES)
+        line += f" {result['total']:>9.2f} {result['segments_per_second']:>7.2f}"
+        line += f" {result['peak_rss_mb']:>9.1f} {result['peak_child_rss_mb']:>10.1f}"
+        line += f" {f'{request_count}/{error_count}':>12}"
+        print(line)
+
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """
+    与基线结果比较，总耗时或峰值内存超出基线 tolerance 比例时视为退化
+    
+    返回:
+        list: 退化描述列表
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {result['segments']: result for result in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        base = baseline.get(result['segments'])
+        if base is None:
+            continue
+        for key, label in (('total', '总耗时'), ('peak_rss_mb', '峰值内存')):
+            if base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    f"{result['segments']} 段{label}: {base[key]:.2f} -> {result[key]:.2f}"
+                    f"（+{(result[key] / base[key] - 1) * 100:.0f}%）"
+                )
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试：用本地替身服务驱动完整流程")
+    parser.add_argument("--segments", type=int, nargs='+', default=[5, 50], help="每次运行的段数（5-500），默认为 5 50")
+    parser.add_argument("--video-size", type=int, nargs=2, default=[1080, 1920], metavar=('W', 'H'), help="视频尺寸")
+    parser.add_argument("--font", default=None, help="渲染用的字体文件，默认自动查找")
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="DeepSeek替身的平均延迟（秒）")
+    parser.add_argument("--chat-error-rate", type=float, default=0.0, help="DeepSeek替身返回错误的概率")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="图片接口替身的平均延迟（秒）")
+    parser.add_argument("--image-error-rate", type=float, default=0.0, help="图片接口替身返回错误的概率")
+    parser.add_argument("--tts-latency", type=float, default=0.8, help="语音合成替身的平均延迟（秒）")
+    parser.add_argument("--tts-error-rate", type=float, default=0.0, help="语音合成替身返回错误的概率")
+    parser.add_argument("--tts-backup-latency", type=float, default=0.0,
+                        help="大于0时增加第二个语音合成替身（不返回错误）及其平均延迟（秒），用于测量失败切换")
+    parser.add_argument("--cache", action="store_true", help="使用缓存（默认不使用，测量完整流程）")
+    parser.add_argument("--output", default=None, help="把结果保存为JSON文件，可作为之后运行的基线")
+    parser.add_argument("--baseline", default=None, help="与基线结果比较，退化时以非0状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例，默认为0.2")
+    parser.add_argument("--verbose", action="store_true", help="显示被测流程的输出")
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.font is None:
+        args.font = find_font()
+        if args.font is None:
+            print("[错误] 找不到可用的字体，请用 --font 指定")
+            sys.exit(1)
+    args.font = os.path.abspath(args.font)
+    
+    if args.result_file:
+        # 子进程：只运行一次，结果写入文件
+        result = run_once(args.segments[0], args)
+        with open(args.result_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        sys.exit(0)
+    
+    # 每次运行使用独立的子进程，峰值内存互不影响
+    script = os.path.abspath(__file__)
+    passthrough = list(sys.argv[1:])
+    results = []
+    for segments in args.segments:
+        if not 1 <= segments <= 500:
+            print(f"[警告] 段数 {segments} 超出范围（1-500），跳过")
+            continue
+        print(f"[基准] 正在运行 {segments} 段...")
+        fd, result_file = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        command = [sys.executable, script] + passthrough + [
+            '--segments', str(segments), '--font', args.font, '--result-file', result_file
+        ]
+        output = None if args.verbose else subprocess.DEVNULL
+        returncode = subprocess.run(command, stdout=output, stderr=output).returncode
+        try:
+            with open(result_file, 'r', encoding='utf-8') as f:
+                results.append(json.load(f))
+        except ValueError:
+            print(f"[错误] {segments} 段运行失败（退出码 {returncode}），使用 --verbose 查看详情")
+        finally:
+            os.remove(result_file)
+    
+    print()
+    print_report(results)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n[基准] 结果已保存到: {args.output}")
+    
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print("\n[基准] 发现退化：")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\n[基准] 未发现超出允许范围的退化")
@@ -0,0 +1,489 @@
+"""
+缓存模块
+基于文件的内容寻址缓存，按最近使用时间（LRU）和条目年龄淘汰
+"""
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows上没有fcntl，索引只在进程内加锁
+    fcntl = None
+
+
+def make_cache_key(*parts):
+    """
+    根据任意可JSON序列化的内容生成缓存键
+    
+    参数:
+        parts: 参与计算的内容，例如模型名、消息列表、温度
+    
+    返回:
+        str: sha256十六进制字符串
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    计算文件内容的sha256
+    
+    参数:
+        path: 文件路径
+        chunk_size: 每次读取的字节数
+    
+    返回:
+        str: sha256十六进制字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    磁盘缓存
+    
+    每个条目是 cache_dir/<键前两位>/<键><后缀> 的一个文件。命中时刷新文件的修改时间，
+    淘汰时先删除超过max_age未被使用的条目，总大小仍超过max_bytes时再按修改时间从旧到新删除。
+    写入时累计的总大小只是估计值（其他进程也可能写入或删除条目），每次淘汰都按实际条目重新统计，
+    距上次统计超过RESYNC_SECONDS时写入也会触发一次。
+    """
+    
+    # 两次按实际条目统计总大小的最长间隔（秒）
+    RESYNC_SECONDS = 300
+    
+    def __init__(self, cache_dir, max_bytes=None, max_age=None, suffix=''):
+        """
+        初始化磁盘缓存
+        
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），为None时不限制
+            max_age: 条目最长未使用时间（秒），为None时不限制
+            suffix: 条目文件后缀，例如 ".json"、".jpg"
+        """
+        self.cache_dir = cache_dir
+        self.name = os.path.basename(os.path.normpath(cache_dir))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self._lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = 0
+        self._synced_at = 0.0
+        self.evict()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+    
+    def _iter_entries(self):
+        """遍历缓存中的所有条目，返回 (路径, 大小, 修改时间) 列表"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.suffix) or name.endswith('.part'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+    
+    def get_path(self, key):
+        """
+        查找缓存条目，并记录命中情况
+        
+        参数:
+            key: 缓存键
+        
+        返回:
+            str: 条目文件路径，未命中或已过期返回None
+        """
+        path = self._lookup(key)
+        metrics.inc('cache_requests_total', cache=self.name, result='hit' if path else 'miss')
+        return path
+    
+    def _lookup(self, key):
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if self.max_age is not None and time.time() - mtime > self.max_age:
+            self._remove(path)
+            return None
+        try:
+            # 刷新修改时间作为最近使用时间
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+    
+    def get_bytes(self, key):
+        """
+        读取缓存条目内容
+        
+        参数:
+            key: 缓存键
+        
+        返回:
+            bytes: 条目内容，未命中返回None
+        """
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def put_bytes(self, key, data, meta=None):
+        """
+        写入缓存条目（先写临时文件再重命名）
+        
+        参数:
+            key: 缓存键
+            data: 条目内容
+            meta: 条目附加信息，仅带索引的缓存会保存
+        
+        返回:
+            str: 条目文件路径
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            old_size = self._replace(tmp_path, path)
+        except BaseException:
+            self._discard(tmp_path)
+            raise
+        self._stored(key, path, len(data), meta, old_size)
+        metrics.inc('bytes_written_total', len(data), kind='cache')
+        return path
+    
+    def put_file(self, key, src_path, meta=None):
+        """
+        复制文件作为缓存条目
+        
+        参数:
+            key: 缓存键
+            src_path: 源文件路径
+            meta: 条目附加信息，仅带索引的缓存会保存
+        
+        返回:
+            str: 条目文件路径
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            size = os.path.getsize(tmp_path)
+            old_size = self._replace(tmp_path, path)
+        except BaseException:
+            self._discard(tmp_path)
+            raise
+        self._stored(key, path, size, meta, old_size)
+        metrics.record_bytes('cache', path)
+        return path
+    
+    @staticmethod
+    def _replace(tmp_path, path):
+        """用临时文件替换条目文件，返回被覆盖的旧条目大小（没有旧条目时为0）"""
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(tmp_path, path)
+        return old_size
+    
+    @staticmethod
+    def _discard(tmp_path):
+        """删除写入失败留下的临时文件"""
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    
+    def link_to(self, key, dest_path):
+        """
+        把缓存条目硬链接到目标路径，无法硬链接时（如跨文件系统）改为复制
+        
+        参数:
+            key: 缓存键
+            dest_path: 目标文件路径
+        
+        返回:
+            str: 目标文件路径，未命中返回None
+        """
+        path = self.get_path(key)
+        if path is None:
+            return None
+        os.makedirs(os.path.dirname(dest_path) if os.path.dirname(dest_path) else '.', exist_ok=True)
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+        try:
+            os.link(path, tmp_path)
+        except OSError:
+            try:
+                shutil.copyfile(path, tmp_path)
+            except OSError:
+                return None
+        os.replace(tmp_path, dest_path)
+        return dest_path
+    
+    def _stored(self, key, path, size, meta, old_size=0):
+        """条目写入后的回调，old_size为被覆盖的旧条目大小"""
+        self._added(size - old_size)
+    
+    def _added(self, size):
+        with self._lock:
+            self._total_bytes += size
+            over_quota = self.max_bytes is not None and self._total_bytes > self.max_bytes
+            stale = time.monotonic() - self._synced_at > self.RESYNC_SECONDS
+        if over_quota or stale:
+            self.evict()
+    
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        self._on_removed(path)
+        return size
+    
+    def _on_removed(self, path):
+        """条目被删除后的回调，子类可覆盖以同步索引"""
+        pass
+    
+    def evict(self):
+        """
+        淘汰过期条目，并在总大小超过上限时按最近使用时间淘汰
+        
+        返回:
+            int: 淘汰的条目数
+        """
+        with self._lock:
+            now = time.time()
+            entries = []
+            removed = 0
+            for path, size, mtime in self._iter_entries():
+                if self.max_age is not None and now - mtime > self.max_age:
+                    self._remove(path)
+                    removed += 1
+                else:
+                    entries.append((path, size, mtime))
+            
+            total = sum(size for _, size, _ in entries)
+            if self.max_bytes is not None and total > self.max_bytes:
+                entries.sort(key=lambda entry: entry[2])
+                for path, size, _ in entries:
+                    if total <= self.max_bytes:
+                        break
+                    self._remove(path)
+                    total -= size
+                    removed += 1
+            
+            self._total_bytes = total
+            self._synced_at = time.monotonic()
+        if removed:
+            print(f"[缓存] {self.cache_dir} 淘汰了 {removed} 个条目")
+        return removed
+
+
+class IndexedDiskCache(DiskCache):
+    """
+    带索引文件的磁盘缓存
+    
+    在cache_dir/index.json中记录每个条目的大小、最近使用时间和附加信息，
+    查找和淘汰都只读索引，不需要遍历缓存目录。索引丢失或损坏时从缓存目录重建。
+    
+    命中时只在内存中更新最近使用时间，累计FLUSH_HITS次命中或距上次写入超过FLUSH_SECONDS时，
+    以及写入、删除条目和进程退出时才写回索引。多个进程可以共享同一个缓存目录：写回时持有index.lock文件锁，
+    重新读取磁盘上的索引并合并本进程的修改，不会覆盖其他进程写入的条目。
+    """
+    
+    INDEX_FILE = 'index.json'
+    INDEX_LOCK_FILE = 'index.lock'
+    # 累计多少次命中后写回最近使用时间
+    FLUSH_HITS = 64
+    # 有未写回的命中时，距上次写回超过该秒数后的下一次命中即写回
+    FLUSH_SECONDS = 30
+    
+    def __init__(self, cache_dir, max_bytes=None, max_age=None, suffix=''):
+        """
+        初始化带索引的磁盘缓存
+        
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），为None时不限制
+            max_age: 条目最长未使用时间（秒），为None时不限制
+            suffix: 条目文件后缀，例如 ".jpg"
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, self.INDEX_FILE)
+        self._lock_path = os.path.join(cache_dir, self.INDEX_LOCK_FILE)
+        self._index = {}
+        # 尚未写回索引文件的修改：命中的最近使用时间、新写入的条目和已删除的键
+        self._touched = {}
+        self._written = {}
+        self._deleted = set()
+        self._hits = 0
+        self._flushed_at = time.monotonic()
+        self.cache_dir = cache_dir
+        self.suffix = suffix
+        self._load_index()
+        super().__init__(cache_dir, max_bytes=max_bytes, max_age=max_age, suffix=suffix)
+        atexit.register(self.flush)
+    
+    def _read_index_file(self):
+        """读取磁盘上的索引，不存在或已损坏时返回None"""
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return index if isinstance(index, dict) else None
+    
+    @contextmanager
+    def _index_file_lock(self):
+        """跨进程的索引文件锁"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _load_index(self):
+        index = self._read_index_file()
+        if index is not None:
+            self._index = index
+            return
+        
+        # 索引不存在或已损坏，从缓存目录重建
+        self._index = {}
+        for path, size, mtime in super()._iter_entries():
+            if os.path.basename(path) in (self.INDEX_FILE, self.INDEX_LOCK_FILE):
+                continue
+            key = os.path.basename(path)[:len(os.path.basename(path)) - len(self.suffix)]
+            self._index[key] = {'bytes': size, 'last_used': mtime, 'meta': {}}
+        if self._index:
+            print(f"[缓存] 已重建索引 {self._index_path}，共 {len(self._index)} 个条目")
+            self._save_index()
+    
+    def _save_index(self):
+        """在文件锁保护下把本进程的修改合并到磁盘上的索引并写回，同时取得其他进程写入的条目"""
+        with self._index_file_lock():
+            index = self._read_index_file()
+            if index is None:
+                index = self._index
+            else:
+                for key in self._deleted:
+                    index.pop(key, None)
+                index.update(self._written)
+                for key, last_used in self._touched.items():
+                    entry = index.get(key)
+                    if entry is not None:
+                        entry['last_used'] = max(entry.get('last_used', 0), last_used)
+            tmp_path = f"{self._index_path}.{uuid.uuid4().hex}.part"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, self._index_path)
+        self._index = index
+        self._touched = {}
+        self._written = {}
+        self._deleted = set()
+        self._hits = 0
+        self._flushed_at = time.monotonic()
+    
+    def flush(self):
+        """把尚未写回的修改（主要是命中时更新的最近使用时间）写回索引文件"""
+        with self._lock:
+            if self._touched or self._written or self._deleted:
+                try:
+                    self._save_index()
+                except OSError:
+                    # 缓存目录已被删除等情况下，最近使用时间丢失不影响正确性
+                    pass
+    
+    def _iter_entries(self):
+        return [
+            (self._path(key), entry.get('bytes', 0), entry.get('last_used', 0))
+            for key, entry in list(self._index.items())
+        ]
+    
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                del self._index[key]
+                self._written.pop(key, None)
+                self._deleted.add(key)
+                self._save_index()
+                return None
+            if self.max_age is not None and time.time() - entry.get('last_used', 0) > self.max_age:
+                self._remove(path)
+                return None
+            entry['last_used'] = time.time()
+            self._touched[key] = entry['last_used']
+            self._hits += 1
+            if self._hits >= self.FLUSH_HITS or time.monotonic() - self._flushed_at > self.FLUSH_SECONDS:
+                self._save_index()
+            return path
+    
+    def get_meta(self, key):
+        """
+        读取条目的附加信息
+        
+        参数:
+            key: 缓存键
+        
+        返回:
+            dict: 附加信息，未命中返回None
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            return dict(entry.get('meta') or {}) if entry is not None else None
+    
+    def _stored(self, key, path, size, meta, old_size=0):
+        with self._lock:
+            entry = {'bytes': size, 'last_used': time.time(), 'meta': meta or {}}
+            self._index[key] = entry
+            self._written[key] = entry
+            self._deleted.discard(key)
+            self._save_index()
+        self._added(size - old_size)
+    
+    def _on_removed(self, path):
+        key = os.path.basename(path)[:len(os.path.basename(path)) - len(self.suffix)]
+        with self._lock:
+            if self._index.pop(key, None) is not None:
+                self._written.pop(key, None)
+                self._touched.pop(key, None)
+                self._deleted.add(key)
+                self._save_index()
@@ -18,28 +18,99 @@ class Config:
     
     # 火山引擎配置
     ARK_API_KEY = os.getenv('ARK_API_KEY', '')
+    ARK_BASE_URL = os.getenv('ARK_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
     
     # 阿里云DashScope配置
     DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY', '')
+    DASHSCOPE_TTS_MODEL = os.getenv('DASHSCOPE_TTS_MODEL', 'cosyvoice-v1')  # 语音合成模型
+    DASHSCOPE_TTS_VOICE = os.getenv('DASHSCOPE_TTS_VOICE', 'longxiaochun')  # 语音合成音色（与Azure的语音名称不通用）
+    DASHSCOPE_TTS_TIMEOUT = float(os.getenv('DASHSCOPE_TTS_TIMEOUT', '60'))  # 单段语音合成的超时（秒）
     
     # Azure语音服务配置
     AZURE_SPEECH_KEY = os.getenv('AZURE_SPEECH_KEY', '')
     AZURE_SPEECH_REGION = os.getenv('AZURE_SPEECH_REGION', '')
     AZURE_SPEECH_VOICE = os.getenv('AZURE_SPEECH_VOICE', 'zh-CN-XiaoxiaoNeural')  # 默认中文语音
+    AZURE_TTS_TIMEOUT = float(os.getenv('AZURE_TTS_TIMEOUT', '60'))  # 单段语音合成的超时（秒）
+    
+    # 语音合成服务商配置
+    TTS_PROVIDERS = os.getenv('TTS_PROVIDERS', 'azure,dashscope')  # 语音合成服务商的优先顺序（逗号分隔），未配置密钥的会被跳过
+    TTS_FAILOVER_RETRIES = int(os.getenv('TTS_FAILOVER_RETRIES', '1'))  # 有多个服务商时，切换前在同一服务商上的重试次数
+    TTS_SLOW_CALL_SECONDS = float(os.getenv('TTS_SLOW_CALL_SECONDS', '0'))  # 当前服务商近期单段合成耗时超过该值时切换到下一个服务商，0表示不切换
+    
+    # 并发配置
+    PROMPT_MAX_WORKERS = int(os.getenv('PROMPT_MAX_WORKERS', '4'))  # 同时进行的DeepSeek请求数
+    IMAGE_MAX_WORKERS = int(os.getenv('IMAGE_MAX_WORKERS', '4'))  # 同时进行的图片生成任务数
+    TTS_MAX_WORKERS = int(os.getenv('TTS_MAX_WORKERS', '4'))  # 同时进行的语音合成任务数（即合成器池大小）
+    PROMPT_BATCH_SIZE = int(os.getenv('PROMPT_BATCH_SIZE', '10'))  # 每次请求生成的图片提示词段数，小于等于1时逐段请求
+    SCRIPT_STREAMING = os.getenv('SCRIPT_STREAMING', 'true').lower() in ('1', 'true', 'yes')  # 流式生成脚本，每段输出完整即开始生成素材
+    STREAM_PROMPT_FLUSH_SECONDS = float(os.getenv('STREAM_PROMPT_FLUSH_SECONDS', '3'))  # 流式生成脚本时，未凑满一批的提示词最多等待的秒数
+    BATCH_PROJECT_WORKERS = int(os.getenv('BATCH_PROJECT_WORKERS', '2'))  # 批量运行时同时生成素材的项目数
+    
+    # 限流与重试配置
+    DEEPSEEK_RATE_LIMIT = float(os.getenv('DEEPSEEK_RATE_LIMIT', '0'))  # 每秒DeepSeek请求数上限，0表示不限
+    DEEPSEEK_RATE_BURST = float(os.getenv('DEEPSEEK_RATE_BURST', '0'))  # 允许的突发请求数，0表示与每秒请求数相同
+    ARK_RATE_LIMIT = float(os.getenv('ARK_RATE_LIMIT', '0'))  # 每秒图片生成请求数上限，0表示不限
+    ARK_RATE_BURST = float(os.getenv('ARK_RATE_BURST', '0'))
+    AZURE_TTS_RATE_LIMIT = float(os.getenv('AZURE_TTS_RATE_LIMIT', '0'))  # 每秒语音合成请求数上限，0表示不限
+    AZURE_TTS_RATE_BURST = float(os.getenv('AZURE_TTS_RATE_BURST', '0'))
+    DASHSCOPE_TTS_RATE_LIMIT = float(os.getenv('DASHSCOPE_TTS_RATE_LIMIT', '0'))  # 每秒DashScope语音合成请求数上限，0表示不限
+    DASHSCOPE_TTS_RATE_BURST = float(os.getenv('DASHSCOPE_TTS_RATE_BURST', '0'))
+    PROVIDER_MAX_RETRIES = int(os.getenv('PROVIDER_MAX_RETRIES', '4'))  # 限流、超时等可重试错误的最大重试次数
+    RETRY_BACKOFF_BASE = float(os.getenv('RETRY_BACKOFF_BASE', '1'))  # 指数退避的基础等待秒数
+    RETRY_BACKOFF_MAX = float(os.getenv('RETRY_BACKOFF_MAX', '30'))  # 单次重试等待的上限秒数
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '8'))  # 连续失败多少次后熔断，0表示不熔断
+    CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))  # 熔断持续秒数
+    
+    # 下载配置
+    IMAGE_RESPONSE_FORMAT = os.getenv('IMAGE_RESPONSE_FORMAT', 'url')  # 图片返回格式：url（返回后再下载）或 b64_json（随响应返回）
+    DOWNLOAD_MAX_CONNECTIONS = int(os.getenv('DOWNLOAD_MAX_CONNECTIONS', '8'))  # 同时进行的下载数（连接池大小）
+    DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', '60'))  # 下载超时（秒）
+    DOWNLOAD_RETRIES = int(os.getenv('DOWNLOAD_RETRIES', '3'))  # 下载失败后的重试次数
+    
+    # 渲染配置
+    RENDER_MODE = os.getenv('RENDER_MODE', 'static')  # static：每张幻灯片只合成一帧再编码；moviepy：MoviePy逐帧合成
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0'))  # static模式下并行渲染的进程数，0表示CPU核数
+    ENCODING_PROFILE = os.getenv('ENCODING_PROFILE', 'standard')  # 编码配置：standard、draft、social 或 archive
+    ENCODING_CALIBRATION_FILE = os.getenv('ENCODING_CALIBRATION_FILE', os.path.join('cache', 'encoding_calibration.json'))  # 编码校准结果文件
+    BATCH_TARGET_BITRATE = int(os.getenv('BATCH_TARGET_BITRATE', '0'))  # 批量运行的目标码率上限（kbps），大于0时按校准结果自动选择编码配置
+    
+    # 指标配置
+    METRICS_FORMAT = os.getenv('METRICS_FORMAT', 'json')  # 运行结束时写出的指标格式：json 或 prometheus
+    
+    # 缓存配置
+    LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', os.path.join('cache', 'llm'))  # DeepSeek返回结果缓存目录
+    LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', '200'))  # 缓存总大小上限（MB）
+    LLM_CACHE_MAX_AGE_DAYS = int(os.getenv('LLM_CACHE_MAX_AGE_DAYS', '30'))  # 缓存条目最长未使用天数
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join('cache', 'images'))  # 跨项目共享的图片缓存目录
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '2048'))  # 图片缓存磁盘配额（MB）
+    AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', os.path.join('cache', 'audio'))  # 跨项目共享的语音缓存目录
+    AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', '512'))  # 语音缓存磁盘配额（MB）
+    OVERLAY_CACHE_DIR = os.getenv('OVERLAY_CACHE_DIR', os.path.join('cache', 'overlays'))  # 栅格化文字叠加层缓存目录
+    OVERLAY_CACHE_MAX_MB = int(os.getenv('OVERLAY_CACHE_MAX_MB', '256'))  # 文字叠加层缓存磁盘配额（MB）
+    SEGMENT_CACHE_DIR = os.getenv('SEGMENT_CACHE_DIR', os.path.join('cache', 'segments'))  # 已渲染幻灯片片段缓存目录
+    SEGMENT_CACHE_MAX_MB = int(os.getenv('SEGMENT_CACHE_MAX_MB', '4096'))  # 幻灯片片段缓存磁盘配额（MB）
     
     @classmethod
-    def validate(cls):
-        """验证必需的配置是否存在"""
+    def validate(cls, providers=None):
+        """
+        验证必需的配置是否存在
+        
+        参数:
+            providers: 需要验证的服务商集合，可包含 "deepseek"、"ark"、"tts"，默认为全部
+        """
+        if providers is None:
+            providers = {'deepseek', 'ark', 'tts'}
         missing = []
-        if not cls.DEEPSEEK_API_KEY:
+        if 'deepseek' in providers and not cls.DEEPSEEK_API_KEY:
             missing.append('DEEPSEEK_API_KEY')
-        if not cls.ARK_API_KEY:
+        if 'ark' in providers and not cls.ARK_API_KEY:
             missing.append('ARK_API_KEY')
-        # Azure和DashScope至少需要一个
-        if not cls.DASHSCOPE_API_KEY and not cls.AZURE_SPEECH_KEY:
-            missing.append('DASHSCOPE_API_KEY 或 AZURE_SPEECH_KEY（至少需要一个）')
-        if cls.AZURE_SPEECH_KEY and not cls.AZURE_SPEECH_REGION:
-            missing.append('AZURE_SPEECH_REGION（使用Azure时需要）')
+        if 'tts' in providers:
+            # Azure和DashScope至少需要一个
+            if not cls.DASHSCOPE_API_KEY and not cls.AZURE_SPEECH_KEY:
+                missing.append('DASHSCOPE_API_KEY 或 AZURE_SPEECH_KEY（至少需要一个）')
+            if cls.AZURE_SPEECH_KEY and not cls.AZURE_SPEECH_REGION:
+                missing.append('AZURE_SPEECH_REGION（使用Azure时需要）')
         
         if missing:
             raise ValueError(f"缺少必需的配置项: {', '.join(missing)}。请检查.env文件。")
@@ -0,0 +1,127 @@
+"""
+下载模块
+复用长连接下载生成的素材，流式写入临时文件后原子重命名，支持断点续传和失败重试
+"""
+import base64
+import os
+import threading
+import time
+import httpx
+from config import Config
+from rate_limit import RETRYABLE_STATUS_CODES, parse_retry_after
+
+
+class Downloader:
+    """素材下载器"""
+    
+    CHUNK_SIZE = 64 * 1024
+    
+    def __init__(self, max_connections=None, timeout=None, retries=None):
+        """
+        初始化下载器
+        
+        参数:
+            max_connections: 同时进行的下载数（也是连接池大小），默认为配置中的DOWNLOAD_MAX_CONNECTIONS
+            timeout: 连接和读取超时（秒），默认为配置中的DOWNLOAD_TIMEOUT
+            retries: 失败后的重试次数，默认为配置中的DOWNLOAD_RETRIES
+        """
+        if max_connections is None:
+            max_connections = Config.DOWNLOAD_MAX_CONNECTIONS
+        if timeout is None:
+            timeout = Config.DOWNLOAD_TIMEOUT
+        if retries is None:
+            retries = Config.DOWNLOAD_RETRIES
+        self.max_connections = max(1, max_connections)
+        self.retries = max(0, retries)
+        self.client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            ),
+            timeout=timeout,
+            follow_redirects=True
+        )
+        self._semaphore = threading.BoundedSemaphore(self.max_connections)
+    
+    def download(self, url, output_path):
+        """
+        下载文件到output_path
+        
+        数据先流式写入 output_path.part，完成后再重命名，中断时不会留下不完整的目标文件；
+        只重试连接、超时等传输错误和408、429、5xx等状态码（429时遵守Retry-After），其他4xx立即抛出；
+        重试时如果服务器支持Range请求，则从已下载的位置继续。
+        
+        参数:
+            url: 文件地址
+            output_path: 输出文件路径
+        
+        返回:
+            str: 输出文件路径
+        """
+        os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
+        part_path = f"{output_path}.part"
+        # 上次运行残留的临时文件可能属于其他内容，只在本次下载的重试之间续传
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        
+        attempt = 0
+        while True:
+            try:
+                self._download_once(url, part_path)
+                os.replace(part_path, output_path)
+                return output_path
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                # 签名过期、无权限、不存在等4xx错误重试也不会成功；416时已删除无效的续传部分，可以从头重试
+                if status not in RETRYABLE_STATUS_CODES and status != 416:
+                    raise
+                if attempt >= self.retries:
+                    raise
+                retry_after = parse_retry_after(e) if status == 429 else None
+            except (httpx.TransportError, OSError):
+                if attempt >= self.retries:
+                    raise
+                retry_after = None
+            
+            delay = min(2 ** attempt, 8) if retry_after is None else min(retry_after, Config.RETRY_BACKOFF_MAX)
+            attempt += 1
+            time.sleep(delay)
+            print(f"[下载] 第 {attempt} 次重试: {output_path}")
+    
+    def _download_once(self, url, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        
+        with self._semaphore:
+            with self.client.stream('GET', url, headers=headers) as response:
+                if response.status_code == 416:
+                    # 已下载部分无效，下次从头开始
+                    os.remove(part_path)
+                response.raise_for_status()
+                # 服务器不支持Range时返回完整内容，需要覆盖写入
+                mode = 'ab' if offset and response.status_code == 206 else 'wb'
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_bytes(self.CHUNK_SIZE):
+                        f.write(chunk)
+    
+    def save_base64(self, data, output_path):
+        """
+        把base64编码的内容写入output_path（先写临时文件再重命名）
+        
+        参数:
+            data: base64编码的字符串
+            output_path: 输出文件路径
+        
+        返回:
+            str: 输出文件路径
+        """
+        os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
+        part_path = f"{output_path}.part"
+        with open(part_path, 'wb') as f:
+            f.write(base64.b64decode(data))
+        os.replace(part_path, output_path)
+        return output_path
+    
+    def close(self):
+        """关闭连接池"""
+        self.client.close()
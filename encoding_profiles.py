@@ -0,0 +1,291 @@
+"""
+编码配置模块
+定义命名的编码配置（编码器、预设、CRF、关键帧间隔、线程数和音频参数），
+并提供校准命令：在本机用各配置编码一张示例幻灯片，记录编码速度和文件大小，供批量运行按目标码率自动选择
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from config import Config
+
+# 命名的编码配置
+# keyframe_interval 为关键帧间隔（秒），None表示使用编码器默认值；crf为None时使用编码器默认质量；
+# threads 为编码线程数，0表示自动（static模式下由并行渲染的进程平分CPU核数）
+ENCODING_PROFILES = {
+    # 与早期版本的固定参数一致
+    'standard': {
+        'codec': 'libx264', 'tune': 'stillimage', 'preset': 'medium', 'crf': None, 'keyframe_interval': None,
+        'threads': 0, 'audio_codec': 'aac', 'audio_bitrate': '192k', 'audio_sample_rate': 44100, 'audio_channels': 2,
+    },
+    # 预览用：编码最快，画质和体积次要
+    'draft': {
+        'codec': 'libx264', 'tune': 'stillimage', 'preset': 'ultrafast', 'crf': 30, 'keyframe_interval': 10,
+        'threads': 0, 'audio_codec': 'aac', 'audio_bitrate': '96k', 'audio_sample_rate': 44100, 'audio_channels': 2,
+    },
+    # 发布到短视频平台：2秒关键帧间隔便于平台转码和拖动进度
+    'social': {
+        'codec': 'libx264', 'tune': 'stillimage', 'preset': 'faster', 'crf': 23, 'keyframe_interval': 2,
+        'threads': 0, 'audio_codec': 'aac', 'audio_bitrate': '128k', 'audio_sample_rate': 44100, 'audio_channels': 2,
+    },
+    # 存档：画质优先
+    'archive': {
+        'codec': 'libx264', 'tune': 'stillimage', 'preset': 'slow', 'crf': 18, 'keyframe_interval': 10,
+        'threads': 0, 'audio_codec': 'aac', 'audio_bitrate': '256k', 'audio_sample_rate': 48000, 'audio_channels': 2,
+    },
+}
+
+
+def get_profile(name=None):
+    """
+    获取编码配置
+    
+    参数:
+        name: 配置名称，默认为配置中的ENCODING_PROFILE
+    
+    返回:
+        dict: 编码配置
+    """
+    name = name or Config.ENCODING_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"未知的编码配置: {name}，可选: {', '.join(ENCODING_PROFILES)}")
+    return ENCODING_PROFILES[name]
+
+
+def ffmpeg_video_args(profile, fps):
+    """
+    生成ffmpeg的视频编码参数（不含线程数）
+    
+    参数:
+        profile: 编码配置
+        fps: 帧率
+    
+    返回:
+        list: ffmpeg参数列表
+    """
+    args = ['-c:v', profile['codec']]
+    if profile.get('tune'):
+        args += ['-tune', profile['tune']]
+    args += ['-preset', profile['preset']]
+    if profile.get('crf') is not None:
+        args += ['-crf', str(profile['crf'])]
+    args += ['-pix_fmt', 'yuv420p', '-r', str(fps)]
+    if profile.get('keyframe_interval'):
+        args += ['-g', str(max(1, round(profile['keyframe_interval'] * fps)))]
+    return args
+
+
+def ffmpeg_audio_args(profile):
+    """
+    生成ffmpeg的音频编码参数
+    
+    参数:
+        profile: 编码配置
+    
+    返回:
+        list: ffmpeg参数列表
+    """
+    return [
+        '-c:a', profile['audio_codec'], '-b:a', profile['audio_bitrate'],
+        '-ar', str(profile['audio_sample_rate']), '-ac', str(profile['audio_channels']),
+    ]
+
+
+def _size_key(video_size):
+    return f"{video_size[0]}x{video_size[1]}"
+
+
+def load_calibration(path=None):
+    """
+    读取校准结果
+    
+    参数:
+        path: 校准结果文件，默认为配置中的ENCODING_CALIBRATION_FILE
+    
+    返回:
+        dict: 视频尺寸（如 "1080x1920"）到校准结果的字典，文件不存在时为空字典
+    """
+    path = path or Config.ENCODING_CALIBRATION_FILE
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def select_profile(target_bitrate, video_size, calibration=None):
+    """
+    按目标码率选择编码配置：在实测码率不超过目标的配置中选编码最快的
+    
+    参数:
+        target_bitrate: 目标码率上限（kbps）
+        video_size: 视频尺寸 (width, height)
+        calibration: load_calibration返回的校准结果，默认从文件读取
+    
+    返回:
+        str: 编码配置名称；没有该尺寸的校准结果时返回None。所有配置都超过目标时选码率最低的
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    results = calibration.get(_size_key(video_size), {}).get('profiles', {})
+    results = {name: result for name, result in results.items() if name in ENCODING_PROFILES}
+    if not results:
+        return None
+    
+    eligible = [name for name, result in results.items() if result['bitrate_kbps'] <= target_bitrate]
+    if eligible:
+        return min(eligible, key=lambda name: results[name]['encode_seconds'])
+    name = min(results, key=lambda name: results[name]['bitrate_kbps'])
+    print(f"[编码] 没有码率不超过 {target_bitrate}kbps 的编码配置，使用码率最低的 {name}")
+    return name
+
+
+def _write_sample_image(path, video_size):
+    """生成一张带渐变、色块和细节纹理的示例图片，编码难度接近真实的生成图片"""
+    import numpy as np
+    from PIL import Image, ImageDraw
+    
+    width, height = video_size
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([
+        255 * x / max(1, width - 1),
+        255 * y / max(1, height - 1),
+        128 + 64 * np.sin(x / 37.0) * np.cos(y / 53.0),
+    ], axis=-1)
+    pixels += rng.normal(0, 12, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(20, max(21, min(width, height) // 4)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        draw.ellipse([x0, y0, x0 + size, y0 + size], fill=color)
+    image.save(path, quality=95)
+
+
+def _write_sample_audio(path, duration, sample_rate=44100):
+    """生成一段立体声正弦波WAV"""
+    import numpy as np
+    
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.repeat(tone, 2).tobytes())
+
+
+def calibrate(video_size=(1080, 1920), fps=10, duration=10.0, font_path=None, profiles=None, output_path=None):
+    """
+    在本机用各编码配置编码同一张示例幻灯片，记录编码耗时、速度和文件大小，并写入校准结果文件
+    
+    参数:
+        video_size: 视频尺寸 (width, height)
+        fps: 帧率
+        duration: 示例幻灯片时长（秒）
+        font_path: 标题和字幕使用的字体，文件不存在时示例幻灯片不带文字
+        profiles: 要校准的配置名称列表，默认为全部
+        output_path: 校准结果文件，默认为配置中的ENCODING_CALIBRATION_FILE
+    
+    返回:
+        dict: 配置名称到 {encode_seconds, speed, bytes, bitrate_kbps} 的字典
+    """
+    from PIL import Image
+    from ffmpeg_utils import mux_audio
+    from video_generator import VideoGenerator
+    
+    output_path = output_path or Config.ENCODING_CALIBRATION_FILE
+    profiles = profiles or list(ENCODING_PROFILES)
+    with_text = bool(font_path) and os.path.exists(font_path)
+    work_dir = tempfile.mkdtemp(prefix='encoding-calibration-')
+    results = {}
+    try:
+        image_path = os.path.join(work_dir, 'sample.jpg')
+        audio_path = os.path.join(work_dir, 'sample.wav')
+        _write_sample_image(image_path, video_size)
+        _write_sample_audio(audio_path, duration)
+        slide = {
+            'image': image_path,
+            'audio': audio_path,
+            'duration': duration,
+            'title': '编码校准' if with_text else '',
+            'subtitle': '这是一段用于测量编码速度和文件大小的示例字幕。' if with_text else '',
+        }
+        
+        # 画面只合成一次，之后只测量编码
+        frame_path = os.path.join(work_dir, 'frame.png')
+        options = {'fps': fps, 'video_size': tuple(video_size), 'use_cache': False}
+        if with_text:
+            options['font_path'] = font_path
+        Image.fromarray(VideoGenerator(**options).render_slide_frame(slide)).save(frame_path)
+        
+        for name in profiles:
+            generator = VideoGenerator(encoding_profile=name, **options)
+            segment_file = os.path.join(work_dir, f"{name}.video.mp4")
+            output_file = os.path.join(work_dir, f"{name}.mp4")
+            # 与渲染时相同：先编码无音频片段，再封装音轨
+            start = time.perf_counter()
+            generator._encode_still_segment(frame_path, round(duration * fps), segment_file)
+            mux_audio(segment_file, audio_path, output_file, ffmpeg_audio_args(generator.encoding_profile))
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(output_file)
+            results[name] = {
+                'encode_seconds': round(elapsed, 3),
+                'speed': round(duration / elapsed, 2) if elapsed > 0 else 0.0,
+                'bytes': size,
+                'bitrate_kbps': round(size * 8 / duration / 1000, 1),
+            }
+            print(f"[编码校准] {name}: 耗时 {elapsed:.2f} 秒（{results[name]['speed']}x 实时），"
+                  f"{size / 1024:.0f} KB，{results[name]['bitrate_kbps']} kbps")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    # 按尺寸保存，同一尺寸的旧结果被覆盖
+    calibration = load_calibration(output_path)
+    calibration[_size_key(video_size)] = {
+        'fps': fps,
+        'duration': duration,
+        'calibrated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'profiles': results,
+    }
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = f"{output_path}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, output_path)
+    print(f"[编码校准] 已保存校准结果到: {output_path}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在本机校准各编码配置的编码速度和文件大小")
+    parser.add_argument("--video-size", default="1080x1920", help="示例幻灯片尺寸，格式为 宽x高")
+    parser.add_argument("--fps", type=int, default=10, help="帧率")
+    parser.add_argument("--duration", type=float, default=10.0, help="示例幻灯片时长（秒）")
+    parser.add_argument("--font", default=None, help="标题和字幕使用的字体，不指定或不存在时示例幻灯片不带文字")
+    parser.add_argument("--profiles", default=None, help=f"只校准这些配置（逗号分隔），可选: {','.join(ENCODING_PROFILES)}")
+    parser.add_argument("--output", default=None, help="校准结果文件，默认为ENCODING_CALIBRATION_FILE")
+    args = parser.parse_args()
+    
+    try:
+        video_size = tuple(int(n) for n in args.video_size.lower().split('x'))
+        if len(video_size) != 2:
+            raise ValueError
+    except ValueError:
+        parser.error(f"视频尺寸格式错误: {args.video_size}")
+    profiles = [name.strip() for name in args.profiles.split(',')] if args.profiles else None
+    for name in profiles or []:
+        if name not in ENCODING_PROFILES:
+            parser.error(f"未知的编码配置: {name}")
+    
+    try:
+        calibrate(video_size, fps=args.fps, duration=args.duration, font_path=args.font,
+                  profiles=profiles, output_path=args.output)
+    except Exception as e:
+        print(f"[错误] 编码校准失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,205 @@
+"""
+ffmpeg工具模块
+定位ffmpeg可执行文件、执行命令、解码音频以及无损拼接视频片段并封装音轨
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def get_ffmpeg_exe():
+    """
+    获取ffmpeg可执行文件路径，优先使用MoviePy自带的ffmpeg，其次使用PATH中的ffmpeg
+    
+    返回:
+        str: ffmpeg可执行文件路径
+    """
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        pass
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError("找不到ffmpeg，请安装ffmpeg或imageio-ffmpeg")
+    return ffmpeg
+
+
+def run_ffmpeg(args):
+    """
+    执行ffmpeg命令，失败时抛出异常并附带ffmpeg的错误输出
+    
+    参数:
+        args: ffmpeg参数列表（不含可执行文件本身）
+    """
+    command = [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y'] + list(args)
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg执行失败: {result.stderr.strip()}")
+
+
+class RawVideoWriter:
+    """
+    通过管道把RGB帧逐帧交给ffmpeg编码
+    
+    调用方每次只需持有当前一帧，内存占用与视频长度无关。
+    """
+    
+    def __init__(self, output_file, size, fps, video_args, threads=0):
+        """
+        启动ffmpeg编码进程
+        
+        参数:
+            output_file: 输出视频文件路径（不含音频）
+            size: 帧尺寸 (width, height)
+            fps: 帧率
+            video_args: 视频编码参数
+            threads: 编码线程数，0表示由ffmpeg自动决定
+        """
+        self.output_file = output_file
+        self.frames = 0
+        # 错误输出写入临时文件，避免管道写满后与stdin互相阻塞
+        self._stderr = tempfile.TemporaryFile()
+        command = [
+            get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{size[0]}x{size[1]}", '-framerate', str(fps),
+            '-i', '-'
+        ] + list(video_args) + [
+            '-threads', str(threads), '-an',
+            output_file
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+    
+    def write_frame(self, frame):
+        """
+        写入一帧
+        
+        参数:
+            frame: 形状为 (高, 宽, 3) 的uint8 RGB数组
+        """
+        try:
+            self._process.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            # ffmpeg已退出，由close报告它的错误输出
+            self.close()
+            raise RuntimeError("ffmpeg编码进程意外退出")
+        self.frames += 1
+    
+    def close(self):
+        """结束输入并等待编码完成，ffmpeg失败时抛出异常并附带其错误输出"""
+        if self._process is None:
+            return
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode('utf-8', 'replace').strip()
+        self._stderr.close()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg执行失败: {stderr}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self._process is not None:
+            # 渲染出错时直接结束编码进程，不保留不完整的输出
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+            self._stderr.close()
+            if os.path.exists(self.output_file):
+                os.remove(self.output_file)
+            return False
+        self.close()
+        return False
+
+
+def decode_audio(audio_file, sample_rate, channels):
+    """
+    把音频文件解码为16位小端PCM
+    
+    参数:
+        audio_file: 音频文件路径
+        sample_rate: 输出采样率
+        channels: 输出声道数
+    
+    返回:
+        bytes: PCM数据
+    """
+    command = [
+        get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-i', audio_file,
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ar', str(sample_rate), '-ac', str(channels), '-'
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg解码音频失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout
+
+
+def mux_audio(video_file, audio_file, output_file, audio_args):
+    """
+    把一条完整的音轨封装到视频上，视频码流直接复制
+    
+    参数:
+        video_file: 视频文件路径（其中的音频流会被忽略）
+        audio_file: 音轨文件路径
+        output_file: 输出视频文件路径
+        audio_args: 音频编码参数，例如 ['-c:a', 'aac', '-b:a', '192k']
+    
+    返回:
+        str: 输出视频文件路径
+    """
+    run_ffmpeg([
+        '-i', video_file, '-i', audio_file,
+        '-map', '0:v:0', '-map', '1:a:0',
+        '-c:v', 'copy'
+    ] + list(audio_args) + [
+        '-movflags', '+faststart',
+        output_file
+    ])
+    return output_file
+
+
+def concat_segments(segment_files, output_file, audio_file=None, audio_args=None):
+    """
+    使用concat demuxer拼接编码参数一致的视频片段，直接复制视频码流不重新编码
+    
+    参数:
+        segment_files: 视频片段路径列表
+        output_file: 输出视频文件路径
+        audio_file: 可选的完整音轨，提供时在同一步中编码为音频流封装进去，片段自身的音频被忽略
+        audio_args: 音轨的编码参数，提供audio_file时必需
+    
+    返回:
+        str: 输出视频文件路径
+    """
+    list_file = f"{output_file}.concat.txt"
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment_file in segment_files:
+            path = os.path.abspath(segment_file).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+    try:
+        if audio_file is None:
+            run_ffmpeg([
+                '-f', 'concat', '-safe', '0', '-i', list_file,
+                '-c', 'copy', '-movflags', '+faststart',
+                output_file
+            ])
+        else:
+            run_ffmpeg([
+                '-f', 'concat', '-safe', '0', '-i', list_file,
+                '-i', audio_file,
+                '-map', '0:v:0', '-map', '1:a:0',
+                '-c:v', 'copy'
+            ] + list(audio_args) + [
+                '-movflags', '+faststart',
+                output_file
+            ])
+    finally:
+        os.remove(list_file)
+    return output_file
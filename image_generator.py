@@ -3,24 +3,51 @@
 使用火山引擎API生成图片
 """
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from volcenginesdkarkruntime import Ark
 from config import Config
+from cache import IndexedDiskCache, make_cache_key
+from downloader import Downloader
+from image_ingest import normalize_image
+from rate_limit import get_guard
+import metrics
+from utils import save_items_to_json
 
 
 class ImageGenerator:
     """图片生成器"""
     
-    def __init__(self):
+    def __init__(self, use_cache=True):
+        """
+        初始化图片生成器
+        
+        参数:
+            use_cache: 是否使用跨项目共享的图片缓存
+        """
         self.client = Ark(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
-            api_key=Config.ARK_API_KEY
+            base_url=Config.ARK_BASE_URL,
+            api_key=Config.ARK_API_KEY,
+            max_retries=0  # 重试由guard统一处理
         )
         self.model = "doubao-seedream-4-0-250828"
+        self.guard = get_guard('ark')
+        self.response_format = Config.IMAGE_RESPONSE_FORMAT
+        self.downloader = Downloader()
+        self.cache = None
+        if use_cache:
+            self.cache = IndexedDiskCache(
+                Config.IMAGE_CACHE_DIR,
+                max_bytes=Config.IMAGE_CACHE_MAX_MB * 1024 * 1024,
+                suffix='.jpg'
+            )
     
     def generate_image(self, prompt, output_path, size="1080x1920"):
         """
         生成单张图片
         
+        相同模型、提示词和尺寸的图片优先从缓存链接到output_path，未命中时才调用接口生成。
+        得到图片后立即按size预处理为铺满裁剪的画面（见image_ingest），渲染时不再缩放。
+        
         参数:
             prompt: 图片生成提示词
             output_path: 输出图片路径
@@ -33,39 +60,81 @@ class ImageGenerator:
             # 确保输出目录存在
             os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
             
-            images_response = self.client.images.generate(
-                model=self.model,
-                prompt=prompt,
-                size=size,
-                response_format="url",
-                watermark=False
-            )
+            cache_key = None
+            if self.cache is not None:
+                cache_key = make_cache_key(self.model, prompt, size)
+                if self.cache.link_to(cache_key, output_path):
+                    print(f"[图片生成] 命中缓存，图片已保存到: {output_path}")
+                    self._ingest(output_path, size)
+                    return output_path
+            
+            with metrics.timer('provider_call', provider='ark', call='image_generate'):
+                images_response = self.guard.call(
+                    self.client.images.generate,
+                    model=self.model,
+                    prompt=prompt,
+                    size=size,
+                    response_format=self.response_format,
+                    watermark=False
+                )
+            
+            image_data = images_response.data[0]
+            if self.response_format == "b64_json":
+                # 图片内容随响应返回，无需再次请求
+                self.downloader.save_base64(image_data.b64_json, output_path)
+            else:
+                # 下载图片
+                with metrics.timer('provider_call', provider='ark', call='image_download'):
+                    self.downloader.download(image_data.url, output_path)
+            metrics.record_bytes('image', output_path)
             
-            # 下载图片
-            import urllib.request
-            image_url = images_response.data[0].url
-            urllib.request.urlretrieve(image_url, output_path)
+            if cache_key is not None:
+                self.cache.put_file(cache_key, output_path, meta={'model': self.model, 'size': size})
             
             print(f"[图片生成] 图片已保存到: {output_path}")
+            self._ingest(output_path, size)
             return output_path
         except Exception as e:
             print(f"[图片生成] 生成图片失败: {e}")
             return None
     
-    def generate_images_batch(self, items, output_dir, image_size="1080x1920"):
+    def _ingest(self, image_path, size):
+        """
+        把图片预处理为视频尺寸的画面，失败时只打印警告，渲染时会再次尝试
+        
+        参数:
+            image_path: 图片路径
+            size: 视频尺寸，格式为 "宽x高"
+        """
+        try:
+            normalize_image(image_path, size)
+        except Exception as e:
+            print(f"[图片生成] 预处理图片失败 {image_path}: {e}")
+    
+    def generate_images_batch(self, items, output_dir, image_size="1080x1920", max_workers=None, json_file_path=None):
         """
         批量生成图片，并更新到items中
         
+        多个图片任务在线程池中并发执行，同时进行的任务数不超过max_workers。
+        每完成一项就写回items，并在提供json_file_path时立即保存，中途崩溃只会丢失正在进行的任务。
+        
         参数:
             items: 项目列表，每个项目包含 Prompt, Image 等字段
             output_dir: 输出目录
             image_size: 图片尺寸，格式为 "宽x高"，例如 "1080x1920" 或 "1080x1440"
+            max_workers: 最大并发数，默认为配置中的IMAGE_MAX_WORKERS
+            json_file_path: 检查点JSON文件路径，为None时不保存
         
         返回:
             无，直接更新items中的Image字段
         """
         os.makedirs(output_dir, exist_ok=True)
         
+        if max_workers is None:
+            max_workers = Config.IMAGE_MAX_WORKERS
+        max_workers = max(1, max_workers)
+        
+        tasks = []
         for i, item in enumerate(items):
             # 如果已有Image，跳过
             if item.get('Image'):
@@ -79,7 +148,23 @@ class ImageGenerator:
                 continue
             
             output_path = os.path.join(output_dir, f"image_{i+1}.jpg")
-            result = self.generate_image(prompt, output_path, size=image_size)
-            if result:
-                item['Image'] = result
-
+            tasks.append((i, prompt, output_path))
+        
+        if not tasks:
+            return
+        
+        print(f"[图片生成] 共 {len(tasks)} 张图片待生成，并发数 {min(max_workers, len(tasks))}")
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            futures = {
+                executor.submit(self.generate_image, prompt, output_path, image_size): i
+                for i, prompt, output_path in tasks
+            }
+            # 结果在主线程中按完成顺序写回，检查点保存无需加锁
+            for future in as_completed(futures):
+                i = futures[future]
+                result = future.result()
+                if not result:
+                    continue
+                items[i]['Image'] = result
+                if json_file_path:
+                    save_items_to_json(items, json_file_path)
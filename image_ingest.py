@@ -0,0 +1,99 @@
+"""
+图片预处理模块
+图片生成后立即按视频尺寸铺满裁剪（cover-fit）为一帧画面，保存在原图旁边，
+渲染时直接读取尺寸已对齐的画面，不再重复解码原图和缩放
+"""
+import glob
+import os
+import uuid
+from PIL import Image, ImageOps
+from cache import hash_file
+import metrics
+
+# 预处理逻辑版本，处理结果变化时递增以废弃旧的画面
+NORMALIZE_VERSION = 1
+
+# 预处理画面的JPEG质量
+NORMALIZED_QUALITY = 95
+
+
+def parse_size(size):
+    """
+    解析尺寸
+    
+    参数:
+        size: "宽x高" 字符串或 (width, height)
+    
+    返回:
+        tuple: (width, height)
+    """
+    if isinstance(size, str):
+        width, height = (int(n) for n in size.lower().split('x'))
+        return width, height
+    return int(size[0]), int(size[1])
+
+
+def normalized_path(image_path, video_size, source_hash=None):
+    """
+    计算预处理画面的路径：与原图同目录，文件名包含原图内容哈希和目标尺寸
+    
+    参数:
+        image_path: 原图路径
+        video_size: 目标尺寸
+        source_hash: 原图内容的sha256，默认重新计算
+    
+    返回:
+        str: 预处理画面路径
+    """
+    width, height = parse_size(video_size)
+    if source_hash is None:
+        source_hash = hash_file(image_path)
+    stem = os.path.splitext(image_path)[0]
+    return f"{stem}.v{NORMALIZE_VERSION}.{source_hash[:16]}.{width}x{height}.jpg"
+
+
+def normalize_image(image_path, video_size):
+    """
+    把图片铺满裁剪为video_size大小的画面，已有相同原图和尺寸的结果时直接返回
+    
+    缩放比例取宽、高比例中较大的一个，使画面完全覆盖目标尺寸，再居中裁剪。
+    JPEG原图先按所需尺寸以draft模式解码（DCT域缩小），再用Lanczos重采样到精确尺寸。
+    
+    参数:
+        image_path: 原图路径
+        video_size: 目标尺寸，"宽x高" 或 (width, height)
+    
+    返回:
+        str: 预处理画面路径
+    """
+    width, height = parse_size(video_size)
+    output_path = normalized_path(image_path, (width, height))
+    hit = os.path.exists(output_path)
+    metrics.inc('cache_requests_total', cache='normalized_images', result='hit' if hit else 'miss')
+    if hit:
+        return output_path
+    
+    with metrics.timer('image_normalize'):
+        with Image.open(image_path) as image:
+            # draft只会缩小到不小于请求尺寸的最大比例，铺满所需的尺寸按原图宽高比计算
+            scale = max(width / image.width, height / image.height)
+            if scale < 1 and image.format == 'JPEG':
+                image.draft('RGB', (int(image.width * scale) + 1, int(image.height * scale) + 1))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            frame = ImageOps.fit(image, (width, height), method=Image.LANCZOS, centering=(0.5, 0.5))
+        
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.part"
+        frame.save(tmp_path, format='JPEG', quality=NORMALIZED_QUALITY, subsampling=0)
+        os.replace(tmp_path, output_path)
+    
+    # 原图被替换后，旧的预处理画面不再需要
+    stem = os.path.splitext(image_path)[0]
+    for stale_path in glob.glob(f"{glob.escape(stem)}.v*.*.{width}x{height}.jpg"):
+        if stale_path != output_path:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+    metrics.record_bytes('normalized_image', output_path)
+    return output_path
@@ -0,0 +1,99 @@
+"""
+增量JSON数组解析模块
+逐块读入模型的流式输出，数组中的每个元素一完整就立即解析返回，无需等待整个数组结束
+"""
+import json
+
+
+class JsonArrayStream:
+    """
+    JSON数组的增量解析器
+    
+    跳过数组开始前的任何内容（例如 ```json 代码块标记），只解析第一个顶层数组；
+    数组结束后的内容会被忽略。
+    """
+    
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element_start = None
+    
+    @property
+    def finished(self):
+        """是否已读到数组结束的 ]"""
+        return self._finished
+    
+    def feed(self, text):
+        """
+        读入一段文本
+        
+        参数:
+            text: 新到达的文本
+        
+        返回:
+            list: 本次读入后新完成的元素（已解析）
+        """
+        if self._finished or not text:
+            return []
+        self._buffer += text
+        elements = []
+        buffer = self._buffer
+        pos = self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if not self._started:
+                if char == '[':
+                    self._started = True
+                    self._depth = 1
+                pos += 1
+                continue
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                pos += 1
+                continue
+            
+            if self._depth == 1 and (char in ',]' or char.isspace()):
+                if self._element_start is not None:
+                    # 顶层的标量元素在逗号、空白或 ] 处结束（对象和数组在闭合时已经返回）
+                    elements.append(json.loads(buffer[self._element_start:pos]))
+                    self._element_start = None
+                if char == ']':
+                    self._finished = True
+                    pos += 1
+                    break
+                pos += 1
+                continue
+            
+            if self._depth == 1 and self._element_start is None:
+                self._element_start = pos
+            if char == '"':
+                self._in_string = True
+            elif char in '[{':
+                self._depth += 1
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 1:
+                    elements.append(json.loads(buffer[self._element_start:pos + 1]))
+                    self._element_start = None
+            pos += 1
+        
+        # 已处理的内容不再需要，只保留未完成的元素
+        if self._element_start is not None:
+            self._buffer = buffer[self._element_start:]
+            self._pos = pos - self._element_start
+            self._element_start = 0
+        else:
+            self._buffer = ''
+            self._pos = 0
+        return elements
@@ -1,43 +1,163 @@
 """
 主程序入口
 自动化生成视频流程：输入配置 -> 生成脚本 -> 生成提示词 -> 生成图片 -> 生成语音 -> 生成视频
+
+各服务商的SDK和MoviePy导入较慢，只在实际用到对应阶段时才导入
 """
+import argparse
 import sys
 import os
+import threading
 from config import Config
-from prompt_generator import PromptGenerator
-from image_generator import ImageGenerator
-from voice_generator import generate_audio_for_items
+from encoding_profiles import ENCODING_PROFILES
+from pipeline import SEGMENT_STAGES, ProviderLimits, run_segment_pipeline
+import metrics
+from state_store import ItemStore
 from utils import (
     load_input_config,
-    load_items_from_json,
-    save_items_to_json,
     create_temp_dir,
     generate_slide_list_from_items,
-    generate_output_filename,
-    calculate_audio_duration
+    generate_output_filename
 )
-from video_generator import VideoGenerator
+
+# 全部阶段，按执行顺序排列
+STAGES = ('script',) + SEGMENT_STAGES + ('render',)
+
+# 各阶段使用的服务商，用于只验证需要的配置
+STAGE_PROVIDERS = {
+    'script': 'deepseek',
+    'prompts': 'deepseek',
+    'images': 'ark',
+    'audio': 'tts',
+}
 
 
-def main(json_file_path):
+def select_stages(stages=None, from_stage=None):
     """
-    主流程函数
+    根据命令行参数确定要执行的阶段
     
     参数:
-        json_file_path: JSON输入文件路径（包含video_size, images, voice, font等配置）
+        stages: 逗号分隔的阶段名称，例如 "script,prompts"
+        from_stage: 从该阶段开始执行之后的全部阶段
+    
+    返回:
+        tuple: 按执行顺序排列的阶段名称
     """
-    print("=" * 60)
-    print("开始自动化视频生成流程")
-    print("=" * 60)
+    selected = set(STAGES)
+    if stages:
+        selected = {stage.strip() for stage in stages.split(',') if stage.strip()}
+        unknown = selected - set(STAGES)
+        if unknown:
+            raise ValueError(f"未知的阶段: {', '.join(sorted(unknown))}，可选: {', '.join(STAGES)}")
+    if from_stage:
+        if from_stage not in STAGES:
+            raise ValueError(f"未知的阶段: {from_stage}，可选: {', '.join(STAGES)}")
+        selected &= set(STAGES[STAGES.index(from_stage):])
+    return tuple(stage for stage in STAGES if stage in selected)
+
+
+class ProjectClients:
+    """
+    各服务商的客户端
     
-    # 1. 验证配置
+    DeepSeek和火山引擎各一个客户端，语音生成器按语音名称各一个，批量运行时由所有项目共享，
+    复用连接池、合成器池和缓存。
+    """
+    
+    def __init__(self, use_cache=True):
+        """
+        初始化客户端，各客户端在第一次使用时才创建
+        
+        参数:
+            use_cache: 是否使用DeepSeek返回结果、图片和语音缓存
+        """
+        self.use_cache = use_cache
+        self._prompt_gen = None
+        self._image_gen = None
+        self._voice_gens = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def prompt_gen(self):
+        """DeepSeek提示词生成器"""
+        with self._lock:
+            if self._prompt_gen is None:
+                from prompt_generator import PromptGenerator
+                self._prompt_gen = PromptGenerator(use_cache=self.use_cache)
+            return self._prompt_gen
+    
+    @property
+    def image_gen(self):
+        """火山引擎图片生成器"""
+        with self._lock:
+            if self._image_gen is None:
+                from image_generator import ImageGenerator
+                self._image_gen = ImageGenerator(use_cache=self.use_cache)
+            return self._image_gen
+    
+    def voice_gen(self, voice_name):
+        """
+        获取指定语音的语音生成器，不存在时创建
+        
+        参数:
+            voice_name: 语音名称
+        
+        返回:
+            VoiceGenerator: 语音生成器
+        """
+        with self._lock:
+            voice_gen = self._voice_gens.get(voice_name)
+            if voice_gen is None:
+                from voice_generator import VoiceGenerator
+                voice_gen = VoiceGenerator(voice_name=voice_name, use_cache=self.use_cache)
+                self._voice_gens[voice_name] = voice_gen
+            return voice_gen
+    
+    def close(self):
+        """关闭语音合成器池和下载连接池"""
+        with self._lock:
+            for voice_gen in self._voice_gens.values():
+                voice_gen.close()
+            self._voice_gens.clear()
+            if self._image_gen is not None:
+                self._image_gen.downloader.close()
+
+
+def stream_script(prompt_gen, config, limits):
+    """
+    流式生成视频脚本，占用DeepSeek的并发名额直到输出结束
+    
+    参数:
+        prompt_gen: PromptGenerator实例
+        config: 输入配置
+        limits: ProviderLimits实例
+    
+    返回:
+        generator: 逐段产出的 {title, subtitle} 字典；生成失败时打印错误并提前结束，已产出的段仍然保留
+    """
     try:
-        Config.validate()
-        print("[配置] 配置验证通过")
-    except ValueError as e:
-        print(f"[错误] {e}")
-        return
+        with limits.slot('deepseek'), metrics.timer('stage', stage='script'):
+            yield from prompt_gen.stream_video_script(config['text'], config['images'])
+    except Exception as e:
+        print(f"[脚本生成] 流式生成视频脚本失败: {e}")
+
+
+def prepare_project(json_file_path, clients, limits=None, stages=STAGES):
+    """
+    生成一个项目的脚本、图片提示词、图片、语音和时长（调用各服务商API的阶段）
+    
+    每个阶段只补齐缺少的内容，已有的脚本、提示词、图片和语音会保留。
+    
+    参数:
+        json_file_path: JSON输入文件路径（包含video_size, images, voice, font等配置）
+        clients: ProjectClients实例
+        limits: 可选的ProviderLimits实例，多个项目共享时对各服务商的并发请求数合计不超过上限
+        stages: 要执行的阶段，未包含的阶段不会创建对应的客户端
+    
+    返回:
+        dict: 项目信息，包含 config, items, temp_dir, output_json_path 字段，失败时返回None
+    """
+    limits = limits or ProviderLimits.from_config()
     
     # 2. 加载输入配置
     try:
@@ -47,7 +167,7 @@ def main(json_file_path):
         print(f"[配置] 视频尺寸: {config['video_size']}")
     except Exception as e:
         print(f"[错误] 加载输入配置失败: {e}")
-        return
+        return None
     
     # 3. 创建临时目录（基于name字段）
     temp_dir = create_temp_dir(config['name'])
@@ -57,125 +177,221 @@ def main(json_file_path):
     
     # 4. 生成视频脚本（包含title和subtitle）
     print("\n" + "=" * 60)
-    print("步骤 1/6: 生成视频脚本")
+    print(f"步骤 1/6: 生成视频脚本（{config['name']}）")
     print("=" * 60)
-    prompt_gen = PromptGenerator()
-    
-    # 检查是否已有生成的JSON文件
-    items = []
-    if os.path.exists(output_json_path):
-        try:
-            items = load_items_from_json(output_json_path)
-            print(f"[脚本] 从已有JSON文件加载了 {len(items)} 个项目")
-        except:
-            pass
-    
-    # 如果没有已有数据，生成新的脚本
-    if not items or len(items) != config['images']:
-        items = prompt_gen.generate_video_script(config['text'], config['images'])
-        # 保存初始脚本
-        save_items_to_json(items, output_json_path)
-    
-    # 5. 生成图片提示词
-    print("\n" + "=" * 60)
-    print("步骤 2/6: 生成图片提示词")
-    print("=" * 60)
-    prompt_gen.generate_image_prompts(items)
-    save_items_to_json(items, output_json_path)
     
-    # 6. 生成图片
-    print("\n" + "=" * 60)
-    print("步骤 3/6: 生成图片")
-    print("=" * 60)
-    image_gen = ImageGenerator()
-    
-    # 准备视频尺寸用于图片生成
-    video_size = config['video_size']
-    if isinstance(video_size, list):
-        image_size = f"{video_size[0]}x{video_size[1]}"
-    else:
-        image_size = "1080x1920"
+    # 检查是否已有生成的数据（状态数据库，或在上次导出后被手工修改过的JSON文件）
+    store = ItemStore(os.path.join(temp_dir, f"{config['name']}.db"))
+    try:
+        items = store.load_or_import(output_json_path)
+        if items:
+            print(f"[脚本] 从已有数据加载了 {len(items)} 个项目")
+        
+        # 如果没有已有数据，生成新的脚本
+        segment_stages = [stage for stage in SEGMENT_STAGES if stage in stages]
+        script_stream = None
+        if 'script' not in stages:
+            if not items:
+                print("[错误] 没有已生成的脚本，请先执行script阶段")
+                return None
+        elif not items or len(items) != config['images']:
+            if Config.SCRIPT_STREAMING and segment_stages:
+                # 脚本边生成边交给流水线，第1段的语音和提示词不必等模型写完最后一段
+                items = []
+                store.replace_all(items)
+                script_stream = stream_script(clients.prompt_gen, config, limits)
+            else:
+                with limits.slot('deepseek'), metrics.timer('stage', stage='script'):
+                    items = clients.prompt_gen.generate_video_script(config['text'], config['images'])
+                # 保存初始脚本
+                store.replace_all(items)
+                store.export_json(output_json_path)
+        
+        # 5. 按段流水线生成图片提示词、图片、语音并计算时长
+        # 每段的 提示词 -> 图片 与 语音 -> 时长 独立推进，只在生成视频前汇合
+        if not segment_stages:
+            return {
+                'config': config,
+                'items': items,
+                'temp_dir': temp_dir,
+                'output_json_path': output_json_path
+            }
+        print("\n" + "=" * 60)
+        print(f"步骤 2-5/6: 按段并行生成图片提示词、图片、语音并计算时长（{config['name']}）")
+        print("=" * 60)
+        
+        # 准备视频尺寸用于图片生成
+        video_size = config['video_size']
+        if isinstance(video_size, list):
+            image_size = f"{video_size[0]}x{video_size[1]}"
+        else:
+            image_size = "1080x1920"
+        
+        with metrics.timer('stage', stage='assets'):
+            errors = run_segment_pipeline(
+                items,
+                clients.prompt_gen if 'prompts' in stages else None,
+                clients.image_gen if 'images' in stages else None,
+                clients.voice_gen(config['voice']) if 'audio' in stages else None,
+                image_dir, audio_dir, image_size=image_size, store=store, limits=limits,
+                stages=segment_stages, script_stream=script_stream
+            )
+        if script_stream is not None:
+            if not items:
+                print("[错误] 视频脚本生成失败")
+                return None
+            if len(items) != config['images']:
+                print(f"[警告] 期望生成{config['images']}段，实际生成{len(items)}段")
+        metrics.inc('segments_total', len(items))
+        if errors:
+            print(f"[警告] 有 {len(errors)} 个任务失败，对应的幻灯片将被跳过")
+        store.export_json(output_json_path)
+    finally:
+        store.close()
     
-    image_gen.generate_images_batch(items, image_dir, image_size=image_size)
-    save_items_to_json(items, output_json_path)
+    return {
+        'config': config,
+        'items': items,
+        'temp_dir': temp_dir,
+        'output_json_path': output_json_path
+    }
+
+
+def render_project(project, use_cache=True, encoding_profile=None):
+    """
+    把prepare_project生成的素材渲染为视频（本地渲染阶段）
     
-    # 7. 生成语音
-    print("\n" + "=" * 60)
-    print("步骤 4/6: 生成语音")
-    print("=" * 60)
-    generate_audio_for_items(items, config['voice'], audio_dir)
-    save_items_to_json(items, output_json_path)
+    参数:
+        project: prepare_project返回的项目信息
+        use_cache: 是否使用文字叠加层和幻灯片片段缓存
+        encoding_profile: 编码配置名称；输入配置中指定了encoding_profile时以输入配置为准，
+                          都未指定时使用配置中的ENCODING_PROFILE
     
-    # 8. 计算时长并更新到items中
-    print("\n" + "=" * 60)
-    print("步骤 5/6: 计算时长")
-    print("=" * 60)
-    for i, item in enumerate(items):
-        if item.get('audio') and (not item.get('duration') or item.get('duration') == 0):
-            duration = calculate_audio_duration(item['audio'])
-            if duration > 0:
-                item['duration'] = duration
-                print(f"[时长计算] 第 {i+1} 项：{duration:.2f} 秒")
-            else:
-                item['duration'] = 3.0  # 默认时长
-                print(f"[时长计算] 第 {i+1} 项：使用默认时长 3.0 秒")
+    返回:
+        str: 输出视频文件路径，失败时返回None
+    """
+    from video_generator import VideoGenerator
     
-    save_items_to_json(items, output_json_path)
+    config = project['config']
+    temp_dir = project['temp_dir']
     
-    # 9. 生成幻灯片列表
+    # 6. 生成幻灯片列表
     print("\n" + "=" * 60)
-    print("步骤 6/6: 生成视频")
+    print(f"步骤 6/6: 生成视频（{config['name']}）")
     print("=" * 60)
     try:
-        slides = generate_slide_list_from_items(items)
+        slides = generate_slide_list_from_items(project['items'])
         if not slides:
             print("[错误] 没有有效的幻灯片")
-            return
+            return None
     except Exception as e:
         print(f"[错误] 生成幻灯片列表失败: {e}")
-        return
+        return None
     
-    # 10. 生成视频
+    # 7. 生成视频
     video_size = config['video_size']
     if isinstance(video_size, list):
         video_size = tuple(video_size)
     else:
         video_size = (1080, 1920)
     
-    video_gen = VideoGenerator(
-        font_path=config['font'],
-        video_size=video_size,
-        font_size=config['font_size']
-    )
+    encoding_profile = config.get('encoding_profile') or encoding_profile
+    try:
+        video_gen = VideoGenerator(
+            font_path=config['font'],
+            video_size=video_size,
+            font_size=config['font_size'],
+            use_cache=use_cache,
+            encoding_profile=encoding_profile
+        )
+    except ValueError as e:
+        print(f"[错误] {e}")
+        return None
+    print(f"[视频生成] 编码配置: {encoding_profile or Config.ENCODING_PROFILE}")
     output_file = generate_output_filename(config['name'], temp_dir)
     
     try:
-        video_gen.create_video(slides, output_file)
+        with metrics.timer('stage', stage='render'):
+            video_gen.create_video(slides, output_file)
     except Exception as e:
         print(f"[错误] 生成视频失败: {e}")
+        return None
+    return output_file
+
+
+def main(json_file_path, use_cache=True, stages=STAGES, encoding_profile=None):
+    """
+    主流程函数
+    
+    参数:
+        json_file_path: JSON输入文件路径（包含video_size, images, voice, font等配置）
+        use_cache: 是否使用DeepSeek返回结果、图片、语音、文字叠加层和幻灯片片段缓存
+        stages: 要执行的阶段，默认为全部阶段
+        encoding_profile: 编码配置名称，默认为配置中的ENCODING_PROFILE
+    """
+    print("=" * 60)
+    print("开始自动化视频生成流程")
+    print("=" * 60)
+    
+    # 1. 验证配置
+    try:
+        Config.validate({STAGE_PROVIDERS[stage] for stage in stages if stage in STAGE_PROVIDERS})
+        print("[配置] 配置验证通过")
+    except ValueError as e:
+        print(f"[错误] {e}")
         return
     
-    # 11. 完成
+    clients = ProjectClients(use_cache=use_cache)
+    try:
+        project = prepare_project(json_file_path, clients, stages=stages)
+    finally:
+        clients.close()
+    if project is None:
+        return
+    
+    if 'render' not in stages:
+        metrics.write_summary(metrics.summary_path(project['temp_dir']))
+        print(f"\n✅ 已完成阶段: {', '.join(stages)}")
+        print(f"📁 JSON文件: {project['output_json_path']}")
+        return
+    
+    output_file = render_project(project, use_cache=use_cache, encoding_profile=encoding_profile)
+    metrics.write_summary(metrics.summary_path(project['temp_dir']))
+    if output_file is None:
+        return
+    
+    # 8. 完成
     print("\n" + "=" * 60)
     print("完成")
     print("=" * 60)
     print(f"\n✅ 视频生成完成！")
     print(f"📁 输出文件: {output_file}")
-    print(f"📁 临时文件: {temp_dir}")
-    print(f"📁 JSON文件: {output_json_path}")
+    print(f"📁 临时文件: {project['temp_dir']}")
+    print(f"📁 JSON文件: {project['output_json_path']}")
+    print(f"📁 运行指标: {metrics.summary_path(project['temp_dir'])}")
     print("\n" + "=" * 60)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法: python main.py <json_file_path>")
-        print("示例: python main.py input.json")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="自动化生成视频")
+    parser.add_argument("json_file_path", help="JSON输入文件路径，例如 input.json")
+    parser.add_argument("--no-cache", action="store_true", help="不使用缓存，重新请求模型、生成图片和语音")
+    parser.add_argument("--stages", default=None,
+                        help=f"只执行这些阶段（逗号分隔），可选: {','.join(STAGES)}；各阶段只补齐缺少的内容")
+    parser.add_argument("--from-stage", default=None, choices=STAGES, help="从该阶段开始执行之后的全部阶段")
+    parser.add_argument("--encoding-profile", default=None, choices=list(ENCODING_PROFILES),
+                        help="编码配置，默认为ENCODING_PROFILE")
+    args = parser.parse_args()
+    
+    try:
+        stages = select_stages(args.stages, args.from_stage)
+    except ValueError as e:
+        parser.error(str(e))
     
-    json_file_path = sys.argv[1]
+    json_file_path = args.json_file_path
     
     if not os.path.exists(json_file_path):
         print(f"[错误] 文件不存在: {json_file_path}")
         sys.exit(1)
     
-    main(json_file_path)
+    main(json_file_path, use_cache=not args.no_cache, stages=stages, encoding_profile=args.encoding_profile)
@@ -0,0 +1,263 @@
+"""
+指标模块
+记录服务商调用和渲染步骤的次数与耗时分布、写入的字节数以及缓存命中情况，
+运行结束时输出为JSON或Prometheus文本格式的汇总
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+
+# 耗时直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class MetricsRegistry:
+    """
+    线程安全的计数器和直方图集合
+    
+    每个指标由名称和标签唯一确定，例如 provider_call_seconds{provider="ark", call="image_generate"}。
+    """
+    
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+    
+    def inc(self, name, value=1, **labels):
+        """
+        计数器增加value
+        
+        参数:
+            name: 指标名称
+            value: 增加的值
+            labels: 标签
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        """
+        向直方图记录一个观测值
+        
+        参数:
+            name: 指标名称
+            value: 观测值（秒）
+            labels: 标签
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+                self._histograms[key] = histogram
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            else:
+                histogram['buckets'][-1] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        统计代码块的耗时和结果：耗时记入 <name>_seconds 直方图，次数记入 <name>_total 计数器（按 result 区分成功和失败）
+        
+        参数:
+            name: 指标名称前缀
+            labels: 标签
+        """
+        start = time.perf_counter()
+        result = 'ok'
+        try:
+            yield
+        except BaseException:
+            result = 'error'
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            self.inc(f"{name}_total", result=result, **labels)
+    
+    def drain(self):
+        """
+        取出并清空当前记录的全部指标，用于把子进程中的指标带回主进程
+        
+        返回:
+            dict: 可序列化的指标快照
+        """
+        with self._lock:
+            snapshot = {'counters': self._counters, 'histograms': self._histograms}
+            self._counters = {}
+            self._histograms = {}
+        return snapshot
+    
+    def merge(self, snapshot):
+        """
+        合并drain返回的指标快照
+        
+        参数:
+            snapshot: 指标快照
+        """
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, other in snapshot['histograms'].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    self._histograms[key] = {
+                        'buckets': list(other['buckets']), 'sum': other['sum'], 'count': other['count']
+                    }
+                    continue
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+    
+    def cache_hit_rates(self):
+        """
+        计算各缓存的命中率
+        
+        返回:
+            dict: 缓存名称到 {hits, misses, hit_rate} 的字典
+        """
+        rates = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if name != 'cache_requests_total':
+                    continue
+                labels = dict(labels)
+                entry = rates.setdefault(labels.get('cache', ''), {'hits': 0, 'misses': 0})
+                entry['hits' if labels.get('result') == 'hit' else 'misses'] += value
+        for entry in rates.values():
+            total = entry['hits'] + entry['misses']
+            entry['hit_rate'] = entry['hits'] / total if total else 0.0
+        return rates
+    
+    def to_json(self):
+        """
+        汇总为JSON对象
+        
+        返回:
+            dict: 包含 counters, histograms, cache_hit_rates 字段
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram['count'],
+                    'sum': round(histogram['sum'], 6),
+                    'avg': round(histogram['sum'] / histogram['count'], 6) if histogram['count'] else 0.0,
+                    'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram['buckets'])),
+                }
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {'counters': counters, 'histograms': histograms, 'cache_hit_rates': self.cache_hit_rates()}
+    
+    def to_prometheus(self):
+        """
+        汇总为Prometheus文本格式（可供node_exporter的textfile收集器读取）
+        
+        返回:
+            str: Prometheus文本
+        """
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (
+                (k, v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs
+            )
+            return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+        
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram['buckets']):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return '\n'.join(lines) + '\n'
+    
+    def write_summary(self, path):
+        """
+        把指标汇总写入文件，扩展名为 .prom 时使用Prometheus文本格式，否则使用JSON
+        
+        参数:
+            path: 输出文件路径
+        
+        返回:
+            str: 输出文件路径
+        """
+        os.makedirs(os.path.dirname(path) if os.path.dirname(path) else '.', exist_ok=True)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        print(f"[指标] 已保存运行指标到: {path}")
+        return path
+
+
+# 进程内共享的指标集合
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+drain = registry.drain
+merge = registry.merge
+write_summary = registry.write_summary
+
+
+def record_bytes(kind, path):
+    """
+    记录写入的文件大小
+    
+    参数:
+        kind: 文件类型，例如 "image"、"audio"、"segment"、"video"
+        path: 文件路径
+    """
+    try:
+        inc('bytes_written_total', os.path.getsize(path), kind=kind)
+    except OSError:
+        pass
+
+
+def summary_path(directory, name='metrics'):
+    """
+    按配置的METRICS_FORMAT生成指标文件路径
+    
+    参数:
+        directory: 输出目录
+        name: 文件名（不含扩展名）
+    
+    返回:
+        str: 指标文件路径
+    """
+    extension = '.prom' if Config.METRICS_FORMAT == 'prometheus' else '.json'
+    return os.path.join(directory, f"{name}{extension}")
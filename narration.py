@@ -0,0 +1,144 @@
+"""
+旁白音轨模块
+把各段语音拼接为一条连续的旁白音轨，每段从所在幻灯片的起始位置开始（按采样点对齐），
+WAV/PCM格式的语音直接复制采样数据，其他格式用ffmpeg解码，不经过MP3的重复编解码，也不经过MoviePy逐帧处理
+"""
+import os
+import struct
+import wave
+from ffmpeg_utils import decode_audio
+
+# 16位PCM的采样字节数
+SAMPLE_WIDTH = 2
+
+
+def read_wav_pcm(audio_file):
+    """
+    读取16位PCM WAV文件的格式和采样数据（按内容识别，不依赖扩展名）
+    
+    流式写入的WAV可能没有回填data块长度，此时读取到文件末尾。
+    
+    参数:
+        audio_file: 音频文件路径
+    
+    返回:
+        tuple: (采样率, 声道数, PCM数据)，不是16位PCM WAV时返回None
+    """
+    with open(audio_file, 'rb') as f:
+        data = f.read()
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None
+    
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        body = pos + 8
+        if chunk_id == b'fmt ' and chunk_size >= 16:
+            fmt = struct.unpack('<HHIIHH', data[body:body + 16])
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            audio_format, channels, sample_rate, _, _, bits = fmt
+            # 1为PCM，0xFFFE为WAVE_FORMAT_EXTENSIBLE（Azure的PCM输出可能使用）
+            if audio_format not in (1, 0xFFFE) or bits != SAMPLE_WIDTH * 8:
+                return None
+            available = len(data) - body
+            if chunk_size == 0 or chunk_size == 0xFFFFFFFF or chunk_size > available:
+                chunk_size = available
+            frame_size = channels * SAMPLE_WIDTH
+            chunk_size -= chunk_size % frame_size
+            return sample_rate, channels, data[body:body + chunk_size]
+        pos = body + chunk_size + (chunk_size & 1)
+    return None
+
+
+def choose_track_format(audio_files, default_sample_rate=44100, default_channels=1):
+    """
+    选择旁白音轨的采样率和声道数：所有语音都是相同格式的16位PCM WAV时沿用该格式，无需重采样
+    
+    参数:
+        audio_files: 语音文件路径列表
+        default_sample_rate: 语音格式不一致或不是WAV时使用的采样率
+        default_channels: 语音格式不一致或不是WAV时使用的声道数
+    
+    返回:
+        tuple: (采样率, 声道数)
+    """
+    formats = set()
+    for audio_file in audio_files:
+        wav = read_wav_pcm(audio_file)
+        formats.add(wav[:2] if wav is not None else None)
+    if len(formats) == 1 and None not in formats:
+        return formats.pop()
+    return default_sample_rate, default_channels
+
+
+def load_pcm(audio_file, sample_rate, channels):
+    """
+    读取一段语音的16位PCM采样数据，格式一致的WAV直接读取，其他情况用ffmpeg解码并重采样
+    
+    参数:
+        audio_file: 语音文件路径
+        sample_rate: 需要的采样率
+        channels: 需要的声道数
+    
+    返回:
+        bytes: PCM数据
+    """
+    wav = read_wav_pcm(audio_file)
+    if wav is not None and wav[0] == sample_rate and wav[1] == channels:
+        return wav[2]
+    return decode_audio(audio_file, sample_rate, channels)
+
+
+def build_narration_track(audio_files, output_file, boundaries=None, sample_rate=None, channels=None):
+    """
+    把各段语音拼接为一条16位PCM WAV旁白音轨
+    
+    提供boundaries时，第i段语音从boundaries[i]秒处开始，超出本段长度的部分截断、不足的部分补静音，
+    各段的起止位置换算为采样点后取整，拼接过程中不会累积误差；不提供时各段按原始长度首尾相接。
+    采样数据逐段写入输出文件，内存占用与单段语音大小相当。
+    
+    参数:
+        audio_files: 语音文件路径列表
+        output_file: 输出WAV文件路径
+        boundaries: 可选的各段起始时间（秒）列表，长度为段数加1，最后一个元素为音轨总时长
+        sample_rate: 输出采样率，默认由choose_track_format决定
+        channels: 输出声道数，默认由choose_track_format决定
+    
+    返回:
+        tuple: (输出文件路径, 总采样点数)
+    """
+    if boundaries is not None and len(boundaries) != len(audio_files) + 1:
+        raise ValueError("boundaries的长度必须为语音段数加1")
+    if sample_rate is None or channels is None:
+        track_rate, track_channels = choose_track_format(audio_files)
+        sample_rate = sample_rate or track_rate
+        channels = channels or track_channels
+    frame_size = channels * SAMPLE_WIDTH
+    
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    tmp_file = f"{output_file}.part"
+    total = 0
+    with wave.open(tmp_file, 'wb') as track:
+        track.setnchannels(channels)
+        track.setsampwidth(SAMPLE_WIDTH)
+        track.setframerate(sample_rate)
+        for index, audio_file in enumerate(audio_files):
+            pcm = load_pcm(audio_file, sample_rate, channels)
+            if boundaries is not None:
+                start = round(boundaries[index] * sample_rate)
+                end = round(boundaries[index + 1] * sample_rate)
+                if start > total:
+                    # 与上一段之间的空隙补静音
+                    track.writeframes(b'\0' * ((start - total) * frame_size))
+                    total = start
+                length = max(0, end - total)
+                pcm = pcm[:length * frame_size]
+                pcm += b'\0' * (length * frame_size - len(pcm))
+            track.writeframes(pcm)
+            total += len(pcm) // frame_size
+    os.replace(tmp_file, output_file)
+    return output_file, total
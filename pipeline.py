@@ -0,0 +1,416 @@
+"""
+流水线调度模块
+按依赖关系调度每一段的任务：提示词 -> 图片，字幕 -> 语音 -> 时长，
+各段之间互不等待，只在渲染前汇合
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from config import Config
+from utils import calculate_audio_duration
+
+# 流水线中的素材生成阶段
+SEGMENT_STAGES = ('prompts', 'images', 'audio')
+
+
+class ProviderLimits:
+    """
+    各服务商的并发名额
+    
+    同一个实例可以在多个项目的流水线之间共享，使对同一服务商的请求总数不超过上限。
+    名额已满时，等待者按先后顺序排队，名额释放时直接交给队首，而不是让等待者各自阻塞在线程里。
+    """
+    
+    def __init__(self, limits=None):
+        """
+        初始化并发名额
+        
+        参数:
+            limits: 各服务商的最大并发数，例如 {"deepseek": 4, "ark": 4, "tts": 4}
+        """
+        self.sizes = {name: max(1, n) for name, n in (limits or {}).items()}
+        self._in_use = {name: 0 for name in self.sizes}
+        self._queues = {name: deque() for name in self.sizes}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls):
+        """按配置中的 PROMPT_MAX_WORKERS、IMAGE_MAX_WORKERS 和 TTS_MAX_WORKERS 创建"""
+        return cls({
+            'deepseek': Config.PROMPT_MAX_WORKERS,
+            'ark': Config.IMAGE_MAX_WORKERS,
+            # 语音合成的并发数由所有语音合成服务商共同遵守
+            'tts': Config.TTS_MAX_WORKERS
+        })
+    
+    def dispatch(self, provider, start):
+        """
+        有空闲名额时立即调用start，否则排队，等其他调用释放名额后再调用；start中必须能快速返回
+        （例如把任务提交到线程池），占用的名额由任务结束时调用release释放
+        
+        参数:
+            provider: 服务商名称，可以为None；未限制的服务商不占用名额，直接调用start
+            start: 无参数的可调用对象
+        """
+        if provider not in self.sizes:
+            start()
+            return
+        with self._lock:
+            if self._in_use[provider] >= self.sizes[provider]:
+                self._queues[provider].append(start)
+                return
+            self._in_use[provider] += 1
+        start()
+    
+    def release(self, provider):
+        """
+        释放一个名额，有排队的调用时把名额直接交给队首
+        
+        参数:
+            provider: 服务商名称，可以为None
+        """
+        if provider not in self.sizes:
+            return
+        with self._lock:
+            queue = self._queues[provider]
+            if not queue:
+                self._in_use[provider] -= 1
+                return
+            start = queue.popleft()
+        start()
+    
+    @contextmanager
+    def slot(self, provider):
+        """
+        占用一个服务商并发名额的上下文管理器，没有空闲名额时在当前线程中排队等待
+        
+        参数:
+            provider: 服务商名称，可以为None
+        """
+        acquired = threading.Event()
+        self.dispatch(provider, acquired.set)
+        acquired.wait()
+        try:
+            yield
+        finally:
+            self.release(provider)
+
+
+class TaskGraph:
+    """
+    依赖驱动的任务调度器
+    
+    任务的所有依赖完成后才提交到线程池执行；依赖失败的任务直接跳过。
+    指定了provider的任务在拿到该服务商的并发名额后才提交到线程池，保证对同一服务商的请求数不超过上限，
+    某个服务商的名额用满时，它排队的任务不占用线程，其他服务商的任务照常执行。
+    运行期间（例如在run的feed回调中）也可以继续添加任务，新任务的依赖已完成时立即开始执行。
+    """
+    
+    def __init__(self, limits=None, max_workers=None):
+        """
+        初始化任务调度器
+        
+        参数:
+            limits: 各服务商的最大并发数，例如 {"deepseek": 4, "ark": 4, "tts": 4}，
+                    也可以是多个调度器共享的ProviderLimits实例
+            max_workers: 线程池大小，默认为各服务商并发数之和再加4
+        """
+        if not isinstance(limits, ProviderLimits):
+            limits = ProviderLimits(limits)
+        self.limits = limits
+        if max_workers is None:
+            max_workers = sum(limits.sizes.values()) + 4
+        self.max_workers = max_workers
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._all_done = threading.Condition(self._lock)
+        self._executor = None
+        self._results = {}
+        self._errors = {}
+        self._finished = set()
+        self._waiting = {}
+        self._dependents = {}
+        self._remaining = 0
+    
+    def add(self, name, func, deps=(), provider=None):
+        """
+        添加任务
+        
+        参数:
+            name: 任务名称，需唯一
+            func: 无参数的可调用对象
+            deps: 依赖的任务名称列表，None会被忽略
+            provider: 任务使用的服务商名称，用于并发限制
+        
+        返回:
+            str: 任务名称
+        """
+        deps = [dep for dep in deps if dep is not None]
+        with self._lock:
+            if name in self._tasks:
+                raise ValueError(f"任务名称重复: {name}")
+            for dep in deps:
+                if dep not in self._tasks:
+                    raise ValueError(f"任务 {name} 依赖的任务不存在: {dep}")
+            self._tasks[name] = {'func': func, 'deps': deps, 'provider': provider}
+            if self._executor is None:
+                return name
+            
+            # 运行期间添加：只等待尚未完成的依赖
+            pending = [dep for dep in deps if dep not in self._finished]
+            self._waiting[name] = len(pending)
+            self._dependents[name] = []
+            for dep in pending:
+                self._dependents[dep].append(name)
+            self._remaining += 1
+            executor = self._executor
+        if not pending:
+            self._dispatch(name, executor)
+        return name
+    
+    def _dispatch(self, name, executor):
+        """依赖都已完成的任务拿到服务商名额后提交到线程池"""
+        task = self._tasks[name]
+        provider = task['provider']
+        if any(dep in self._errors for dep in task['deps']):
+            # 会被跳过的任务不需要名额
+            provider = None
+        self.limits.dispatch(provider, partial(executor.submit, self._execute, name, provider))
+    
+    def _execute(self, name, provider):
+        task = self._tasks[name]
+        try:
+            failed = [dep for dep in task['deps'] if dep in self._errors]
+            if failed:
+                raise RuntimeError(f"依赖任务失败: {', '.join(failed)}")
+            self._results[name] = task['func']()
+        except Exception as e:
+            self._errors[name] = e
+            print(f"[调度] 任务 {name} 失败: {e}")
+        finally:
+            self.limits.release(provider)
+            self._finish(name)
+    
+    def _finish(self, name):
+        ready = []
+        with self._lock:
+            self._finished.add(name)
+            self._remaining -= 1
+            for dependent in self._dependents[name]:
+                self._waiting[dependent] -= 1
+                if self._waiting[dependent] == 0:
+                    ready.append(dependent)
+            if self._remaining == 0:
+                self._all_done.notify_all()
+            executor = self._executor
+        for dependent in ready:
+            self._dispatch(dependent, executor)
+    
+    def run(self, feed=None):
+        """
+        执行所有任务，全部完成（或跳过）后返回
+        
+        参数:
+            feed: 可选的无参数可调用对象，调度开始后在当前线程中执行，可以在其中继续添加任务；
+                  feed返回且所有任务都结束后run才返回，feed抛出的异常在任务结束后重新抛出
+        
+        返回:
+            tuple: (results, errors)，分别为任务名称到返回值、任务名称到异常的字典
+        """
+        self._results = {}
+        self._errors = {}
+        if not self._tasks and feed is None:
+            return self._results, self._errors
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            with self._lock:
+                self._executor = executor
+                self._finished = set()
+                self._waiting = {name: len(task['deps']) for name, task in self._tasks.items()}
+                self._dependents = {name: [] for name in self._tasks}
+                for name, task in self._tasks.items():
+                    for dep in task['deps']:
+                        self._dependents[dep].append(name)
+                self._remaining = len(self._tasks)
+                ready = [name for name, count in self._waiting.items() if count == 0]
+            for name in ready:
+                self._dispatch(name, executor)
+            
+            try:
+                if feed is not None:
+                    feed()
+            finally:
+                with self._lock:
+                    while self._remaining:
+                        self._all_done.wait()
+                    self._executor = None
+        
+        return self._results, self._errors
+
+
+def run_segment_pipeline(items, prompt_gen, image_gen, voice_gen, image_dir, audio_dir,
+                         image_size="1080x1920", store=None, limits=None, stages=SEGMENT_STAGES,
+                         script_stream=None):
+    """
+    按段流水线生成提示词、图片、语音和时长，并更新到items中
+    
+    每段的 提示词 -> 图片 与 语音 -> 时长 两条链独立推进，例如第1段的语音在脚本生成后立即开始，
+    第1段的图片在其所在批次的提示词生成后立即开始。对DeepSeek、火山引擎和Azure的并发请求数
+    分别受 PROMPT_MAX_WORKERS、IMAGE_MAX_WORKERS 和 TTS_MAX_WORKERS 限制，传入共享的limits时
+    这些上限由同时运行的所有项目共同遵守。
+    
+    参数:
+        items: 项目列表，每个项目包含 title, subtitle 等字段
+        prompt_gen: PromptGenerator实例
+        image_gen: ImageGenerator实例
+        voice_gen: VoiceGenerator实例
+        image_dir: 图片保存目录
+        audio_dir: 音频保存目录
+        image_size: 图片尺寸，格式为 "宽x高"
+        store: 可选的ItemStore，每完成一个任务就把变化的字段原子地写入，为None时不保存
+        limits: 可选的ProviderLimits实例，默认按配置为本次调用单独创建
+        stages: 要执行的阶段，为 SEGMENT_STAGES 的子集；未执行阶段对应的生成器可以为None
+        script_stream: 可选的脚本段迭代器，每产出一个 {title, subtitle} 就追加到items并立即调度该段的任务，
+                       使前面各段的素材生成与模型继续输出后面的段重叠进行
+    
+    返回:
+        dict: 失败任务名称到异常的字典
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    os.makedirs(audio_dir, exist_ok=True)
+    
+    # items只在持有锁时修改，工作线程读取的都是快照
+    lock = threading.Lock()
+    
+    def snapshot(i):
+        with lock:
+            return dict(items[i])
+    
+    def commit(i, **fields):
+        with lock:
+            items[i].update(fields)
+        if store is not None:
+            store.update(i, **fields)
+    
+    def generate_prompts(indices):
+        with lock:
+            copies = [dict(item) for item in items]
+        prompt_gen.generate_image_prompts(copies, indices=indices)
+        for i in indices:
+            if copies[i].get('Prompt'):
+                commit(i, Prompt=copies[i]['Prompt'])
+    
+    def generate_image(i):
+        prompt = snapshot(i).get('Prompt')
+        if not prompt:
+            print(f"[警告] 第 {i+1} 项缺少Prompt字段，跳过图片生成")
+            return
+        output_path = os.path.join(image_dir, f"image_{i+1}.jpg")
+        result = image_gen.generate_image(prompt, output_path, size=image_size)
+        if not result:
+            raise RuntimeError(f"第 {i+1} 项图片生成失败")
+        commit(i, Image=result)
+    
+    def generate_audio(i):
+        audio_file = os.path.join(audio_dir, f"audio_{i+1}.wav")
+        audio_file, duration = voice_gen.generate_audio(snapshot(i)['subtitle'], audio_file)
+        print(f"[语音生成] 第 {i+1}/{len(items)} 段语音已生成")
+        if duration:
+            commit(i, audio=audio_file, duration=duration)
+        else:
+            commit(i, audio=audio_file)
+    
+    def measure_duration(i):
+        item = snapshot(i)
+        if not item.get('audio') or item.get('duration'):
+            return
+        duration = calculate_audio_duration(item['audio'])
+        if duration > 0:
+            print(f"[时长计算] 第 {i+1} 项：{duration:.2f} 秒")
+        else:
+            duration = 3.0  # 默认时长
+            print(f"[时长计算] 第 {i+1} 项：使用默认时长 3.0 秒")
+        commit(i, duration=duration)
+    
+    graph = TaskGraph(limits=limits or ProviderLimits.from_config())
+    
+    # 提示词按批次生成，每个批次是一个任务，批次内各段的图片任务依赖该批次；
+    # 边生成脚本边调度时，第一段立即单独请求，之后未凑满一批的段最多等待STREAM_PROMPT_FLUSH_SECONDS，
+    # 让图片生成尽早开始，不必等到脚本结束
+    batch_size = max(1, Config.PROMPT_BATCH_SIZE)
+    prompt_chunk = []
+    chunk_started = None
+    flushed_any = False
+    
+    def flush_prompts():
+        nonlocal flushed_any
+        if not prompt_chunk:
+            return
+        chunk = [i for i, _ in prompt_chunk]
+        needs_image = [i for i, wanted in prompt_chunk if wanted]
+        prompt_chunk.clear()
+        flushed_any = True
+        name = graph.add(f"prompt:{chunk[0]+1}-{chunk[-1]+1}", partial(generate_prompts, chunk), provider='deepseek')
+        for i in needs_image:
+            graph.add(f"image:{i+1}", partial(generate_image, i), deps=[name], provider='ark')
+    
+    def schedule(i):
+        nonlocal chunk_started
+        item = snapshot(i)
+        needs_prompt = (
+            'prompts' in stages and not item.get('Prompt') and (item.get('title') or item.get('subtitle'))
+        )
+        if needs_prompt:
+            if not prompt_chunk:
+                chunk_started = time.monotonic()
+            prompt_chunk.append((i, 'images' in stages and not item.get('Image')))
+            if len(prompt_chunk) >= batch_size:
+                flush_prompts()
+            elif script_stream is not None and (
+                not flushed_any
+                or time.monotonic() - chunk_started >= Config.STREAM_PROMPT_FLUSH_SECONDS
+            ):
+                flush_prompts()
+        elif 'images' in stages and not item.get('Image'):
+            if item.get('Prompt'):
+                graph.add(f"image:{i+1}", partial(generate_image, i), provider='ark')
+            else:
+                print(f"[警告] 第 {i+1} 项缺少Prompt字段，跳过图片生成")
+        
+        if 'audio' not in stages:
+            return
+        
+        audio_task = None
+        if not item.get('audio'):
+            if item.get('subtitle'):
+                audio_task = graph.add(f"audio:{i+1}", partial(generate_audio, i), provider='tts')
+            else:
+                print(f"[警告] 第 {i+1} 项缺少subtitle，跳过语音生成")
+        
+        if (item.get('audio') or audio_task) and not item.get('duration'):
+            graph.add(f"duration:{i+1}", partial(measure_duration, i), deps=[audio_task])
+    
+    def feed():
+        if script_stream is None:
+            for i in range(len(items)):
+                schedule(i)
+        else:
+            # 脚本边生成边调度：每收到一段就开始生成它的提示词、图片和语音
+            for item in script_stream:
+                if not isinstance(item, dict):
+                    print(f"[警告] 脚本中的元素不是对象，已忽略: {item}")
+                    continue
+                with lock:
+                    items.append(item)
+                    i = len(items) - 1
+                if store is not None:
+                    store.update(i, **item)
+                schedule(i)
+        flush_prompts()
+    
+    _, errors = graph.run(feed)
+    return errors
@@ -4,28 +4,121 @@
 """
 from openai import OpenAI
 from config import Config
+from cache import DiskCache, make_cache_key
+from rate_limit import get_guard
+from json_stream import JsonArrayStream
+import metrics
 import json
 
 
 class PromptGenerator:
     """提示词生成器"""
     
-    def __init__(self):
+    def __init__(self, use_cache=True):
+        """
+        初始化提示词生成器
+        
+        参数:
+            use_cache: 是否使用磁盘缓存复用相同请求的返回结果
+        """
         self.client = OpenAI(
             api_key=Config.DEEPSEEK_API_KEY,
-            base_url=Config.DEEPSEEK_BASE_URL
+            base_url=Config.DEEPSEEK_BASE_URL,
+            max_retries=0  # 重试由guard统一处理
         )
+        self.model = "deepseek-chat"
+        self.guard = get_guard('deepseek')
+        self.cache = None
+        if use_cache:
+            self.cache = DiskCache(
+                Config.LLM_CACHE_DIR,
+                max_bytes=Config.LLM_CACHE_MAX_MB * 1024 * 1024,
+                max_age=Config.LLM_CACHE_MAX_AGE_DAYS * 24 * 3600,
+                suffix='.json'
+            )
     
-    def generate_video_script(self, text, num_segments):
+    def _chat_completion(self, messages, temperature=0.7, parse=None):
         """
-        基于文本生成视频脚本，包含N段内容，每段包含title和subtitle
+        调用聊天补全接口，相同的模型、消息和温度直接返回缓存结果
+        
+        参数:
+            messages: 消息列表
+            temperature: 采样温度
+            parse: 可选的解析函数，只有解析成功的返回内容才会写入缓存
+        
+        返回:
+            模型返回的文本内容，提供parse时返回解析结果
+        """
+        if parse is None:
+            parse = lambda content: content
+        
+        key = None
+        if self.cache is not None:
+            key = make_cache_key(self.model, messages, temperature)
+            cached = self.cache.get_bytes(key)
+            if cached is not None:
+                try:
+                    return parse(json.loads(cached.decode('utf-8'))['content'])
+                except Exception:
+                    pass
+        
+        with metrics.timer('provider_call', provider='deepseek', call='chat_completion'):
+            response = self.guard.call(
+                self.client.chat.completions.create,
+                model=self.model,
+                messages=messages,
+                temperature=temperature
+            )
+        content = response.choices[0].message.content
+        result = parse(content)
+        
+        if key is not None and content:
+            record = {'model': self.model, 'content': content}
+            self.cache.put_bytes(key, json.dumps(record, ensure_ascii=False).encode('utf-8'))
+        return result
+    
+    def _parse_json_response(self, response_text):
+        """
+        从模型返回的文本中解析JSON（可能包含markdown代码块）
+        
+        参数:
+            response_text: 模型返回的文本
+        
+        返回:
+            解析后的JSON对象
+        """
+        response_text = response_text.strip()
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+        return json.loads(response_text)
+    
+    def _parse_json_array(self, response_text):
+        """
+        从模型返回的文本中解析JSON数组
+        
+        参数:
+            response_text: 模型返回的文本
+        
+        返回:
+            list: 解析后的数组
+        """
+        result = self._parse_json_response(response_text)
+        if not isinstance(result, list):
+            raise ValueError("返回的不是数组格式")
+        return result
+    
+    def _script_messages(self, text, num_segments):
+        """
+        构造生成视频脚本的消息列表
         
         参数:
             text: 输入文本
             num_segments: 需要生成的段数（图片个数）
         
         返回:
-            list: 项目列表，每个项目包含 title, subtitle 字段
+            list: 消息列表
         """
         script_prompt = f"""请基于以下文本内容，生成一个包含{num_segments}段内容的视频脚本。每段内容需要包含：
 1. title: 该段的标题（简短，作为字幕显示）
@@ -48,31 +141,30 @@ class PromptGenerator:
 ]
 
 只返回JSON数组，不要包含其他文字说明。"""
+        return [
+            {"role": "user", "content": script_prompt}
+        ]
+    
+    def generate_video_script(self, text, num_segments):
+        """
+        基于文本生成视频脚本，包含N段内容，每段包含title和subtitle
         
+        参数:
+            text: 输入文本
+            num_segments: 需要生成的段数（图片个数）
+        
+        返回:
+            list: 项目列表，每个项目包含 title, subtitle 字段
+        """
         try:
             print(f"[脚本生成] 正在生成{num_segments}段视频脚本...")
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "user", "content": script_prompt}
-                ],
-                temperature=0.7
+            # 生成并解析JSON
+            items = self._chat_completion(
+                self._script_messages(text, num_segments),
+                temperature=0.7,
+                parse=self._parse_json_array
             )
             
-            response_text = response.choices[0].message.content.strip()
-            
-            # 尝试提取JSON（可能包含markdown代码块）
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            # 解析JSON
-            items = json.loads(response_text)
-            
-            if not isinstance(items, list):
-                raise ValueError("返回的不是数组格式")
-            
             if len(items) != num_segments:
                 print(f"[警告] 期望生成{num_segments}段，实际生成{len(items)}段")
             
@@ -81,16 +173,96 @@ class PromptGenerator:
             
         except Exception as e:
             print(f"[脚本生成] 生成视频脚本失败: {e}")
-
     
-    def generate_image_prompts(self, items):
+    def stream_video_script(self, text, num_segments, temperature=0.7):
+        """
+        以流式输出生成视频脚本，每段的JSON对象一完整就立即产出，
+        调用方可以在模型继续输出后面各段的同时处理前面的段
+        
+        与generate_video_script使用相同的请求和缓存键，缓存命中时直接逐段产出缓存的结果。
+        
+        参数:
+            text: 输入文本
+            num_segments: 需要生成的段数（图片个数）
+            temperature: 采样温度
+        
+        返回:
+            generator: 逐段产出的 {title, subtitle} 字典；请求失败时抛出异常（已产出的段仍然有效）
+        """
+        messages = self._script_messages(text, num_segments)
+        key = None
+        if self.cache is not None:
+            key = make_cache_key(self.model, messages, temperature)
+            cached = self.cache.get_bytes(key)
+            if cached is not None:
+                try:
+                    items = self._parse_json_array(json.loads(cached.decode('utf-8'))['content'])
+                except Exception:
+                    items = None
+                if items is not None:
+                    print(f"[脚本生成] 使用缓存的{len(items)}段视频脚本")
+                    yield from items
+                    return
+        
+        print(f"[脚本生成] 正在流式生成{num_segments}段视频脚本...")
+        parser = JsonArrayStream()
+        parts = []
+        count = 0
+        with metrics.timer('provider_call', provider='deepseek', call='chat_completion_stream'):
+            # 重试只覆盖建立连接；开始输出后中断时直接抛出，已产出的段不会重复
+            stream = self.guard.call(
+                self.client.chat.completions.create,
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                for item in parser.feed(delta):
+                    count += 1
+                    yield item
+        
+        content = ''.join(parts)
+        if not parser.finished:
+            raise ValueError(f"视频脚本输出不完整，已收到{count}段")
+        if count != num_segments:
+            print(f"[警告] 期望生成{num_segments}段，实际生成{count}段")
+        print(f"[脚本生成] 成功生成{count}段视频脚本")
+        
+        if key is not None:
+            try:
+                self._parse_json_array(content)
+            except Exception:
+                return
+            record = {'model': self.model, 'content': content}
+            self.cache.put_bytes(key, json.dumps(record, ensure_ascii=False).encode('utf-8'))
+    
+    def generate_image_prompts(self, items, batch_size=None, indices=None):
         """
         为每段内容生成对应的图片生成提示词，并更新到items中
         
+        默认使用批量模式：每batch_size段合并为一次请求，模型以JSON数组返回各段提示词并按序号写回，
+        各段在同一请求中生成，画面风格更统一。批量结果中缺失或不合格的段再单独请求。
+        
         参数:
             items: 项目列表，每个项目包含 title, subtitle 等字段
+            batch_size: 每次请求包含的段数，默认为配置中的PROMPT_BATCH_SIZE，小于等于1时逐段请求
+            indices: 只为这些下标的段生成提示词，默认为全部
         """
-        for i, item in enumerate(items):
+        if batch_size is None:
+            batch_size = Config.PROMPT_BATCH_SIZE
+        if indices is None:
+            indices = range(len(items))
+        
+        pending = []
+        for i in indices:
+            item = items[i]
             # 如果已有Prompt，跳过
             if item.get('Prompt'):
                 print(f"[提示词生成] 第 {i+1}/{len(items)} 段已有提示词，跳过")
@@ -103,8 +275,32 @@ class PromptGenerator:
                 print(f"[警告] 第 {i+1} 项缺少title和subtitle，跳过")
                 continue
             
-            # 生成图片提示词
-            prompt_request = f"""请为以下视频内容生成一个详细的图片生成提示词（中文）。
+            pending.append(i)
+        
+        if batch_size > 1:
+            failed = []
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                failed.extend(self._generate_image_prompts_batch(items, chunk))
+            pending = failed
+        
+        for i in pending:
+            self._generate_image_prompt(items, i)
+    
+    def _generate_image_prompt(self, items, i):
+        """
+        单独为第i段生成图片提示词
+        
+        参数:
+            items: 项目列表
+            i: 段的下标
+        """
+        item = items[i]
+        title = item.get('title', '')
+        subtitle = item.get('subtitle', '')
+        
+        # 生成图片提示词
+        prompt_request = f"""请为以下视频内容生成一个详细的图片生成提示词（中文）。
 
 标题：{title}
 字幕：{subtitle}
@@ -114,18 +310,84 @@ class PromptGenerator:
 - 风格要统一，适合视频内容
 
 只返回提示词内容，不要包含其他说明。"""
+
+        try:
+            response_text = self._chat_completion(
+                [
+                    {"role": "user", "content": prompt_request}
+                ],
+                temperature=0.7
+            )
+            full_prompt = response_text.strip()
             
-            try:
-                response = self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "user", "content": prompt_request}
-                    ],
-                    temperature=0.7
-                )
-                full_prompt = response.choices[0].message.content.strip()
-                
-                item['Prompt'] = full_prompt
+            item['Prompt'] = full_prompt
+            print(f"[提示词生成] 第 {i+1}/{len(items)} 段的图片提示词已生成")
+        except Exception as e:
+            print(f"[提示词生成] 生成第 {i+1} 段提示词失败: {e}")
+    
+    def _generate_image_prompts_batch(self, items, indices):
+        """
+        在一次请求中为多段内容生成图片提示词
+        
+        参数:
+            items: 项目列表
+            indices: 本批次各段的下标
+        
+        返回:
+            list: 未能从批量结果中得到合格提示词的段下标
+        """
+        segments = "\n".join(
+            f"{n}. 标题：{items[i].get('title', '')}；字幕：{items[i].get('subtitle', '')}"
+            for n, i in enumerate(indices, start=1)
+        )
+        prompt_request = f"""请为以下{len(indices)}段视频内容分别生成详细的图片生成提示词（中文）。
+
+{segments}
+
+要求：
+- 每段提示词要详细描述该段的画面内容
+- 各段风格要统一，适合作为同一个视频的连续画面
+- 每段都必须返回，序号与上面的编号一致
+
+请以JSON数组格式返回，每个元素包含index和prompt字段。格式如下：
+[
+  {{"index": 1, "prompt": "提示词1"}},
+  {{"index": 2, "prompt": "提示词2"}},
+  ...
+]
+
+只返回JSON数组，不要包含其他文字说明。"""
+
+        try:
+            print(f"[提示词生成] 正在批量生成第 {indices[0]+1}-{indices[-1]+1} 段的图片提示词...")
+            results = self._chat_completion(
+                [
+                    {"role": "user", "content": prompt_request}
+                ],
+                temperature=0.7,
+                parse=self._parse_json_array
+            )
+        except Exception as e:
+            print(f"[提示词生成] 批量生成提示词失败，改为逐段生成: {e}")
+            return list(indices)
+        
+        prompts = {}
+        for result in results:
+            if not isinstance(result, dict):
+                continue
+            n = result.get('index')
+            prompt = result.get('prompt')
+            if isinstance(n, int) and 1 <= n <= len(indices) and isinstance(prompt, str) and prompt.strip():
+                prompts[n] = prompt.strip()
+        
+        failed = []
+        for n, i in enumerate(indices, start=1):
+            if n in prompts:
+                items[i]['Prompt'] = prompts[n]
                 print(f"[提示词生成] 第 {i+1}/{len(items)} 段的图片提示词已生成")
-            except Exception as e:
-                print(f"[提示词生成] 生成第 {i+1} 段提示词失败: {e}")
+            else:
+                failed.append(i)
+        
+        if failed:
+            print(f"[提示词生成] 批量结果中有 {len(failed)} 段无效，将逐段重新生成")
+        return failed
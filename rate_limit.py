@@ -0,0 +1,323 @@
+"""
+服务商调用保护模块
+为DeepSeek、火山引擎、Azure和DashScope的每次调用提供统一的令牌桶限流、带抖动的指数退避重试（遵守Retry-After）
+和熔断，同一服务商的所有调用共享一个保护器
+"""
+import copy
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import Config
+import metrics
+
+# 可重试的HTTP状态码：请求超时、冲突、限流和服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """服务商返回的可重试错误（限流、超时、服务暂不可用等），retry_after为服务商建议的等待秒数"""
+    
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用未发出即被拒绝"""
+
+
+def _status_code(error):
+    """获取异常对应的HTTP状态码，没有时返回None"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def parse_retry_after(error):
+    """
+    从异常携带的响应头中读取Retry-After
+    
+    返回:
+        float: 等待秒数，没有时返回None
+    """
+    if isinstance(error, RetryableError):
+        return error.retry_after
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value:
+            return max(0.0, float(value) / 1000)
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """
+    判断异常是否值得重试
+    
+    参数:
+        error: 调用服务商时抛出的异常
+    
+    返回:
+        bool: 限流、超时、连接失败和服务端错误返回True，参数错误、鉴权失败等返回False
+    """
+    if isinstance(error, RetryableError):
+        return True
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # 各SDK的超时和连接异常没有公共基类，按类名识别
+    name = type(error).__name__
+    return 'Timeout' in name or 'Connection' in name
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+    
+    每秒补充rate个令牌，最多积累burst个；收到Retry-After时整个桶暂停发放，
+    让同一服务商的所有调用方一起等待，而不是各自重试。
+    """
+    
+    def __init__(self, rate, burst=None):
+        """
+        初始化令牌桶
+        
+        参数:
+            rate: 每秒允许的请求数，小于等于0时不限流
+            burst: 桶容量，默认为max(1, rate)
+        """
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """取得一个令牌，没有令牌或处于暂停期时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def pause(self, seconds):
+        """
+        暂停发放令牌
+        
+        参数:
+            seconds: 暂停秒数
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    连续failure_threshold次可重试的失败后打开，打开期间的调用直接失败；
+    reset_timeout秒后进入半开状态放行一次试探调用，成功则关闭，失败则重新打开。
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        初始化熔断器
+        
+        参数:
+            failure_threshold: 触发熔断的连续失败次数，小于等于0时不熔断
+            reset_timeout: 熔断持续秒数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def before_call(self, name):
+        """
+        调用前检查熔断状态
+        
+        参数:
+            name: 服务商名称，用于错误信息
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f"{name} 调用已熔断，{max(remaining, 0):.0f} 秒后重试")
+            self._probing = True
+    
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def release_probe(self):
+        """试探调用遇到不可重试的错误时结束试探，不改变熔断状态，之后可以再放行一次试探"""
+        with self._lock:
+            self._probing = False
+    
+    def record_failure(self):
+        """
+        记录一次可重试的失败
+        
+        返回:
+            bool: 本次失败是否使熔断器打开
+        """
+        with self._lock:
+            self._failures += 1
+            if self._probing or (0 < self.failure_threshold <= self._failures and self._opened_at is None):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+
+class ProviderGuard:
+    """
+    服务商调用保护器，组合令牌桶、重试和熔断
+    """
+    
+    def __init__(self, name, rate=0, burst=None, max_retries=None, backoff_base=None, backoff_max=None,
+                 failure_threshold=None, reset_timeout=None):
+        """
+        初始化保护器
+        
+        参数:
+            name: 服务商名称
+            rate: 每秒允许的请求数，小于等于0时不限流
+            burst: 令牌桶容量
+            max_retries: 可重试错误的最大重试次数，默认为配置中的PROVIDER_MAX_RETRIES
+            backoff_base: 第一次重试前的基础等待秒数，默认为配置中的RETRY_BACKOFF_BASE
+            backoff_max: 单次等待的上限秒数，默认为配置中的RETRY_BACKOFF_MAX
+            failure_threshold: 触发熔断的连续失败次数，默认为配置中的CIRCUIT_FAILURE_THRESHOLD
+            reset_timeout: 熔断持续秒数，默认为配置中的CIRCUIT_RESET_SECONDS
+        """
+        self.name = name
+        self.max_retries = max_retries if max_retries is not None else Config.PROVIDER_MAX_RETRIES
+        self.backoff_base = backoff_base if backoff_base is not None else Config.RETRY_BACKOFF_BASE
+        self.backoff_max = backoff_max if backoff_max is not None else Config.RETRY_BACKOFF_MAX
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(
+            failure_threshold if failure_threshold is not None else Config.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout if reset_timeout is not None else Config.CIRCUIT_RESET_SECONDS
+        )
+    
+    def with_retries(self, max_retries):
+        """
+        返回使用不同重试次数的保护器，与本保护器共享令牌桶和熔断器
+        
+        参数:
+            max_retries: 可重试错误的最大重试次数
+        
+        返回:
+            ProviderGuard: 保护器
+        """
+        guard = copy.copy(self)
+        guard.max_retries = max_retries
+        return guard
+    
+    def _backoff(self, attempt):
+        """第attempt次重试前的等待秒数（full jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def call(self, func, *args, **kwargs):
+        """
+        在限流、重试和熔断保护下调用func
+        
+        参数:
+            func: 实际发出请求的可调用对象
+            args, kwargs: 传给func的参数
+        
+        返回:
+            func的返回值；重试用尽、遇到不可重试的错误或已熔断时抛出最后一次的异常
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call(self.name)
+            self.bucket.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # 参数错误等与服务是否可用无关，不计入熔断，也不算作恢复
+                    self.breaker.release_probe()
+                    raise
+                metrics.inc('provider_errors_total', provider=self.name, error=type(e).__name__)
+                if self.breaker.record_failure():
+                    metrics.inc('circuit_open_total', provider=self.name)
+                    print(f"[限流] {self.name} 连续失败，熔断 {self.breaker.reset_timeout:.0f} 秒")
+                retry_after = parse_retry_after(e)
+                if retry_after is not None:
+                    # 服务商明确要求等待时，同一服务商的其他调用也一起暂停
+                    self.bucket.pause(min(retry_after, self.backoff_max))
+                if attempt >= self.max_retries:
+                    raise
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                delay = min(delay, self.backoff_max)
+                attempt += 1
+                metrics.inc('provider_retries_total', provider=self.name)
+                print(f"[限流] {self.name} 调用失败（{e}），{delay:.1f} 秒后第 {attempt} 次重试")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(provider):
+    """
+    获取服务商的共享保护器，不存在时按配置创建
+    
+    参数:
+        provider: 服务商名称："deepseek"、"ark"、"azure" 或 "dashscope"，其他名称不限流
+    
+    返回:
+        ProviderGuard: 保护器
+    """
+    with _guards_lock:
+        guard = _guards.get(provider)
+        if guard is None:
+            rate, burst = {
+                'deepseek': (Config.DEEPSEEK_RATE_LIMIT, Config.DEEPSEEK_RATE_BURST),
+                'ark': (Config.ARK_RATE_LIMIT, Config.ARK_RATE_BURST),
+                'azure': (Config.AZURE_TTS_RATE_LIMIT, Config.AZURE_TTS_RATE_BURST),
+                'dashscope': (Config.DASHSCOPE_TTS_RATE_LIMIT, Config.DASHSCOPE_TTS_RATE_BURST),
+            }.get(provider, (0, None))
+            guard = ProviderGuard(provider, rate=rate, burst=burst)
+            _guards[provider] = guard
+        return guard
@@ -0,0 +1,151 @@
+"""
+状态存储模块
+使用SQLite按字段记录每个项目的状态，每次更新都是一个独立的原子事务，
+并发的工作线程可以各自提交，并可随时导出为原有的JSON数组格式
+"""
+import json
+import os
+import sqlite3
+import threading
+from utils import load_items_from_json, save_items_to_json
+
+
+class ItemStore:
+    """项目状态存储"""
+    
+    def __init__(self, db_path):
+        """
+        打开（或创建）状态数据库
+        
+        参数:
+            db_path: SQLite数据库文件路径
+        """
+        os.makedirs(os.path.dirname(db_path) if os.path.dirname(db_path) else '.', exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # WAL模式下写入只追加日志，崩溃后自动回滚未完成的事务
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS item_fields (
+                idx INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (idx, field)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+    
+    def load(self):
+        """
+        读取全部项目
+        
+        返回:
+            list: items列表，没有数据时返回空列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, field, value FROM item_fields ORDER BY idx, rowid"
+            ).fetchall()
+        items = []
+        for idx, field, value in rows:
+            while len(items) <= idx:
+                items.append({})
+            items[idx][field] = json.loads(value)
+        return items
+    
+    def replace_all(self, items):
+        """
+        用新的items整体替换存储内容（例如重新生成脚本后）
+        
+        参数:
+            items: 项目列表
+        """
+        rows = [
+            (idx, field, json.dumps(value, ensure_ascii=False))
+            for idx, item in enumerate(items)
+            for field, value in item.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM item_fields")
+                self._conn.executemany(
+                    "INSERT INTO item_fields (idx, field, value) VALUES (?, ?, ?)", rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def update(self, index, **fields):
+        """
+        原子地更新一个项目的若干字段
+        
+        参数:
+            index: 项目下标
+            fields: 要更新的字段和值
+        """
+        rows = [(index, field, json.dumps(value, ensure_ascii=False)) for field, value in fields.items()]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 冲突时原地更新，保持字段原有顺序
+                self._conn.executemany("""
+                    INSERT INTO item_fields (idx, field, value) VALUES (?, ?, ?)
+                    ON CONFLICT (idx, field) DO UPDATE SET value = excluded.value
+                """, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def export_json(self, json_file_path):
+        """
+        导出为JSON数组格式，与 save_items_to_json 生成的文件兼容
+        
+        参数:
+            json_file_path: JSON文件路径
+        """
+        save_items_to_json(self.load(), json_file_path)
+        # 记录导出文件的修改时间，用于发现之后对JSON文件的手工修改
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('exported_json_mtime', ?)",
+                (str(os.stat(json_file_path).st_mtime_ns),)
+            )
+    
+    def load_or_import(self, json_file_path):
+        """
+        读取全部项目；数据库为空或JSON文件在上次导出后被修改过时，先从JSON文件导入
+        
+        参数:
+            json_file_path: JSON文件路径
+        
+        返回:
+            list: items列表
+        """
+        if os.path.exists(json_file_path):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM meta WHERE key = 'exported_json_mtime'"
+                ).fetchone()
+            if row is None or row[0] != str(os.stat(json_file_path).st_mtime_ns):
+                try:
+                    items = load_items_from_json(json_file_path)
+                    self.replace_all(items)
+                    print(f"[状态] 已从 {json_file_path} 导入 {len(items)} 个项目")
+                except Exception as e:
+                    print(f"[状态] 导入JSON文件失败: {e}")
+        return self.load()
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
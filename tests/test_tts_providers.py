@@ -0,0 +1,197 @@
+"""
+语音合成服务商路由的测试：用register_provider注册的替身服务商代替Azure和DashScope
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from rate_limit import RetryableError
+import rate_limit
+import tts_providers
+import voice_generator
+from tts_providers import SAMPLE_RATE, StreamingWavWriter, SynthesizerPool, TTSProvider, register_provider
+
+
+def make_provider(name, fail=False, default_voice='fake-default', latency=0):
+    """创建一个替身服务商类，记录每次合成使用的语音"""
+    
+    class FakeProvider(TTSProvider):
+        calls = []
+        
+        @classmethod
+        def is_configured(cls):
+            return True
+        
+        @classmethod
+        def voice_for(cls, voice_name=None):
+            return voice_name or default_voice
+        
+        def synthesize(self, text, output_file):
+            type(self).calls.append((text, self.voice))
+            time.sleep(latency)
+            if fail:
+                raise RetryableError(f"{name} 不可用")
+            writer = StreamingWavWriter(output_file)
+            writer.write(b'\x00\x00' * (SAMPLE_RATE // 10))
+            return writer.commit()
+    
+    FakeProvider.name = name
+    register_provider(FakeProvider)
+    return FakeProvider
+
+
+class TTSRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+        # 熔断器和令牌桶按服务商名称共享，每个测试从新的状态开始
+        self.addCleanup(rate_limit._guards.clear)
+        self.addCleanup(lambda: [tts_providers.PROVIDER_CLASSES.pop(name, None) for name in ('primary', 'backup')])
+        for name, value in {
+            'AUDIO_CACHE_DIR': os.path.join(self.work_dir, 'cache'),
+            'TTS_FAILOVER_RETRIES': 0,
+            'RETRY_BACKOFF_BASE': 0,
+            'CIRCUIT_FAILURE_THRESHOLD': 0,
+            'TTS_SLOW_CALL_SECONDS': 0,
+        }.items():
+            patcher = mock.patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(voice_generator, 'calculate_audio_duration', return_value=0.1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def use_providers(self, names):
+        patcher = mock.patch.object(Config, 'TTS_PROVIDERS', ','.join(names))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def generate(self, voice_gen, count, prefix='第'):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return list(executor.map(
+                lambda i: voice_gen.generate_audio(f"{prefix}{i}段", os.path.join(self.work_dir, f"{prefix}{i}.wav")),
+                range(count)
+            ))
+    
+    def test_fails_over_on_error_and_sticks_to_backup(self):
+        primary = make_provider('primary', fail=True)
+        backup = make_provider('backup')
+        self.use_providers(['primary', 'backup'])
+        voice_gen = voice_generator.VoiceGenerator('voice-a', use_cache=False)
+        
+        voice_gen.generate_audio("第一段", os.path.join(self.work_dir, 'a1.wav'))
+        self.assertEqual(len(primary.calls), 1)
+        self.assertEqual(voice_gen.router.current(), ('backup', 'voice-a'))
+        
+        # 切换后不再回到失败的服务商
+        self.generate(voice_gen, 5)
+        self.assertEqual(len(primary.calls), 1)
+        self.assertEqual(len(backup.calls), 6)
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, 'a1.wav')))
+    
+    def test_all_segments_use_primary_voice(self):
+        primary = make_provider('primary', default_voice='primary-voice')
+        backup = make_provider('backup', default_voice='backup-voice')
+        self.use_providers(['primary', 'backup'])
+        voice_gen = voice_generator.VoiceGenerator(use_cache=False)
+        
+        self.generate(voice_gen, 12)
+        self.assertEqual(backup.calls, [])
+        self.assertEqual({voice for _, voice in primary.calls}, {'primary-voice'})
+    
+    def test_cache_key_is_tied_to_provider_and_voice(self):
+        primary = make_provider('primary')
+        backup = make_provider('backup')
+        self.use_providers(['backup'])
+        self.generate(voice_generator.VoiceGenerator('voice-a'), 1)
+        self.assertEqual(len(backup.calls), 1)
+        
+        # 其他服务商缓存的语音不算命中
+        self.use_providers(['primary', 'backup'])
+        self.generate(voice_generator.VoiceGenerator('voice-a'), 1)
+        self.assertEqual(len(primary.calls), 1)
+        
+        # 同一服务商的其他语音不算命中，相同语音命中
+        self.generate(voice_generator.VoiceGenerator('voice-b'), 1)
+        self.assertEqual(len(primary.calls), 2)
+        self.generate(voice_generator.VoiceGenerator('voice-a'), 1)
+        self.generate(voice_generator.VoiceGenerator('voice-b'), 1)
+        self.assertEqual(len(primary.calls), 2)
+        self.assertEqual([voice for _, voice in primary.calls], ['voice-a', 'voice-b'])
+    
+    def test_slow_provider_is_demoted(self):
+        primary = make_provider('primary', latency=0.05)
+        backup = make_provider('backup')
+        self.use_providers(['primary', 'backup'])
+        voice_gen = voice_generator.VoiceGenerator('voice-a', use_cache=False)
+        
+        with mock.patch.object(Config, 'TTS_SLOW_CALL_SECONDS', 0.02):
+            for i in range(5):
+                voice_gen.generate_audio(f"第{i}段", os.path.join(self.work_dir, f"s{i}.wav"))
+        # 积累到足够的样本后才切换，之后一直使用备用服务商
+        self.assertEqual(len(primary.calls), tts_providers.SLOW_CALL_MIN_SAMPLES)
+        self.assertEqual(len(backup.calls), 5 - tts_providers.SLOW_CALL_MIN_SAMPLES)
+        self.assertEqual(voice_gen.router.current(), ('backup', 'voice-a'))
+    
+    def test_azure_call_times_out(self):
+        pool = SynthesizerPool.__new__(SynthesizerPool)
+        pool._pool = tts_providers.queue.Queue()
+        synthesizer = mock.Mock()
+        pool._pool.put(synthesizer)
+        release = threading.Event()
+        
+        def stream_to(synthesizer, text, writer):
+            release.wait(5)
+            writer.write(b'\x00\x00' * 10)
+        
+        pool._stream_to = stream_to
+        output_file = os.path.join(self.work_dir, 'azure.wav')
+        with mock.patch.object(Config, 'AZURE_TTS_TIMEOUT', 0.05):
+            with self.assertRaises(RetryableError):
+                pool.synthesize("第一段", output_file)
+        synthesizer.stop_speaking_async.assert_called_once()
+        
+        # 读取结束后合成器归还到池中，迟到的音频不会写出文件
+        release.set()
+        self.assertIs(pool._pool.get(timeout=5), synthesizer)
+        self.assertEqual(os.listdir(self.work_dir), [])
+    
+    def test_unsupported_voice_skips_provider(self):
+        self.assertIsNone(tts_providers.AzureTTSProvider.voice_for('longxiaochun'))
+        self.assertEqual(tts_providers.AzureTTSProvider.voice_for('zh-CN-XiaoxiaoNeural'), 'zh-CN-XiaoxiaoNeural')
+        self.assertEqual(tts_providers.DashScopeTTSProvider.voice_for('longxiaochun'), 'longxiaochun')
+
+
+
+class StreamingWavWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+    
+    def test_write_after_abort_is_dropped(self):
+        output_file = os.path.join(self.work_dir, 'a.wav')
+        writer = StreamingWavWriter(output_file)
+        writer.write(b'\x00\x00' * 10)
+        writer.abort()
+        # 超时放弃后迟到的音频块不会重新创建文件，也不会报错
+        writer.write(b'\x00\x00' * 10)
+        self.assertEqual(writer.bytes_written, 20)
+        self.assertEqual(os.listdir(self.work_dir), [])
+        with self.assertRaises(Exception):
+            writer.commit()
+        self.assertFalse(os.path.exists(output_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+"""
+文字叠加层模块
+把标题/字幕连同半透明背景栅格化为一张预乘alpha的RGBA位图，并在内存和磁盘中缓存，
+相同的文字、字体和样式不再重复排版和描边
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from cache import DiskCache, make_cache_key
+from config import Config
+
+# 位图格式版本，渲染逻辑变化时递增以废弃旧的磁盘缓存
+OVERLAY_VERSION = 1
+
+
+def _wrap_text(text, font, max_width, stroke_width):
+    """
+    按最大宽度自动换行：中文逐字断行，英文单词尽量不拆开
+    
+    返回:
+        list: 每行文字
+    """
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for char in paragraph:
+            candidate = line + char
+            if line and font.getlength(candidate) + stroke_width * 2 > max_width:
+                split_at = line.rfind(' ')
+                if char != ' ' and char.isascii() and split_at > 0 and line[-1].isascii():
+                    lines.append(line[:split_at])
+                    line = line[split_at + 1:] + char
+                else:
+                    lines.append(line.rstrip())
+                    line = char.lstrip()
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def rasterize_text_overlay(text, font_path, font_size, color, stroke_color, stroke_width,
+                           bg_color, bg_opacity, padding, width):
+    """
+    栅格化一块文字叠加层
+    
+    参数:
+        text: 文字内容
+        font_path: 字体文件路径
+        font_size: 字体大小
+        color: 文字颜色，例如 "#FFFFFF"
+        stroke_color: 描边颜色
+        stroke_width: 描边宽度
+        bg_color: 背景颜色，RGB元组
+        bg_opacity: 背景不透明度（0-1）
+        padding: 背景内边距（像素）
+        width: 文字区域宽度，文字在其中自动换行并居中
+    
+    返回:
+        numpy.ndarray: 形状为 (高, 宽, 4) 的预乘alpha RGBA位图（uint8）
+    """
+    font = ImageFont.truetype(font_path, font_size)
+    wrapped = '\n'.join(_wrap_text(text, font, width, stroke_width))
+    
+    measure = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    left, top, right, bottom = measure.multiline_textbbox(
+        (0, 0), wrapped, font=font, align='center', stroke_width=stroke_width
+    )
+    text_height = bottom - top
+    
+    box_width = width + padding * 2
+    box_height = text_height + padding * 2
+    alpha = int(round(bg_opacity * 255))
+    overlay = Image.new('RGBA', (box_width, box_height), tuple(bg_color) + (alpha,))
+    
+    text_layer = Image.new('RGBA', (box_width, box_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(text_layer)
+    x = padding + (width - (right - left)) / 2 - left
+    y = padding - top
+    draw.multiline_text(
+        (x, y), wrapped, font=font, align='center',
+        fill=ImageColor.getrgb(color) + (255,),
+        stroke_width=stroke_width,
+        stroke_fill=ImageColor.getrgb(stroke_color) + (255,)
+    )
+    overlay = Image.alpha_composite(overlay, text_layer)
+    
+    # 预乘alpha，叠加时只需 out = overlay + frame * (1 - alpha)
+    rgba = np.asarray(overlay).astype(np.uint16)
+    rgba[:, :, :3] = (rgba[:, :, :3] * rgba[:, :, 3:4] + 127) // 255
+    return rgba.astype(np.uint8)
+
+
+def blend_overlay(frame, overlay, x, y):
+    """
+    把预乘alpha的叠加层混合到RGB帧的 (x, y) 位置，超出画面的部分会被裁掉
+    
+    参数:
+        frame: 形状为 (高, 宽, 3) 的RGB帧（uint8），原地修改
+        overlay: 预乘alpha的RGBA位图
+        x: 叠加层左上角横坐标
+        y: 叠加层左上角纵坐标
+    
+    返回:
+        numpy.ndarray: 混合后的帧
+    """
+    frame_h, frame_w = frame.shape[:2]
+    h, w = overlay.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame_w), min(y + h, frame_h)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+    
+    part = overlay[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.uint16)
+    region = frame[y0:y1, x0:x1].astype(np.uint16)
+    inverse_alpha = 255 - part[:, :, 3:4]
+    frame[y0:y1, x0:x1] = (part[:, :, :3] + (region * inverse_alpha + 127) // 255).astype(np.uint8)
+    return frame
+
+
+class OverlayCache:
+    """
+    文字叠加层缓存
+    
+    先查进程内的LRU缓存，再查磁盘缓存，都未命中时才栅格化。
+    磁盘缓存键包含字体文件的大小和修改时间，替换字体后自动失效。
+    """
+    
+    def __init__(self, memory_items=256, use_disk=True):
+        """
+        初始化叠加层缓存
+        
+        参数:
+            memory_items: 内存中最多保留的位图数量
+            use_disk: 是否使用磁盘缓存
+        """
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if use_disk:
+            self._disk = DiskCache(
+                Config.OVERLAY_CACHE_DIR,
+                max_bytes=Config.OVERLAY_CACHE_MAX_MB * 1024 * 1024,
+                suffix='.npy'
+            )
+    
+    def get(self, text, font_path, font_size, color, stroke_color, stroke_width,
+            bg_color, bg_opacity, padding, width):
+        """
+        获取文字叠加层，参数同 rasterize_text_overlay
+        
+        返回:
+            numpy.ndarray: 预乘alpha的RGBA位图
+        """
+        try:
+            font_stat = os.stat(font_path)
+            font_signature = (font_stat.st_size, font_stat.st_mtime_ns)
+        except OSError:
+            font_signature = None
+        key = make_cache_key(
+            OVERLAY_VERSION, text, font_path, font_signature, font_size, color, stroke_color,
+            stroke_width, list(bg_color), bg_opacity, padding, width
+        )
+        
+        with self._lock:
+            overlay = self._memory.get(key)
+            if overlay is not None:
+                self._memory.move_to_end(key)
+                return overlay
+        
+        overlay = None
+        if self._disk is not None:
+            data = self._disk.get_bytes(key)
+            if data is not None:
+                try:
+                    overlay = np.load(io.BytesIO(data), allow_pickle=False)
+                except ValueError:
+                    overlay = None
+        
+        if overlay is None:
+            overlay = rasterize_text_overlay(
+                text, font_path, font_size, color, stroke_color, stroke_width,
+                bg_color, bg_opacity, padding, width
+            )
+            if self._disk is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, overlay, allow_pickle=False)
+                self._disk.put_bytes(key, buffer.getvalue())
+        
+        with self._lock:
+            self._memory[key] = overlay
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return overlay
@@ -0,0 +1,617 @@
+"""
+语音合成服务商模块
+定义统一的语音合成接口和Azure、DashScope两个实现：合成的音频边接收边写入磁盘，
+同一条旁白固定使用一个主服务商，主服务商失败或熔断时才切换到下一个服务商
+"""
+# Azure Speech Service: https://learn.microsoft.com/azure/ai-services/speech-service/
+# DashScope CosyVoice: https://help.aliyun.com/zh/model-studio/cosyvoice-python-sdk
+
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import wave
+from config import Config
+from rate_limit import RetryableError, get_guard
+import metrics
+
+# 流式合成的输出格式：24kHz、16位、单声道PCM，写入WAV文件后可直接拼接为旁白音轨
+SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+# 每次从Azure音频流读取的字节数（约0.5秒）
+STREAM_CHUNK_BYTES = SAMPLE_RATE * SAMPLE_WIDTH // 2
+
+# Azure的语音名称格式，例如 zh-CN-XiaoxiaoNeural、en-US-AvaMultilingualNeural
+AZURE_VOICE_PATTERN = re.compile(r'^[a-z]{2,3}-[A-Z]{2,4}(-[A-Za-z]+)?-\w+Neural$')
+
+
+class StreamingWavWriter:
+    """
+    边接收边写入的WAV文件
+    
+    音频块到达时直接写入临时文件，成功结束时重命名为目标文件，失败时删除临时文件，
+    不会留下不完整的音频，也不需要在内存中保留整段音频。
+    写入、完成和放弃之间加锁：超时放弃后合成线程或SDK回调仍可能送来音频块，这些数据会被丢弃。
+    """
+    
+    def __init__(self, output_file):
+        """
+        初始化写入器
+        
+        参数:
+            output_file: 输出的WAV文件路径
+        """
+        os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else '.', exist_ok=True)
+        self.output_file = output_file
+        self.bytes_written = 0
+        self._tmp_file = f"{output_file}.{uuid.uuid4().hex}.part"
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wav = wave.open(self._tmp_file, 'wb')
+        self._wav.setnchannels(CHANNELS)
+        self._wav.setsampwidth(SAMPLE_WIDTH)
+        self._wav.setframerate(SAMPLE_RATE)
+    
+    def write(self, data):
+        """写入一块PCM数据，已完成或已放弃后到达的数据被丢弃"""
+        with self._lock:
+            if self._closed:
+                return
+            self._wav.writeframes(data)
+            self.bytes_written += len(data)
+    
+    def commit(self):
+        """
+        完成写入并重命名为目标文件
+        
+        返回:
+            str: 输出文件路径
+        """
+        with self._lock:
+            if self._closed:
+                raise Exception("语音写入已放弃")
+            self._closed = True
+            self._wav.close()
+            if self.bytes_written > 0:
+                os.replace(self._tmp_file, self.output_file)
+                return self.output_file
+        self._remove_tmp_file()
+        raise Exception("语音合成没有返回音频数据")
+    
+    def abort(self):
+        """放弃写入并删除临时文件，之后到达的数据被丢弃"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._wav.close()
+            except Exception:
+                pass
+        self._remove_tmp_file()
+    
+    def _remove_tmp_file(self):
+        try:
+            os.remove(self._tmp_file)
+        except OSError:
+            pass
+
+
+class TTSProvider:
+    """
+    语音合成服务商接口
+    
+    子类需要设置name，实现is_configured、voice_for和synthesize；
+    synthesize由TTSRouter在该服务商的限流与重试保护下调用，可重试的错误应抛出RetryableError。
+    """
+    
+    name = None
+    
+    def __init__(self, voice_name=None, size=None):
+        """
+        初始化服务商
+        
+        参数:
+            voice_name: 输入配置中的语音名称
+            size: 同时进行的合成数，默认为配置中的TTS_MAX_WORKERS
+        """
+        self.voice = self.voice_for(voice_name)
+        self.size = max(1, size if size is not None else Config.TTS_MAX_WORKERS)
+    
+    @classmethod
+    def is_configured(cls):
+        """是否已配置该服务商所需的密钥"""
+        raise NotImplementedError
+    
+    @classmethod
+    def voice_for(cls, voice_name=None):
+        """
+        该服务商实际使用的语音，用于合成和生成缓存键
+        
+        参数:
+            voice_name: 输入配置中的语音名称
+        
+        返回:
+            str: 语音名称，该服务商不支持所请求的语音时返回None
+        """
+        raise NotImplementedError
+    
+    def synthesize(self, text, output_file):
+        """
+        合成语音并保存为16位PCM WAV文件
+        
+        参数:
+            text: 要转换的文本
+            output_file: 输出的音频文件路径
+        
+        返回:
+            output_file: 保存的音频文件路径
+        """
+        raise NotImplementedError
+    
+    def close(self):
+        """释放连接等资源"""
+
+
+def _check_azure_config():
+    """检查Azure语音服务配置是否完整"""
+    if not Config.AZURE_SPEECH_KEY or not Config.AZURE_SPEECH_REGION:
+        raise ValueError("Azure语音服务配置不完整，请检查.env文件中的AZURE_SPEECH_KEY和AZURE_SPEECH_REGION")
+
+
+def _create_speech_config(voice_name=None, output_format=None):
+    """
+    创建Azure语音配置
+    
+    参数:
+        voice_name: 使用的语音名称，默认为配置中的AZURE_SPEECH_VOICE
+        output_format: 输出格式，默认为24kHz 16位单声道PCM的WAV
+    
+    返回:
+        SpeechConfig: 语音配置对象
+    """
+    import azure.cognitiveservices.speech as speechsdk
+    
+    speech_config = speechsdk.SpeechConfig(
+        subscription=Config.AZURE_SPEECH_KEY,
+        region=Config.AZURE_SPEECH_REGION
+    )
+    if voice_name is None:
+        voice_name = Config.AZURE_SPEECH_VOICE
+    speech_config.speech_synthesis_voice_name = voice_name
+    # 输出16位PCM的WAV，渲染时直接拼接为旁白音轨，不经过MP3编解码
+    speech_config.set_speech_synthesis_output_format(
+        output_format or speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm
+    )
+    return speech_config
+
+
+def _raise_for_cancellation(cancellation_details):
+    """
+    按取消原因抛出异常
+    
+    参数:
+        cancellation_details: 语音合成的取消详情
+    """
+    import azure.cognitiveservices.speech as speechsdk
+    
+    error_msg = f"语音合成被取消: {cancellation_details.reason}"
+    if cancellation_details.reason == speechsdk.CancellationReason.Error:
+        error_msg += f"\n错误详情: {cancellation_details.error_details}"
+        # 限流、超时和服务暂不可用交给guard重试
+        if cancellation_details.error_code in (
+            speechsdk.CancellationErrorCode.TooManyRequests,
+            speechsdk.CancellationErrorCode.ConnectionFailure,
+            speechsdk.CancellationErrorCode.ServiceTimeout,
+            speechsdk.CancellationErrorCode.ServiceUnavailable,
+        ):
+            raise RetryableError(error_msg)
+    raise Exception(error_msg)
+
+
+def _check_result(result):
+    """
+    检查语音合成结果，失败时抛出异常
+    
+    参数:
+        result: SpeechSynthesisResult对象
+    """
+    import azure.cognitiveservices.speech as speechsdk
+    
+    if result.reason in (speechsdk.ResultReason.SynthesizingAudioCompleted,
+                         speechsdk.ResultReason.SynthesizingAudioStarted):
+        return
+    if result.reason == speechsdk.ResultReason.Canceled:
+        _raise_for_cancellation(speechsdk.CancellationDetails(result))
+    raise Exception(f"语音合成失败: {result.reason}")
+
+
+class SynthesizerPool:
+    """
+    Azure语音合成器池
+    
+    每次运行只创建一次SpeechConfig和固定数量的SpeechSynthesizer，并预先建立连接，
+    之后各段语音复用这些合成器，避免每段都重新握手。
+    合成器不绑定输出文件，音频开始返回后即从音频流逐块读取并写入目标文件。
+    """
+    
+    def __init__(self, voice_name=None, size=None):
+        """
+        初始化合成器池
+        
+        参数:
+            voice_name: 使用的语音名称，默认为配置中的AZURE_SPEECH_VOICE
+            size: 池中合成器数量，默认为配置中的TTS_MAX_WORKERS
+        """
+        import azure.cognitiveservices.speech as speechsdk
+        
+        _check_azure_config()
+        if size is None:
+            size = Config.TTS_MAX_WORKERS
+        self.size = max(1, size)
+        # 流式读取的是不带文件头的PCM数据，WAV文件头由StreamingWavWriter写入
+        self.speech_config = _create_speech_config(
+            voice_name, speechsdk.SpeechSynthesisOutputFormat.Raw24Khz16BitMonoPcm
+        )
+        self._pool = queue.Queue()
+        self._connections = []
+        for _ in range(self.size):
+            synthesizer = speechsdk.SpeechSynthesizer(
+                speech_config=self.speech_config,
+                audio_config=None
+            )
+            # 预先建立连接，首段语音不再承担握手延迟
+            connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+            connection.open(True)
+            self._connections.append(connection)
+            self._pool.put(synthesizer)
+    
+    def synthesize(self, text, output_file):
+        """
+        从池中取出一个合成器合成语音并流式写入文件，用完后归还
+        
+        参数:
+            text: 要转换的文本
+            output_file: 输出的音频文件路径
+        
+        返回:
+            output_file: 保存的音频文件路径
+        """
+        timeout = Config.AZURE_TTS_TIMEOUT
+        try:
+            synthesizer = self._pool.get(timeout=timeout)
+        except queue.Empty:
+            raise RetryableError(f"Azure语音合成超时（{timeout:.0f} 秒内没有空闲的合成器）")
+        writer = StreamingWavWriter(output_file)
+        done = threading.Event()
+        errors = []
+        
+        def run():
+            # SDK的调用没有超时参数，在后台线程中读取；合成器在读取真正结束后才归还到池中
+            try:
+                self._stream_to(synthesizer, text, writer)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                self._pool.put(synthesizer)
+                done.set()
+        
+        threading.Thread(target=run, daemon=True).start()
+        if not done.wait(timeout):
+            writer.abort()
+            try:
+                synthesizer.stop_speaking_async()
+            except Exception:
+                pass
+            raise RetryableError(f"Azure语音合成超时（{timeout:.0f} 秒）")
+        if errors:
+            writer.abort()
+            raise errors[0]
+        return writer.commit()
+    
+    def _stream_to(self, synthesizer, text, writer):
+        """用合成器合成语音，音频开始返回时即得到结果，之后边合成边读取并写入writer"""
+        import azure.cognitiveservices.speech as speechsdk
+        
+        result = synthesizer.start_speaking_text_async(text).get()
+        _check_result(result)
+        stream = speechsdk.AudioDataStream(result)
+        buffer = bytes(STREAM_CHUNK_BYTES)
+        while True:
+            filled = stream.read_data(buffer)
+            if not filled:
+                break
+            writer.write(buffer[:filled])
+        if stream.status == speechsdk.StreamStatus.Canceled:
+            _raise_for_cancellation(stream.cancellation_details)
+    
+    def close(self):
+        """关闭池中所有连接"""
+        for connection in self._connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        self._connections = []
+
+
+class AzureTTSProvider(TTSProvider):
+    """Azure语音服务，复用预先建立连接的合成器池"""
+    
+    name = 'azure'
+    
+    def __init__(self, voice_name=None, size=None):
+        super().__init__(voice_name, size)
+        self._pool = SynthesizerPool(voice_name=self.voice, size=self.size)
+    
+    @classmethod
+    def is_configured(cls):
+        return bool(Config.AZURE_SPEECH_KEY and Config.AZURE_SPEECH_REGION)
+    
+    @classmethod
+    def voice_for(cls, voice_name=None):
+        if voice_name and not AZURE_VOICE_PATTERN.match(voice_name):
+            return None
+        return voice_name or Config.AZURE_SPEECH_VOICE
+    
+    def synthesize(self, text, output_file):
+        return self._pool.synthesize(text, output_file)
+    
+    def close(self):
+        self._pool.close()
+
+
+# DashScope错误信息中表示可重试的关键字
+DASHSCOPE_RETRYABLE_ERRORS = ('Throttling', 'RateQuota', 'ServiceUnavailable', 'InternalError', 'Timeout', 'timeout')
+
+
+class DashScopeTTSProvider(TTSProvider):
+    """
+    阿里云DashScope语音合成（CosyVoice）
+    
+    输入配置中的语音是DashScope的音色（例如 longxiaochun）时直接使用；
+    是Azure的语音名称或未指定时使用配置中的DASHSCOPE_TTS_VOICE，此时DashScope只在Azure失败后接替。
+    """
+    
+    name = 'dashscope'
+    
+    def __init__(self, voice_name=None, size=None):
+        super().__init__(voice_name, size)
+        import dashscope
+        dashscope.api_key = Config.DASHSCOPE_API_KEY
+        self.model = Config.DASHSCOPE_TTS_MODEL
+    
+    @classmethod
+    def is_configured(cls):
+        return bool(Config.DASHSCOPE_API_KEY)
+    
+    @classmethod
+    def voice_for(cls, voice_name=None):
+        if voice_name and not AZURE_VOICE_PATTERN.match(voice_name):
+            return voice_name
+        return Config.DASHSCOPE_TTS_VOICE
+    
+    def synthesize(self, text, output_file):
+        from dashscope.audio.tts_v2 import AudioFormat, ResultCallback, SpeechSynthesizer
+        
+        writer = StreamingWavWriter(output_file)
+        done = threading.Event()
+        errors = []
+        
+        class Callback(ResultCallback):
+            # 超时放弃后SDK线程仍可能回调，writer已关闭时丢弃这些数据
+            def on_data(self, data):
+                writer.write(data)
+            
+            def on_complete(self):
+                done.set()
+            
+            def on_error(self, message):
+                errors.append(str(message))
+                done.set()
+            
+            def on_close(self):
+                done.set()
+        
+        try:
+            # 合成器对象不能复用，每段语音创建一个；音频块通过回调到达时直接写入文件
+            synthesizer = SpeechSynthesizer(
+                model=self.model,
+                voice=self.voice,
+                format=AudioFormat.PCM_24000HZ_MONO_16BIT,
+                callback=Callback()
+            )
+            synthesizer.call(text)
+            if not done.wait(Config.DASHSCOPE_TTS_TIMEOUT):
+                writer.abort()
+                try:
+                    synthesizer.streaming_cancel()
+                except Exception:
+                    pass
+                raise RetryableError(f"DashScope语音合成超时（{Config.DASHSCOPE_TTS_TIMEOUT:.0f} 秒）")
+            if errors:
+                error_msg = f"DashScope语音合成失败: {errors[0]}"
+                if any(keyword in errors[0] for keyword in DASHSCOPE_RETRYABLE_ERRORS):
+                    raise RetryableError(error_msg)
+                raise Exception(error_msg)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+
+# 服务商名称到实现类的注册表，TTS_PROVIDERS中的名称在这里查找
+PROVIDER_CLASSES = {
+    AzureTTSProvider.name: AzureTTSProvider,
+    DashScopeTTSProvider.name: DashScopeTTSProvider,
+}
+
+
+def register_provider(provider_class):
+    """
+    注册语音合成服务商，之后可以在TTS_PROVIDERS中使用其名称（例如替身服务商）
+    
+    参数:
+        provider_class: TTSProvider的子类
+    """
+    PROVIDER_CLASSES[provider_class.name] = provider_class
+
+
+def configured_providers():
+    """
+    按TTS_PROVIDERS中的顺序返回已配置密钥的服务商
+    
+    返回:
+        list: TTSProvider子类列表
+    """
+    classes = []
+    for name in Config.TTS_PROVIDERS.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        provider_class = PROVIDER_CLASSES.get(name)
+        if provider_class is None:
+            raise ValueError(f"未知的语音合成服务商: {name}，可选: {', '.join(PROVIDER_CLASSES)}")
+        if provider_class.is_configured():
+            classes.append(provider_class)
+    if not classes:
+        raise ValueError("没有可用的语音合成服务商，请检查TTS_PROVIDERS以及对应的密钥配置")
+    return classes
+
+
+# 服务商耗时滑动平均的权重，以及按耗时切换前至少需要的样本数
+LATENCY_ALPHA = 0.3
+SLOW_CALL_MIN_SAMPLES = 3
+
+
+class TTSRouter:
+    """
+    语音合成服务商路由
+    
+    同一个路由（即同一个语音生成器）的所有段都使用同一个主服务商，保证整条旁白是同一个音色；
+    只有主服务商失败（重试用尽）、已熔断或近期耗时超过TTS_SLOW_CALL_SECONDS时才改用下一个服务商，
+    并在之后的段中一直使用它，不再来回切换。
+    不支持所请求语音的服务商不参与切换；服务商实例在第一次使用时才创建。
+    """
+    
+    def __init__(self, voice_name=None, size=None, provider_classes=None):
+        """
+        初始化路由
+        
+        参数:
+            voice_name: 输入配置中的语音名称
+            size: 每个服务商同时进行的合成数，默认为配置中的TTS_MAX_WORKERS
+            provider_classes: TTSProvider子类列表，按优先顺序，默认为configured_providers()
+        """
+        if provider_classes is None:
+            provider_classes = configured_providers()
+        self.size = size
+        self.voice_name = voice_name
+        # (服务商类, 实际使用的语音)，不支持该语音的服务商被排除
+        self.candidates = [
+            (provider_class, provider_class.voice_for(voice_name)) for provider_class in provider_classes
+            if provider_class.voice_for(voice_name)
+        ]
+        if not self.candidates:
+            raise ValueError(f"没有支持语音 {voice_name} 的语音合成服务商，请检查TTS_PROVIDERS以及对应的密钥配置")
+        self._current = 0
+        self._providers = {}
+        # 每个候选服务商单段合成耗时的滑动平均和样本数
+        self._latency = {}
+        self._lock = threading.Lock()
+    
+    def current(self):
+        """
+        当前使用的服务商
+        
+        返回:
+            tuple: (服务商名称, 语音名称)，用于生成缓存键
+        """
+        with self._lock:
+            provider_class, voice = self.candidates[self._current]
+        return provider_class.name, voice
+    
+    def _provider(self, index):
+        """获取第index个候选服务商的实例，不存在时创建"""
+        with self._lock:
+            provider = self._providers.get(index)
+            if provider is None:
+                provider_class, _ = self.candidates[index]
+                provider = provider_class(voice_name=self.voice_name, size=self.size)
+                self._providers[index] = provider
+            return provider
+    
+    def _record_latency(self, index, seconds):
+        """
+        记录第index个服务商一次合成的耗时
+        
+        返回:
+            float: 样本足够且滑动平均超过TTS_SLOW_CALL_SECONDS时返回平均耗时，否则返回None
+        """
+        with self._lock:
+            average, samples = self._latency.get(index, (seconds, 0))
+            average += LATENCY_ALPHA * (seconds - average)
+            samples += 1
+            self._latency[index] = (average, samples)
+        threshold = Config.TTS_SLOW_CALL_SECONDS
+        if threshold > 0 and samples >= SLOW_CALL_MIN_SAMPLES and average > threshold:
+            return average
+        return None
+    
+    def _fail_over(self, index):
+        """第index个服务商失败后改用下一个，其他段已经切换过时不再重复切换"""
+        with self._lock:
+            if self._current == index and index + 1 < len(self.candidates):
+                self._current = index + 1
+                return True
+            return False
+    
+    def synthesize(self, text, output_file):
+        """
+        用当前服务商合成语音，失败时改用下一个服务商
+        
+        参数:
+            text: 要转换的文本
+            output_file: 输出的音频文件路径
+        
+        返回:
+            tuple: (音频文件路径, 实际使用的TTSProvider)
+        """
+        with self._lock:
+            index = self._current
+        # 有其他服务商可以接替时，同一服务商只做少量重试，尽快切换
+        max_retries = Config.TTS_FAILOVER_RETRIES if len(self.candidates) > 1 else None
+        while True:
+            provider_name = self.candidates[index][0].name
+            guard = get_guard(provider_name)
+            if max_retries is not None:
+                guard = guard.with_retries(max_retries)
+            try:
+                provider = self._provider(index)
+                start = time.monotonic()
+                with metrics.timer('provider_call', provider=provider_name, call='tts'):
+                    guard.call(provider.synthesize, text, output_file)
+                average = self._record_latency(index, time.monotonic() - start)
+                if average is not None and self._fail_over(index):
+                    metrics.inc('tts_failover_total', provider=provider_name)
+                    print(f"[语音生成] {provider_name} 延迟过高（平均 {average:.1f} 秒/段），之后的语音改用 {self.candidates[index + 1][0].name}")
+                return output_file, provider
+            except Exception as e:
+                if index + 1 >= len(self.candidates):
+                    raise
+                if self._fail_over(index):
+                    metrics.inc('tts_failover_total', provider=provider_name)
+                    print(f"[语音生成] {provider_name} 合成失败（{e}），之后的语音改用 {self.candidates[index + 1][0].name}")
+                index += 1
+    
+    def close(self):
+        """关闭已创建的服务商"""
+        with self._lock:
+            providers = list(self._providers.values())
+            self._providers = {}
+        for provider in providers:
+            provider.close()
@@ -3,7 +3,9 @@
 """
 import json
 import os
-from moviepy import AudioFileClip, concatenate_audioclips
+from audio_probe import probe_duration
+from ffmpeg_utils import run_ffmpeg
+from narration import build_narration_track
 
 
 def load_input_config(json_file_path):
@@ -14,7 +16,8 @@ def load_input_config(json_file_path):
         json_file_path: JSON文件路径
     
     返回:
-        dict: 配置字典，包含 video_size, images, voice, font, font_color, font_size, name, text
+        dict: 配置字典，包含 video_size, images, voice, font, font_color, font_size, name, text，
+              以及可选的 encoding_profile（未指定时为None）
     """
     try:
         with open(json_file_path, 'r', encoding='utf-8') as f:
@@ -40,7 +43,8 @@ def load_input_config(json_file_path):
             'font_color': data['font_color'],
             'font_size': data['font_size'],
             'name': data['name'],
-            'text': data['text']
+            'text': data['text'],
+            'encoding_profile': data.get('encoding_profile')
         }
         
         print(f"[工具] 从 {json_file_path} 加载配置: name={config['name']}, images={config['images']}")
@@ -83,9 +87,11 @@ def save_items_to_json(items, json_file_path):
         json_file_path: JSON文件路径
     """
     try:
-        # 直接保存为数组格式
-        with open(json_file_path, 'w', encoding='utf-8') as f:
+        # 直接保存为数组格式，先写临时文件再重命名，避免中断时留下不完整的文件
+        tmp_path = f"{json_file_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(items, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, json_file_path)
         print(f"[工具] 已保存更新后的JSON到: {json_file_path}")
     except Exception as e:
         print(f"[工具] 保存JSON文件失败: {e}")
@@ -96,6 +102,8 @@ def calculate_audio_duration(audio_file):
     """
     计算音频文件的时长
     
+    直接读取WAV/MP3文件头，不解码音频，结果按路径和修改时间缓存
+    
     参数:
         audio_file: 音频文件路径
     
@@ -103,9 +111,9 @@ def calculate_audio_duration(audio_file):
         float: 时长（秒）
     """
     try:
-        audio_clip = AudioFileClip(audio_file)
-        duration = audio_clip.duration
-        audio_clip.close()
+        duration = probe_duration(audio_file)
+        if duration is None:
+            raise ValueError("无法识别的音频格式")
         return duration
     except Exception as e:
         print(f"[工具] 计算音频时长失败 {audio_file}: {e}")
@@ -116,6 +124,9 @@ def merge_audio_files(audio_files, output_file):
     """
     合并多个音频文件
     
+    各段首尾相接拼为一条16位PCM音轨（WAV输入直接复制采样数据），
+    输出文件不是.wav时再用ffmpeg按扩展名编码一次
+    
     参数:
         audio_files: 音频文件路径列表
         output_file: 输出音频文件路径
@@ -124,18 +135,16 @@ def merge_audio_files(audio_files, output_file):
         str: 输出音频文件路径
     """
     try:
-        clips = []
-        for audio_file in audio_files:
-            clips.append(AudioFileClip(audio_file))
-        
-        final_clip = concatenate_audioclips(clips)
-        final_clip.write_audiofile(output_file)
+        if output_file.lower().endswith('.wav'):
+            build_narration_track(audio_files, output_file)
+        else:
+            wav_file = f"{output_file}.wav"
+            build_narration_track(audio_files, wav_file)
+            try:
+                run_ffmpeg(['-i', wav_file, output_file])
+            finally:
+                os.remove(wav_file)
         
-        # Close clips
-        final_clip.close()
-        for clip in clips:
-            clip.close()
-            
         print(f"[工具] 已合并音频到: {output_file}")
         return output_file
     except Exception as e:
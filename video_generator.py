@@ -1,15 +1,34 @@
 """
 视频生成模块
-使用MoviePy合成视频
+合成幻灯片画面并编码为视频，各段语音先拼接为一条旁白音轨，再用ffmpeg一次封装到视频上
 """
-from moviepy import ImageClip, TextClip, CompositeVideoClip, AudioFileClip, concatenate_videoclips, ColorClip
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from moviepy import ImageClip, TextClip, CompositeVideoClip, ColorClip
+from config import Config
+from cache import DiskCache, hash_file, make_cache_key
+from ffmpeg_utils import RawVideoWriter, run_ffmpeg, concat_segments, mux_audio
+from encoding_profiles import ffmpeg_audio_args, ffmpeg_video_args, get_profile
+from narration import build_narration_track
+from text_overlay import OverlayCache, OVERLAY_VERSION, blend_overlay
+from image_ingest import normalize_image
+import metrics
+
+# 片段渲染逻辑版本，渲染结果变化时递增以废弃旧的片段缓存
+SEGMENT_VERSION = 2
 
 
 class VideoGenerator:
     """视频生成器"""
     
     def __init__(self, font_path="./resource/AlibabaPuHuiTi-3-75-SemiBold.ttf", fps=10, video_size=(1080, 1920),
-                 font_size=50, stroke_width=5, bg_opacity=0.7, bg_padding=20):
+                 font_size=50, stroke_width=5, bg_opacity=0.7, bg_padding=20, render_mode=None,
+                 render_workers=None, use_cache=True, encoding_profile=None):
         """
         初始化视频生成器
         
@@ -21,6 +40,11 @@ class VideoGenerator:
             stroke_width: 文字描边宽度
             bg_opacity: 背景不透明度（0-1）
             bg_padding: 背景内边距（像素）
+            render_mode: 渲染方式，"static" 每张幻灯片只合成一帧再用ffmpeg编码为静态片段，
+                         "moviepy" 由MoviePy逐帧合成，默认为配置中的RENDER_MODE
+            render_workers: static模式下并行渲染幻灯片片段的进程数，默认为配置中的RENDER_WORKERS，0表示CPU核数
+            use_cache: static模式下是否缓存栅格化的文字叠加层和已渲染的幻灯片片段
+            encoding_profile: 编码配置名称（见encoding_profiles.ENCODING_PROFILES），默认为配置中的ENCODING_PROFILE
         """
         self.font_path = font_path
         self.fps = fps
@@ -29,6 +53,21 @@ class VideoGenerator:
         self.stroke_width = stroke_width
         self.bg_opacity = bg_opacity
         self.bg_padding = bg_padding
+        self.render_mode = render_mode or Config.RENDER_MODE
+        if render_workers is None:
+            render_workers = Config.RENDER_WORKERS
+        self.render_workers = render_workers if render_workers > 0 else (os.cpu_count() or 1)
+        # 多个进程同时编码时平分CPU线程，避免过度争抢
+        self.encoder_threads = 0
+        self.use_cache = use_cache
+        self.encoding_profile = get_profile(encoding_profile)
+        self._overlay_cache = None
+    
+    def __getstate__(self):
+        # 叠加层缓存含有锁，不能传给子进程，子进程中按需重新创建
+        state = self.__dict__.copy()
+        state['_overlay_cache'] = None
+        return state
     
     def _format_text_for_display(self, text):
         """
@@ -44,146 +83,461 @@ class VideoGenerator:
             return ""
         return text
     
-    def create_video(self, slides, output_file):
+    def _fit_image_clip(self, slide):
         """
-        创建视频
+        加载幻灯片图片已铺满裁剪到视频尺寸的画面
+        
+        画面通常在图片生成后就已预处理好（见image_ingest），这里只读取；
+        还没有预处理过的图片（例如手工替换的图片）在此时处理一次并缓存。
         
         参数:
-            slides: 幻灯片列表，每个元素包含 image, audio, text, duration
-            output_file: 输出视频文件路径
+            slide: 幻灯片，包含 image, duration
         
         返回:
-            str: 输出视频文件路径
+            ImageClip: 与视频尺寸一致的图片剪辑
         """
-        clips_with_text = []
+        return ImageClip(normalize_image(slide["image"], self.video_size)).with_duration(slide["duration"])
+    
+    def _compose_slide(self, slide):
+        """
+        合成一张幻灯片的画面（图片 + 顶部标题 + 底部字幕），不含音频
         
-        for index, slide in enumerate(slides):
-            print(f"\n处理第 {index + 1}/{len(slides)} 张幻灯片...")
-            
-            # 创建图片剪辑
-            img_clip = ImageClip(slide["image"])
-            img_clip = img_clip.with_duration(slide["duration"])
-            
-            # 调整图片尺寸以适应视频尺寸（保持宽高比）
-            # 计算缩放比例，使图片能够完全适应视频尺寸
-            scale_w = self.video_size[0] / img_clip.w
-            scale_h = self.video_size[1] / img_clip.h
-            scale = max(scale_w, scale_h)  # 使用较大的缩放比例，确保图片完全覆盖
-            
-            # 缩放图片
-            new_width = int(img_clip.w * scale)
-            new_height = int(img_clip.h * scale)
-            img_clip = img_clip.resized((new_width, new_height))
-            
-            # 如果图片尺寸大于视频尺寸，居中裁剪
-            if new_width > self.video_size[0] or new_height > self.video_size[1]:
-                img_clip = img_clip.cropped(
-                    x_center=new_width/2,
-                    y_center=new_height/2,
-                    width=self.video_size[0],
-                    height=self.video_size[1]
-                )
+        参数:
+            slide: 幻灯片，包含 image, title, subtitle, duration
+        
+        返回:
+            CompositeVideoClip: 合成后的画面剪辑
+        """
+        img_clip = self._fit_image_clip(slide)
+        
+        # 创建文字剪辑
+        title = slide.get("title", "")
+        subtitle = slide.get("subtitle", "")
+        
+        clips_to_composite = [img_clip]
+        
+        # 文本区域宽度（留出左右边距）
+        text_area_width = self.video_size[0] - 100  # 左右各留50像素边距
+        
+        # 如果存在title，显示在顶部
+        if title:
+            formatted_title = self._format_text_for_display(title)
+            title_text_clip = TextClip(
+                text=formatted_title,
+                font=self.font_path,
+                font_size=int(self.font_size * 1.4),  # 标题字体稍大
+                color="#FF6600",  # 亮金色文字，更醒目
+                stroke_color="#FFFFFF",  # 白色描边，增强对比度
+                stroke_width=self.stroke_width,  # 加粗描边
+                method='caption',
+                size=(text_area_width, None)
+            ).with_duration(slide["duration"])
             
-            # 确保图片尺寸完全匹配视频尺寸
-            if img_clip.w != self.video_size[0] or img_clip.h != self.video_size[1]:
-                img_clip = img_clip.resized(self.video_size)
+            # 创建半透明深色背景，增强对比度
+            title_bg = ColorClip(
+                size=(title_text_clip.w + self.bg_padding * 2, title_text_clip.h + self.bg_padding * 2),
+                color=(20, 20, 20),  # 深灰色背景，比纯黑更柔和
+                duration=slide["duration"]
+            ).with_opacity(0.8)  # 稍微提高不透明度，使背景更明显
             
-            # 创建文字剪辑
-            title = slide.get("title", "")
-            subtitle = slide.get("subtitle", "")
+            # 将文字叠加在背景上
+            title_composite = CompositeVideoClip([
+                title_bg.with_position(("center", "center")),
+                title_text_clip.with_position(("center", "center"))
+            ], size=(title_bg.w, title_bg.h))
             
-            clips_to_composite = [img_clip]
+            # 标题位置：水平居中，距离顶部有一定边距
+            title_composite = title_composite.with_position(("center", 30))
+            clips_to_composite.append(title_composite)
+        
+        # 如果存在subtitle，显示在底部
+        if subtitle:
+            formatted_subtitle = self._format_text_for_display(subtitle)
+            subtitle_text_clip = TextClip(
+                text=formatted_subtitle,
+                font=self.font_path,
+                font_size=self.font_size,
+                color="#FFFFFF",  # 白色文字
+                stroke_color="#000000",  # 黑色描边
+                stroke_width=self.stroke_width,  # 使用配置的描边宽度
+                method='caption',  # 使用caption方法支持自动换行
+                size=(text_area_width, None)  # 指定宽度，高度自动计算
+            ).with_duration(slide["duration"])
             
-            # 文本区域宽度（留出左右边距）
-            text_area_width = self.video_size[0] - 100  # 左右各留50像素边距
+            # 创建半透明背景
+            subtitle_bg = ColorClip(
+                size=(subtitle_text_clip.w + self.bg_padding * 2, subtitle_text_clip.h + self.bg_padding * 2),
+                color=(0, 0, 0),  # 黑色背景
+                duration=slide["duration"]
+            ).with_opacity(self.bg_opacity)  # 半透明背景
             
-            # 如果存在title，显示在顶部
-            if title:
-                formatted_title = self._format_text_for_display(title)
-                title_text_clip = TextClip(
-                    text=formatted_title,
-                    font=self.font_path,
-                    font_size=int(self.font_size * 1.4),  # 标题字体稍大
-                    color="#FF6600",  # 亮金色文字，更醒目
-                    stroke_color="#FFFFFF",  # 白色描边，增强对比度
-                    stroke_width=self.stroke_width,  # 加粗描边
-                    method='caption',
-                    size=(text_area_width, None)
-                ).with_duration(slide["duration"])
-                
-                # 创建半透明深色背景，增强对比度
-                title_bg = ColorClip(
-                    size=(title_text_clip.w + self.bg_padding * 2, title_text_clip.h + self.bg_padding * 2),
-                    color=(20, 20, 20),  # 深灰色背景，比纯黑更柔和
-                    duration=slide["duration"]
-                ).with_opacity(0.8)  # 稍微提高不透明度，使背景更明显
-                
-                # 将文字叠加在背景上
-                title_composite = CompositeVideoClip([
-                    title_bg.with_position(("center", "center")),
-                    title_text_clip.with_position(("center", "center"))
-                ], size=(title_bg.w, title_bg.h))
-                
-                # 标题位置：水平居中，距离顶部有一定边距
-                title_composite = title_composite.with_position(("center", 30))
-                clips_to_composite.append(title_composite)
+            # 将文字叠加在背景上
+            subtitle_composite = CompositeVideoClip([
+                subtitle_bg.with_position(("center", "center")),
+                subtitle_text_clip.with_position(("center", "center"))
+            ], size=(subtitle_bg.w, subtitle_bg.h))
             
-            # 如果存在subtitle，显示在底部
-            if subtitle:
-                formatted_subtitle = self._format_text_for_display(subtitle)
-                subtitle_text_clip = TextClip(
-                    text=formatted_subtitle,
-                    font=self.font_path,
-                    font_size=self.font_size,
-                    color="#FFFFFF",  # 白色文字
-                    stroke_color="#000000",  # 黑色描边
-                    stroke_width=self.stroke_width,  # 使用配置的描边宽度
-                    method='caption',  # 使用caption方法支持自动换行
-                    size=(text_area_width, None)  # 指定宽度，高度自动计算
-                ).with_duration(slide["duration"])
-                
-                # 创建半透明背景
-                subtitle_bg = ColorClip(
-                    size=(subtitle_text_clip.w + self.bg_padding * 2, subtitle_text_clip.h + self.bg_padding * 2),
-                    color=(0, 0, 0),  # 黑色背景
-                    duration=slide["duration"]
-                ).with_opacity(self.bg_opacity)  # 半透明背景
-                
-                # 将文字叠加在背景上
-                subtitle_composite = CompositeVideoClip([
-                    subtitle_bg.with_position(("center", "center")),
-                    subtitle_text_clip.with_position(("center", "center"))
-                ], size=(subtitle_bg.w, subtitle_bg.h))
-                
-                # 字幕位置：水平居中，距离底部有一定边距
-                bottom_margin = 30
-                # 计算底部位置（需要先获取clip的高度）
-                bottom_y = self.video_size[1] - subtitle_composite.h - bottom_margin
-                subtitle_composite = subtitle_composite.with_position(("center", bottom_y))
-                clips_to_composite.append(subtitle_composite)
+            # 字幕位置：水平居中，距离底部有一定边距
+            bottom_margin = 30
+            # 计算底部位置（需要先获取clip的高度）
+            bottom_y = self.video_size[1] - subtitle_composite.h - bottom_margin
+            subtitle_composite = subtitle_composite.with_position(("center", bottom_y))
+            clips_to_composite.append(subtitle_composite)
+        
+        # 明确指定尺寸以确保所有clip尺寸一致
+        return CompositeVideoClip(clips_to_composite, size=self.video_size)
+    
+    def _get_overlay_cache(self):
+        if self._overlay_cache is None:
+            self._overlay_cache = OverlayCache(use_disk=self.use_cache)
+        return self._overlay_cache
+    
+    def _title_overlay(self, title):
+        """获取标题叠加层（样式与MoviePy渲染方式一致）"""
+        return self._get_overlay_cache().get(
+            self._format_text_for_display(title),
+            font_path=self.font_path,
+            font_size=int(self.font_size * 1.4),  # 标题字体稍大
+            color="#FF6600",  # 亮金色文字，更醒目
+            stroke_color="#FFFFFF",  # 白色描边，增强对比度
+            stroke_width=self.stroke_width,
+            bg_color=(20, 20, 20),  # 深灰色背景，比纯黑更柔和
+            bg_opacity=0.8,
+            padding=self.bg_padding,
+            width=self.video_size[0] - 100  # 左右各留50像素边距
+        )
+    
+    def _subtitle_overlay(self, subtitle):
+        """获取字幕叠加层（样式与MoviePy渲染方式一致）"""
+        return self._get_overlay_cache().get(
+            self._format_text_for_display(subtitle),
+            font_path=self.font_path,
+            font_size=self.font_size,
+            color="#FFFFFF",  # 白色文字
+            stroke_color="#000000",  # 黑色描边
+            stroke_width=self.stroke_width,
+            bg_color=(0, 0, 0),  # 黑色背景
+            bg_opacity=self.bg_opacity,
+            padding=self.bg_padding,
+            width=self.video_size[0] - 100  # 左右各留50像素边距
+        )
+    
+    def render_slide_frame(self, slide):
+        """
+        把一张幻灯片的画面压平为一帧RGB图像
+        
+        幻灯片内容都是静止的，只需取图片的第0帧，再叠加缓存的标题和字幕位图，不经过MoviePy的文字渲染和合成
+        
+        参数:
+            slide: 幻灯片，包含 image, title, subtitle, duration
+        
+        返回:
+            numpy.ndarray: 形状为 (高, 宽, 3) 的RGB图像
+        """
+        with Image.open(normalize_image(slide["image"], self.video_size)) as image:
+            frame = np.array(image.convert('RGB'))
+        
+        # 标题：水平居中，距离顶部有一定边距
+        title = slide.get("title", "")
+        if title:
+            overlay = self._title_overlay(title)
+            blend_overlay(frame, overlay, (self.video_size[0] - overlay.shape[1]) // 2, 30)
+        
+        # 字幕：水平居中，距离底部有一定边距
+        subtitle = slide.get("subtitle", "")
+        if subtitle:
+            overlay = self._subtitle_overlay(subtitle)
+            bottom_margin = 30
+            bottom_y = self.video_size[1] - overlay.shape[0] - bottom_margin
+            blend_overlay(frame, overlay, (self.video_size[0] - overlay.shape[1]) // 2, bottom_y)
+        
+        return frame
+    
+    def _encoder_args(self):
+        """
+        片段的视频编码参数，所有片段必须一致才能无损拼接
+        
+        返回:
+            list: ffmpeg输出编码参数
+        """
+        return ffmpeg_video_args(self.encoding_profile, self.fps)
+    
+    def _slide_boundaries(self, slides):
+        """
+        计算各张幻灯片在视频中的起止帧号
+        
+        按累计时长换算并取整到帧，每张幻灯片至少一帧；画面片段和旁白音轨使用同一组边界，
+        幻灯片再多也不会出现音画逐渐错位。
+        
+        参数:
+            slides: 幻灯片列表
+        
+        返回:
+            list: 长度为幻灯片数加1的帧号列表，第i张幻灯片占用 [boundaries[i], boundaries[i+1]) 帧
+        """
+        boundaries = [0]
+        elapsed = 0.0
+        for slide in slides:
+            elapsed += slide["duration"]
+            boundaries.append(max(boundaries[-1] + 1, round(elapsed * self.fps)))
+        return boundaries
+    
+    def _build_narration(self, slides, boundaries, output_file):
+        """
+        把各张幻灯片的语音拼接为与画面帧边界对齐的旁白音轨
+        
+        参数:
+            slides: 幻灯片列表
+            boundaries: _slide_boundaries返回的帧号列表
+            output_file: 输出WAV文件路径
+        
+        返回:
+            str: 输出WAV文件路径
+        """
+        with metrics.timer('render_step', step='narration'):
+            build_narration_track(
+                [slide["audio"] for slide in slides], output_file,
+                boundaries=[frame / self.fps for frame in boundaries]
+            )
+        return output_file
+    
+    def _encode_still_segment(self, frame_path, frames, segment_file):
+        """
+        把一帧静态画面编码为指定帧数的无音频视频片段
+        
+        参数:
+            frame_path: 画面图片路径
+            frames: 片段帧数
+            segment_file: 输出片段路径
+        """
+        run_ffmpeg([
+            '-loop', '1', '-framerate', str(self.fps), '-i', frame_path,
+        ] + self._encoder_args() + [
+            '-threads', str(self.encoding_profile['threads'] or self.encoder_threads),
+            '-frames:v', str(frames), '-an',
+            segment_file
+        ])
+    
+    def _segment_cache_key(self, slide, frames):
+        """
+        计算幻灯片片段的缓存键：图片内容、标题、字幕、帧数、字体、尺寸与样式以及编码参数
+        
+        片段不含音频，只修改语音而时长不变时片段仍可复用。
+        
+        参数:
+            slide: 幻灯片
+            frames: 片段帧数
+        
+        返回:
+            str: 缓存键
+        """
+        try:
+            font_stat = os.stat(self.font_path)
+            font_signature = (font_stat.st_size, font_stat.st_mtime_ns)
+        except OSError:
+            font_signature = None
+        return make_cache_key(
+            SEGMENT_VERSION, OVERLAY_VERSION,
+            hash_file(slide["image"]),
+            slide.get("title", ""), slide.get("subtitle", ""), frames,
+            self.font_path, font_signature, self.font_size, self.stroke_width,
+            self.bg_opacity, self.bg_padding, list(self.video_size),
+            self._encoder_args()
+        )
+    
+    def create_video(self, slides, output_file):
+        """
+        创建视频
+        
+        参数:
+            slides: 幻灯片列表，每个元素包含 image, audio, text, duration
+            output_file: 输出视频文件路径
+        
+        返回:
+            str: 输出视频文件路径
+        """
+        if self.render_mode == "moviepy":
+            return self._create_video_moviepy(slides, output_file)
+        return self._create_video_static(slides, output_file)
+    
+    def _render_slide_segment(self, slide, frames, index, total, work_dir):
+        """
+        渲染一张幻灯片的无音频视频片段（可在子进程中执行）
+        
+        参数:
+            slide: 幻灯片
+            frames: 片段帧数
+            index: 幻灯片下标
+            total: 幻灯片总数
+            work_dir: 片段输出目录
+        
+        返回:
+            str: 片段文件路径
+        """
+        print(f"\n处理第 {index + 1}/{total} 张幻灯片...")
+        
+        frame_path = os.path.join(work_dir, f"frame_{index + 1}.png")
+        with metrics.timer('render_step', step='compose'):
+            Image.fromarray(self.render_slide_frame(slide)).save(frame_path)
+        
+        segment_file = os.path.join(work_dir, f"segment_{index + 1}.mp4")
+        with metrics.timer('render_step', step='encode'):
+            self._encode_still_segment(frame_path, frames, segment_file)
+        metrics.record_bytes('segment', segment_file)
+        os.remove(frame_path)
+        return segment_file
+    
+    def _render_slide_segment_in_worker(self, slide, frames, index, total, work_dir):
+        """在子进程中渲染片段，并把子进程中记录的指标一起返回"""
+        segment_file = self._render_slide_segment(slide, frames, index, total, work_dir)
+        return segment_file, metrics.drain()
+    
+    def _create_video_static(self, slides, output_file):
+        """
+        静态幻灯片快速渲染：每张幻灯片只合成一帧，用ffmpeg把该帧编码为无音频片段，
+        最后无损拼接片段，并在同一步中封装按帧边界拼好的旁白音轨
+        
+        各片段使用相同的编码参数，在进程池中并行渲染，渲染耗时与幻灯片时长和帧率基本无关，并随CPU核数扩展；
+        旁白音轨在主进程中与片段渲染同时拼接。
+        启用缓存时片段按输入内容的哈希保存，再次运行只重新编码内容有变化的幻灯片。
+        
+        参数:
+            slides: 幻灯片列表
+            output_file: 输出视频文件路径
+        
+        返回:
+            str: 输出视频文件路径
+        """
+        segment_cache = None
+        if self.use_cache:
+            segment_cache = DiskCache(
+                Config.SEGMENT_CACHE_DIR,
+                max_bytes=Config.SEGMENT_CACHE_MAX_MB * 1024 * 1024,
+                suffix='.mp4'
+            )
+        
+        boundaries = self._slide_boundaries(slides)
+        frames = [end - start for start, end in zip(boundaries, boundaries[1:])]
+        
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        work_dir = tempfile.mkdtemp(prefix="segments_", dir=output_dir)
+        narration_file = os.path.join(work_dir, "narration.wav")
+        try:
+            # 先查缓存，只渲染未命中的幻灯片。命中的片段硬链接（或复制）到工作目录，
+            # 之后写入新片段触发的淘汰即使删除了缓存中的条目，拼接时也仍然可用
+            segment_files = [None] * len(slides)
+            cache_keys = [None] * len(slides)
+            pending = []
+            for index, slide in enumerate(slides):
+                if segment_cache is not None:
+                    cache_keys[index] = self._segment_cache_key(slide, frames[index])
+                    segment_files[index] = segment_cache.link_to(
+                        cache_keys[index], os.path.join(work_dir, f"cached_segment_{index + 1}.mp4")
+                    )
+                if segment_files[index]:
+                    print(f"[视频生成] 第 {index + 1}/{len(slides)} 张幻灯片未变化，复用已渲染的片段")
+                else:
+                    pending.append(index)
             
-            # 加载音频剪辑
-            audio_clip = AudioFileClip(slide["audio"])
+            workers = max(1, min(self.render_workers, len(pending)))
+            self.encoder_threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else 0
+            if workers == 1:
+                rendered = [
+                    self._render_slide_segment(slides[index], frames[index], index, len(slides), work_dir)
+                    for index in pending
+                ]
+                self._build_narration(slides, boundaries, narration_file)
+            else:
+                print(f"[视频生成] 使用 {workers} 个进程并行渲染 {len(pending)} 张幻灯片")
+                # 用spawn启动子进程：批量运行时其他线程可能正持有指标等模块中的锁，fork出的子进程会继承
+                # 已加锁的锁而永久阻塞。spawn的子进程从空的指标开始，每个任务只带回自己记录的部分
+                mp_context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+                    futures = [
+                        executor.submit(
+                            self._render_slide_segment_in_worker,
+                            slides[index], frames[index], index, len(slides), work_dir
+                        )
+                        for index in pending
+                    ]
+                    # 子进程渲染片段的同时拼接旁白音轨
+                    self._build_narration(slides, boundaries, narration_file)
+                    rendered = []
+                    for future in futures:
+                        segment_file, worker_metrics = future.result()
+                        metrics.merge(worker_metrics)
+                        rendered.append(segment_file)
             
-            # 合成视频：图片 + 顶部文字 + 底部文字 + 语音
-            # 明确指定尺寸以确保所有clip尺寸一致
-            video_clip = CompositeVideoClip(clips_to_composite, size=self.video_size)
-            video_clip = video_clip.with_audio(audio_clip)
+            for index, segment_file in zip(pending, rendered):
+                if segment_cache is not None:
+                    # 拼接使用工作目录中的片段，缓存中的副本随时可能被淘汰
+                    segment_cache.put_file(cache_keys[index], segment_file)
+                segment_files[index] = segment_file
             
-            clips_with_text.append(video_clip)
+            # 拼接所有片段并封装旁白音轨
+            print("\n正在合成最终视频...")
+            print(f"正在保存视频到: {output_file}")
+            with metrics.timer('render_step', step='concat'):
+                concat_segments(
+                    segment_files, output_file,
+                    audio_file=narration_file, audio_args=ffmpeg_audio_args(self.encoding_profile)
+                )
+            metrics.record_bytes('video', output_file)
+        finally:
+            # 清理临时片段
+            shutil.rmtree(work_dir, ignore_errors=True)
         
-        # 拼接所有剪辑
-        print("\n正在合成最终视频...")
-        final_clip = concatenate_videoclips(clips_with_text, method="compose")
+        print(f"\n[视频生成] 视频已保存到: {output_file}")
+        return output_file
+    
+    def _create_video_moviepy(self, slides, output_file):
+        """
+        由MoviePy逐帧合成画面，流式交给ffmpeg编码为无音频视频，再封装旁白音轨
         
-        # 输出视频
-        print(f"正在保存视频到: {output_file}")
-        final_clip.write_videofile(output_file, fps=self.fps)
+        同一时间只加载当前幻灯片的图片和文字剪辑，合成出的帧立即写入ffmpeg管道，
+        幻灯片写完即释放，峰值内存与幻灯片数量无关。
+        音频不经过MoviePy：各段语音按与画面相同的帧边界拼接为一条旁白音轨，编码完成后直接封装。
         
-        # 清理资源
-        final_clip.close()
-        for clip in clips_with_text:
-            clip.close()
+        参数:
+            slides: 幻灯片列表
+            output_file: 输出视频文件路径
+        
+        返回:
+            str: 输出视频文件路径
+        """
+        boundaries = self._slide_boundaries(slides)
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        work_dir = tempfile.mkdtemp(prefix="render_", dir=output_dir)
+        try:
+            narration_file = self._build_narration(slides, boundaries, os.path.join(work_dir, "narration.wav"))
+            
+            print(f"正在保存视频到: {output_file}")
+            video_file = os.path.join(work_dir, "video.mp4")
+            with metrics.timer('render_step', step='encode'), RawVideoWriter(
+                video_file, self.video_size, self.fps, self._encoder_args(), threads=self.encoding_profile['threads']
+            ) as writer:
+                for index, slide in enumerate(slides):
+                    print(f"\n处理第 {index + 1}/{len(slides)} 张幻灯片...")
+                    
+                    # 合成画面：图片 + 顶部文字 + 底部文字，时长取整到帧边界
+                    frames = boundaries[index + 1] - boundaries[index]
+                    with metrics.timer('render_step', step='compose'):
+                        video_clip = self._compose_slide(dict(slide, duration=frames / self.fps))
+                    try:
+                        for n in range(frames):
+                            frame = video_clip.get_frame(n / self.fps)
+                            writer.write_frame(np.clip(frame[:, :, :3], 0, 255).astype(np.uint8))
+                    finally:
+                        # 释放本张幻灯片的图片和文字剪辑
+                        video_clip.close()
+                        video_clip = None
+            
+            print("\n正在合成最终视频...")
+            with metrics.timer('render_step', step='mux'):
+                mux_audio(video_file, narration_file, output_file, ffmpeg_audio_args(self.encoding_profile))
+            metrics.record_bytes('video', output_file)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
         
         print(f"\n[视频生成] 视频已保存到: {output_file}")
         return output_file
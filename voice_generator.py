@@ -1,11 +1,18 @@
 # Azure Speech Service: https://learn.microsoft.com/azure/ai-services/speech-service/
 
 import os
-import azure.cognitiveservices.speech as speechsdk
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from cache import IndexedDiskCache, make_cache_key
+from rate_limit import get_guard
+from tts_providers import AzureTTSProvider, TTSRouter, _check_azure_config, _check_result, _create_speech_config
+import metrics
+from utils import calculate_audio_duration
 
 
-def text_to_speech(text, output_file, voice_name=None):
+def text_to_speech(text, output_file, voice_name=None, pool=None):
     """
     使用Azure语音服务将文本转换为语音并保存到文件
     
@@ -13,26 +20,29 @@ def text_to_speech(text, output_file, voice_name=None):
         text: 要转换的文本
         output_file: 输出的音频文件路径
         voice_name: 使用的语音名称，默认为配置中的AZURE_SPEECH_VOICE
+        pool: 可选的tts_providers.SynthesizerPool，提供时复用池中的合成器，voice_name以池的配置为准
     
     返回:
         output_file: 保存的音频文件路径
     """
-    if not Config.AZURE_SPEECH_KEY or not Config.AZURE_SPEECH_REGION:
-        raise ValueError("Azure语音服务配置不完整，请检查.env文件中的AZURE_SPEECH_KEY和AZURE_SPEECH_REGION")
+    import azure.cognitiveservices.speech as speechsdk
+    
+    provider = AzureTTSProvider.name
+    guard = get_guard(provider)
+    if pool is not None:
+        with metrics.timer('provider_call', provider=provider, call='tts'):
+            guard.call(pool.synthesize, text, output_file)
+        metrics.record_bytes('audio', output_file)
+        print(f'[Azure TTS] 音频已保存到: {output_file}')
+        return output_file
+    
+    _check_azure_config()
     
     # 确保输出目录存在
     os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else '.', exist_ok=True)
     
     # 配置Azure语音服务
-    speech_config = speechsdk.SpeechConfig(
-        subscription=Config.AZURE_SPEECH_KEY,
-        region=Config.AZURE_SPEECH_REGION
-    )
-    
-    # 设置语音名称
-    if voice_name is None:
-        voice_name = Config.AZURE_SPEECH_VOICE
-    speech_config.speech_synthesis_voice_name = voice_name
+    speech_config = _create_speech_config(voice_name)
     
     # 配置音频输出
     audio_config = speechsdk.audio.AudioOutputConfig(filename=output_file)
@@ -43,32 +53,123 @@ def text_to_speech(text, output_file, voice_name=None):
         audio_config=audio_config
     )
     
-    # 执行语音合成
-    result = synthesizer.speak_text_async(text).get()
+    # 执行语音合成并检查结果
+    def synthesize():
+        _check_result(synthesizer.speak_text_async(text).get())
     
-    # 检查结果
-    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-        print(f'[Azure TTS] 音频已保存到: {output_file}')
-        return output_file
-    elif result.reason == speechsdk.ResultReason.Canceled:
-        cancellation_details = speechsdk.CancellationDetails(result)
-        error_msg = f"语音合成被取消: {cancellation_details.reason}"
-        if cancellation_details.reason == speechsdk.CancellationReason.Error:
-            error_msg += f"\n错误详情: {cancellation_details.error_details}"
-        raise Exception(error_msg)
-    else:
-        raise Exception(f"语音合成失败: {result.reason}")
+    with metrics.timer('provider_call', provider=provider, call='tts'):
+        guard.call(synthesize)
+    metrics.record_bytes('audio', output_file)
+    print(f'[Azure TTS] 音频已保存到: {output_file}')
+    return output_file
+
+
+def normalize_tts_text(text):
+    """
+    规范化待合成文本，用于生成语音缓存键
+    
+    参数:
+        text: 原始文本
+    
+    返回:
+        str: 全半角统一、去除首尾空白并合并连续空白后的文本
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def create_audio_cache():
+    """
+    创建跨项目共享的语音缓存
+    
+    返回:
+        IndexedDiskCache: 语音缓存，条目附加信息中记录音频时长
+    """
+    return IndexedDiskCache(
+        Config.AUDIO_CACHE_DIR,
+        max_bytes=Config.AUDIO_CACHE_MAX_MB * 1024 * 1024,
+        suffix='.wav'
+    )
+
+
+class VoiceGenerator:
+    """
+    语音生成器
+    
+    持有一次运行内共享的语音缓存和语音合成服务商，服务商在第一次缓存未命中时才创建。
+    所有段都由TTSRouter的当前服务商合成，缓存也只查找当前服务商和语音对应的条目，
+    其他服务商或其他音色缓存的语音不会混入同一条旁白。
+    """
+    
+    def __init__(self, voice_name=None, max_workers=None, use_cache=True):
+        """
+        初始化语音生成器
+        
+        参数:
+            voice_name: 语音名称，默认为配置中的AZURE_SPEECH_VOICE
+            max_workers: 每个服务商同时进行的合成数（Azure的合成器池大小），默认为配置中的TTS_MAX_WORKERS
+            use_cache: 是否使用跨项目共享的语音缓存
+        """
+        self.voice_name = voice_name
+        self.max_workers = max_workers if max_workers is not None else Config.TTS_MAX_WORKERS
+        self.cache = create_audio_cache() if use_cache else None
+        self.router = TTSRouter(voice_name=voice_name, size=self.max_workers)
+    
+    def generate_audio(self, text, audio_file):
+        """
+        生成一段语音，优先从缓存获取
+        
+        参数:
+            text: 要转换的文本
+            audio_file: 输出的音频文件路径
+        
+        返回:
+            tuple: (音频文件路径, 时长)，缓存中没有时长记录时时长为None
+        """
+        normalized = normalize_tts_text(text)
+        if self.cache is not None:
+            provider_name, voice = self.router.current()
+            cache_key = make_cache_key(provider_name, voice, normalized)
+            if self.cache.link_to(cache_key, audio_file):
+                duration = (self.cache.get_meta(cache_key) or {}).get('duration')
+                print(f"[语音生成] 命中缓存，音频已保存到: {audio_file}")
+                return audio_file, duration
+        
+        _, provider = self.router.synthesize(text, audio_file)
+        metrics.record_bytes('audio', audio_file)
+        print(f'[语音生成] {provider.name} 音频已保存到: {audio_file}')
+        
+        duration = None
+        if self.cache is not None:
+            # 合成后立即测量时长并随音频一起缓存，下次命中时无需再测量
+            duration = calculate_audio_duration(audio_file) or None
+            self.cache.put_file(make_cache_key(provider.name, provider.voice, normalized), audio_file, meta={
+                'provider': provider.name,
+                'voice': provider.voice,
+                'duration': duration
+            })
+        return audio_file, duration
+    
+    def close(self):
+        """关闭各服务商的连接"""
+        self.router.close()
 
 
-def generate_audio_for_items(items, voice_name, audio_dir):
+def generate_audio_for_items(items, voice_name, audio_dir, max_workers=None, use_cache=True):
     """
     为items生成语音，基于subtitle字段
     
+    相同语音、相同服务商和规范化后相同字幕的语音直接从缓存链接，并同时写回缓存中记录的时长，
+    其余各段按items顺序提交，在不超过max_workers的并发下复用同一组语音合成服务商完成合成。
+    
     参数:
         items: 项目列表，每个项目包含 subtitle 字段
         voice_name: 语音名称（从input配置中获取）
         audio_dir: 音频文件保存目录
+        max_workers: 最大并发数，默认为配置中的TTS_MAX_WORKERS
+        use_cache: 是否使用跨项目共享的语音缓存
     """
+    tasks = []
     for i, item in enumerate(items):
         # 如果已有audio，跳过
         if item.get('audio'):
@@ -81,16 +182,41 @@ def generate_audio_for_items(items, voice_name, audio_dir):
             print(f"[警告] 第 {i+1} 项缺少subtitle，跳过语音生成")
             continue
         
-        audio_file = os.path.join(audio_dir, f"audio_{i+1}.mp3")
-        
+        audio_file = os.path.join(audio_dir, f"audio_{i+1}.wav")
+        tasks.append((i, subtitle, audio_file))
+    
+    if not tasks:
+        return
+    
+    if max_workers is None:
+        max_workers = Config.TTS_MAX_WORKERS
+    max_workers = max(1, min(max_workers, len(tasks)))
+    
+    voice_gen = VoiceGenerator(voice_name=voice_name, max_workers=max_workers, use_cache=use_cache)
+    
+    def synthesize(i, subtitle, audio_file):
         try:
-            # 生成语音
-            text_to_speech(subtitle, audio_file, voice_name=voice_name)
-            item['audio'] = audio_file
+            result = voice_gen.generate_audio(subtitle, audio_file)
             print(f"[语音生成] 第 {i+1}/{len(items)} 段语音已生成")
+            return result
         except Exception as e:
             print(f"[错误] 生成第 {i+1} 段语音失败: {e}")
-            continue
+            return None, None
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (i, executor.submit(synthesize, i, subtitle, audio_file))
+                for i, subtitle, audio_file in tasks
+            ]
+            for i, future in futures:
+                audio_file, duration = future.result()
+                if audio_file:
+                    items[i]['audio'] = audio_file
+                    if duration:
+                        items[i]['duration'] = duration
+    finally:
+        voice_gen.close()
 
 
 if __name__ == "__main__":